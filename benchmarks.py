@@ -0,0 +1,320 @@
+import random
+import re
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+
+from tabulate import tabulate
+
+from typing import List, Any, Dict, Tuple, Callable, Union
+
+import encodingCommon as enc
+import variantGrouping
+
+# Benchmarks for the sort keys and the list grouping, with the implementations they replaced as the reference.
+# These stay out of the modules the listing uses, the tests check the new versions against them.
+#
+#   python benchmarks.py sort|group [--count N]
+
+_video_exts = ['.mp4', '.mov', '.ts', '.avi', '.mkv', '.wmv', '.m4v', '.mpg', '.flv', '.webm']
+_rx_num_delim = re.compile(r'([^\d]|\d+)')
+
+
+# Token at a time sort keys the weight tables in encodingCommon replaced
+def windows_file_sort_keys_reference(key: str) -> List:
+    if not key:
+        return [enc._max_neg]
+
+    m = _rx_num_delim.findall(key.casefold())
+    if m:
+        i = 0
+
+        while i < len(m):
+            if m[i].isdigit():
+                m[i] = enc._windows_sort_num_offset + int(m[i])
+            else:
+                v = enc._windows_sort_pos.get(m[i])
+
+                if v == 0:
+                    i += 1
+                    continue
+                elif v:
+                    m[i] = v
+                else:
+                    m[i] = ord(m[i])
+            i += 1
+        return m
+    else:
+        return [key]
+
+
+def dblcmd_file_sort_keys_reference(key: str, is_file: bool) -> Tuple:
+    if not key:
+        return (enc._max_neg,)
+
+    if is_file:
+        key_suffix = Path(key).suffix
+        key_stem = key[:-len(key_suffix)] if key_suffix and key.endswith(key_suffix) else key
+    else:
+        key_suffix = ''
+        key_stem = key
+
+    res: List[Union[str, int]] = []
+
+    m: List[str] = _rx_num_delim.findall(key_stem.casefold())
+    if m:
+        dblcmd_file_sort_key_parts(m, res)
+
+        res.append(enc._max_neg)
+
+        if key_suffix:
+            dblcmd_file_sort_key_parts(_rx_num_delim.findall(key_suffix.casefold()), res)
+
+        return tuple(res)
+    else:
+        return (key,)
+
+
+def dblcmd_file_sort_key_parts(m: List[str], res: List[Union[str, int]]):
+    i = 0
+
+    while i < len(m):
+        if m[i] == '_':
+            undc = 0
+            num = False
+            follow = None
+            i += 1
+
+            while i < len(m):
+                if m[i] == '_':
+                    undc += 1
+                elif m[i].isdigit():
+                    i -= 1
+                    num = True
+                    break
+                elif m[i] in enc._dblcmd_sort_dunder_pre_alpha:
+                    follow = enc._dblcmd_sort_pos[m[i]] - enc._max_neg
+                    i -= 1
+                    break
+                else:
+                    i -= 1
+                    break
+                i += 1
+
+            res.append(enc._dblcmd_sort_dunder_offset)
+            if num:
+                res.append(enc._dblcmd_sort_dunder_offset)
+                res.append(undc)
+                res.append(0)
+            elif follow:
+                res.append(enc._dblcmd_sort_dunder_offset)
+                res.append(undc)
+                res.append(follow)
+            else:
+                res.append(enc._dblcmd_sort_dunder_offset + 1)
+                res.append(undc * -1)
+                res.append(0)
+        elif m[i].isdigit():
+            res.append(enc._dblcmd_sort_num_offset + int(m[i]))
+        else:
+            v = enc._dblcmd_sort_pos.get(m[i])
+
+            if v == 0:
+                i += 1
+                continue
+            elif v:
+                res.append(v)
+            else:
+                res.append(ord(m[i]))
+        i += 1
+
+
+def sort_bench_names(count: int) -> List[str]:
+    rnd = random.Random(count)
+    words = ['clip', 'Scene', 'part', 'IMG', 'vid', 'Straße', 'été', 'take', 'b-roll', 'cam']
+    seps = [' ', '_', '-', '.', '__', ' - ', '', '_-']
+    exts = _video_exts + ['.txt', '.json', '']
+    names = []
+
+    for i in range(count):
+        parts = []
+
+        for j in range(rnd.randint(1, 4)):
+            parts.append(rnd.choice(words))
+            parts.append(rnd.choice(seps))
+            parts.append(str(rnd.randint(0, 10 ** rnd.randint(1, 6))).zfill(rnd.choice([0, 2, 4])))
+
+        names.append(''.join(parts) + rnd.choice(exts))
+
+    return names
+
+
+def sort_bench(count: int = 50000) -> List[Dict[str, Any]]:
+    names = sort_bench_names(count)
+    benches = {
+        'windows': (windows_file_sort_keys_reference, enc.windows_file_sort_keys),
+        'dblcmd': (lambda k: dblcmd_file_sort_keys_reference(k, True), lambda k: enc.dblcmd_file_sort_keys(k, None, True)),
+        'dblcmd dirs': (lambda k: dblcmd_file_sort_keys_reference(k, False), lambda k: enc.dblcmd_file_sort_keys(k, None, False))
+    }
+    data = []
+
+    for (mode, (reference, compiled)) in benches.items():
+        start = time.perf_counter()
+        expected = sorted(names, key=reference)
+        reference_ms = (time.perf_counter() - start) * 1000
+
+        enc.sort_key_cache_clear()
+        start = time.perf_counter()
+        res = sorted(names, key=compiled)
+        cold_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        sorted(names, key=compiled)
+        warm_ms = (time.perf_counter() - start) * 1000
+
+        data.append({
+            'sorter': mode,
+            'names': len(names),
+            'reference ms': round(reference_ms, 1),
+            'cold ms': round(cold_ms, 1),
+            'warm ms': round(warm_ms, 1),
+            'speedup': f'{reference_ms / cold_ms:.1f}x',
+            'same order': 'yes' if res == expected else 'no'
+        })
+
+    return data
+
+
+# The incremental list grouping variantGrouping.group_variants replaced
+def group_variants_reference(rows: List[Dict[str, Any]], sort_rows: Callable[[List[Dict[str, Any]]], None]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    groupings: List[List[Any]] = []
+
+    for datum in rows:
+        if not groupings:
+            groupings.append([datum['_grp_enc'] or '', datum])
+        else:
+            prev_grouping = groupings[-1]
+
+            if datum['_grp_enc']:
+                grouping = []
+
+                if prev_grouping[0] == '':
+                    while True:
+                        if isinstance(prev_grouping[-1], str):
+                            prev_grouping.pop()
+                            break
+                        elif prev_grouping[-1]['_grp_res'] and prev_grouping[-1]['_grp_res'].startswith(datum['_grp_enc']):
+                            prev_datum = prev_grouping.pop()
+                            prev_datum['_grp_enc'] = datum['_grp_enc']
+                            grouping.append(prev_datum)
+                        else:
+                            break
+
+                    sort_rows(grouping)
+
+                if not prev_grouping:
+                    groupings.pop()
+
+                grouping.insert(0, datum['_grp_enc'])
+                grouping.append(datum)
+                groupings.append(grouping)
+            else:
+                if not prev_grouping[0] or datum['_grp_res'].startswith(prev_grouping[0]):
+                    prev_grouping.append(datum)
+                else:
+                    groupings.append(['', datum])
+
+    return [(g[0], g[1:]) for g in groupings]
+
+
+# a folder of titles, each with some mix of a `~` source, its encodes and plain files, in dblcmd order like the
+# listing shows them
+def group_bench_names(count: int) -> List[str]:
+    rnd = random.Random(count)
+    words = ['clip', 'Scene', 'part', 'IMG', 'vid', 'take', 'cam', 'b-roll']
+    names = []
+
+    while len(names) < count:
+        title = f'{rnd.choice(words)}{rnd.choice([" ", "_", "-", ""])}{rnd.randint(0, 99999)}'
+        spans = rnd.randint(1, 3)
+
+        if rnd.random() < 0.6:
+            names.append(f'{title}~{" ".join(f"{i}:00-{i}:30" for i in range(spans))} [q{rnd.choice([28, 30, 32])}].mp4')
+        if rnd.random() < 0.6:
+            cq = rnd.choice([28, 30, 32])
+            names += [f'{title}-{i}-nvenc-cq{cq}.mp4' for i in range(spans)] if spans > 1 else [f'{title}-nvenc-cq{cq}.mp4']
+        if rnd.random() < 0.3:
+            names.append(f'{title}{rnd.choice(_video_exts)}')
+
+    names = names[:count]
+    names.sort(key=lambda n: enc.dblcmd_file_sort_keys(n, None, True))
+    return names
+
+
+def sort_rows(rows: List[Dict[str, Any]]):
+    rows.sort(key=lambda dt: enc.dblcmd_file_sort_keys(dt['path'], None))
+
+
+# fresh rows for a grouping run, the groupers mark rows up as they go
+def group_rows(names: List[str]) -> List[Dict[str, Any]]:
+    rows = []
+
+    for n in names:
+        (grp_enc, grp_res) = variantGrouping.group_keys(Path(n).stem)
+        rows.append({'path': n, '_grp_enc': grp_enc, '_grp_res': grp_res})
+
+    return rows
+
+
+# a grouping's (name, [(path, group)]), comparable between runs
+def group_result(groups: List[Tuple[str, List[Dict[str, Any]]]]) -> List[Tuple[str, List[Tuple[str, str]]]]:
+    return [(name, [(dt['path'], dt['_grp_enc']) for dt in members]) for (name, members) in groups]
+
+
+def group_bench(count: int = 50000, runs: int = 5) -> List[Dict[str, Any]]:
+    names = group_bench_names(count)
+    benches = {'reference': group_variants_reference, 'single pass': variantGrouping.group_variants}
+    results = {}
+    data = []
+
+    for (name, grouper) in benches.items():
+        times = []
+
+        for i in range(runs):
+            rows = group_rows(names)
+            start = time.perf_counter()
+            groups = grouper(rows, sort_rows)
+            times.append((time.perf_counter() - start) * 1000)
+
+        results[name] = group_result(groups)
+
+        data.append({
+            'grouping': name,
+            'files': len(names),
+            'groups': len(groups),
+            'min ms': round(min(times), 1),
+            'mean ms': round(sum(times) / len(times), 1),
+            'same output': 'yes' if results[name] == results['reference'] else 'no'
+        })
+
+    return data
+
+
+_benches = {
+    'sort': sort_bench,
+    'group': group_bench
+}
+
+if __name__ == '__main__':
+    ap = ArgumentParser()
+    ap.add_argument('bench', choices=_benches.keys(), help="What to benchmark against its reference implementation")
+    ap.add_argument('--count', type=int, default=50000, help="Synthetic file names to run on")
+    args = ap.parse_args()
+
+    data = _benches[args.bench](args.count)
+    print(tabulate(data, headers='keys'))
+
+    # a faster result that differs from the reference is a regression, whatever the timings say
+    if any(r.get('same order', r.get('same output')) != 'yes' for r in data):
+        sys.exit(1)
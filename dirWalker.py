@@ -0,0 +1,215 @@
+import os
+import pickle
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from dataclasses import dataclass
+from typing import Any, Collection, Dict, Iterator, List, Optional, Set, Tuple
+
+_index_version = 2
+
+
+@dataclass
+class DirListing:
+    path: Path
+    videos: List[Path]
+    configs: List[Path]
+    optFiles: List[Path]
+    subdirs: List[str]
+    linkedSubdirs: List[str]
+    fileCount: int
+    hasFiles: bool
+
+
+# one scandir pass per directory, each entry classified from its cached DirEntry type info
+def list_dir(path: Path, extensions: Collection[str]) -> DirListing:
+    videos = []
+    configs = []
+    opt_files = []
+    subdirs = []
+    linked_subdirs = []
+    file_count = 0
+    has_files = False
+
+    with os.scandir(path) as it:
+        for e in it:
+            name = e.name
+
+            # option markers are matched by name alone, same as globbing '_.*'
+            if name.startswith('_.'):
+                opt_files.append(path / name)
+
+            if e.is_dir():
+                subdirs.append(name)
+                if e.is_symlink():
+                    linked_subdirs.append(name)
+                continue
+
+            file_count += 1
+
+            if not e.is_file():
+                continue
+
+            has_files = True
+            ext = os.path.splitext(name)[1].lower()
+
+            if ext in extensions:
+                videos.append(path / name)
+            elif ext == '.json':
+                configs.append(path / name)
+
+    return DirListing(path, videos, configs, opt_files, subdirs, linked_subdirs, file_count, has_files)
+
+
+@dataclass
+class IndexEntry:
+    mtimeNs: int
+    listing: DirListing
+    configsSig: Optional[Tuple] = None
+    scan: Optional[bytes] = None
+
+
+# Persisted per-root map of directory -> listing (and the planner's results for it), reused while the
+# directory mtime is unchanged. In-place edits of a file don't touch the directory mtime, so they need --full.
+class DirIndex:
+    indexPath: Path
+    reused: int
+    rescanned: int
+    scansReused: int
+
+    def __init__(self, indexPath: Path, fingerprint: str, full: bool = False):
+        self.indexPath = indexPath
+        self.reused = 0
+        self.rescanned = 0
+        self.scansReused = 0
+        self._fingerprint = f'{_index_version}|{fingerprint}'
+        self._entries: Dict[Path, IndexEntry] = {}
+        self._fresh: Dict[Path, IndexEntry] = {}
+        self._unchanged: Set[Path] = set()
+        self._lock = threading.Lock()
+
+        if not full and indexPath.exists():
+            try:
+                with open(indexPath, 'rb') as f:
+                    (fp, entries) = pickle.load(f)
+
+                if fp == self._fingerprint:
+                    self._entries = entries
+            except Exception:
+                self._entries = {}
+
+    def listing(self, path: Path, extensions: Collection[str]) -> DirListing:
+        # stat before listing, so a change made mid-scan leaves an older mtime behind and is rescanned next time
+        mtime_ns = os.stat(path).st_mtime_ns
+
+        with self._lock:
+            e = self._entries.get(path)
+            reuse = e and e.mtimeNs == mtime_ns
+
+        if not reuse:
+            e = IndexEntry(mtime_ns, list_dir(path, extensions))
+
+        with self._lock:
+            if reuse:
+                self.reused += 1
+                self._unchanged.add(path)
+            else:
+                self.rescanned += 1
+
+            self._fresh[path] = e
+
+        return e.listing
+
+    def invalidate(self, path: Path):
+        self._entries.pop(path, None)
+        self._fresh.pop(path, None)
+        self._unchanged.discard(path)
+
+    def get_scan(self, path: Path, configsSig: Tuple) -> Optional[Any]:
+        e = self._fresh.get(path)
+
+        if path in self._unchanged and e.scan is not None and e.configsSig == configsSig:
+            self.scansReused += 1
+            return pickle.loads(e.scan)
+
+        return None
+
+    def put_scan(self, path: Path, configsSig: Tuple, scan: Any):
+        e = self._fresh.get(path)
+
+        if e:
+            e.configsSig = configsSig
+            e.scan = pickle.dumps(scan)
+
+    # only directories seen this run are written back, which drops deleted ones
+    def save(self):
+        os.makedirs(self.indexPath.parent, exist_ok=True)
+        tmp_path = self.indexPath.with_name(self.indexPath.name + '.tmp')
+
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((self._fingerprint, self._fresh), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, self.indexPath)
+
+
+# same top-down order as os.walk without followlinks, unreadable directories are skipped like os.walk does
+def walk(root: Path, extensions: Collection[str], index: DirIndex = None) -> Iterator[DirListing]:
+    stack = [root]
+
+    while stack:
+        path = stack.pop()
+
+        try:
+            listing = index.listing(path, extensions) if index else list_dir(path, extensions)
+        except OSError:
+            continue
+
+        yield listing
+        stack.extend(reversed([path / d for d in listing.subdirs if d not in listing.linkedSubdirs]))
+
+
+# Same listings in the same order as walk(), but directories are listed from a thread pool as soon as their
+# parent is known, which hides per-call latency on network mounts. Each task submits its children before
+# returning, so a child's future always exists by the time the consumer reaches it.
+def walk_parallel(root: Path, extensions: Collection[str], width: int, index: DirIndex = None) -> Iterator[DirListing]:
+    futures: Dict[Path, Future] = {}
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=width) as pool:
+        def list_task(path: Path) -> Optional[DirListing]:
+            try:
+                listing = index.listing(path, extensions) if index else list_dir(path, extensions)
+            except OSError:
+                return None
+
+            for d in listing.subdirs:
+                if d not in listing.linkedSubdirs:
+                    child = path / d
+                    try:
+                        with lock:
+                            futures[child] = pool.submit(list_task, child)
+                    except RuntimeError:
+                        # pool is shutting down because the consumer stopped early
+                        pass
+
+            return listing
+
+        with lock:
+            futures[root] = pool.submit(list_task, root)
+
+        stack = [root]
+
+        while stack:
+            path = stack.pop()
+
+            with lock:
+                future = futures.pop(path)
+
+            listing = future.result()
+
+            if listing is None:
+                continue
+
+            yield listing
+            stack.extend(reversed([path / d for d in listing.subdirs if d not in listing.linkedSubdirs]))
@@ -0,0 +1,208 @@
+import os
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+from pathlib import Path
+
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_watch_mask = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+_event_header = struct.Struct('iIII')
+_read_size = 64 * 1024
+
+_libc = None
+
+
+def _inotify_libc():
+    global _libc
+
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+
+        if not hasattr(_libc, 'inotify_init1'):
+            raise OSError('inotify is not available on this platform')
+
+    return _libc
+
+
+# thin ctypes binding, one watch per directory since inotify isn't recursive
+class Inotify:
+    fd: int
+
+    def __init__(self):
+        libc = _inotify_libc()
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+        self._paths: Dict[int, Path] = {}
+        self._wds: Dict[Path, int] = {}
+
+    def add(self, path: Path):
+        if path in self._wds:
+            return
+
+        wd = _inotify_libc().inotify_add_watch(self.fd, os.fsencode(path), _watch_mask)
+
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), str(path))
+
+        self._paths[wd] = path
+        self._wds[path] = wd
+
+    def remove(self, path: Path):
+        wd = self._wds.pop(path, None)
+
+        if wd is not None:
+            self._paths.pop(wd, None)
+            _inotify_libc().inotify_rm_watch(self.fd, wd)
+
+    def watched(self) -> List[Path]:
+        return list(self._wds.keys())
+
+    def read(self, timeout: Optional[float]) -> List[Tuple[Optional[Path], str, int]]:
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+
+        if not ready:
+            return []
+
+        try:
+            data = os.read(self.fd, _read_size)
+        except BlockingIOError:
+            return []
+
+        events = []
+        pos = 0
+
+        while pos + _event_header.size <= len(data):
+            (wd, mask, cookie, name_len) = _event_header.unpack_from(data, pos)
+            pos += _event_header.size
+            name = os.fsdecode(data[pos:pos + name_len].rstrip(b'\0'))
+            pos += name_len
+            path = self._paths.get(wd)
+
+            # the kernel already dropped the watch
+            if mask & IN_IGNORED:
+                if path is not None:
+                    self._paths.pop(wd, None)
+                    self._wds.pop(path, None)
+                continue
+
+            events.append((path, name, mask))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+@dataclass
+class WatchBatch:
+    changed: Set[Path] = field(default_factory=set)
+    created: Set[Path] = field(default_factory=set)
+    removed: Set[Path] = field(default_factory=set)
+    overflow: bool = False
+
+
+# Collects events until the tree has been quiet for `debounce` seconds (or maxWait has passed since the
+# first one), so a burst of renames becomes one batch of affected directories.
+class Watcher:
+    debounce: float
+    maxWait: float
+
+    def __init__(self, debounce: float = 1.0, maxWait: float = 10.0, ignore: Callable[[Path, str], bool] = None):
+        self.debounce = debounce
+        self.maxWait = maxWait
+        self._ignore = ignore
+        self._inotify = Inotify()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, path: Path):
+        self._inotify.add(path)
+
+    def remove_tree(self, path: Path):
+        for p in self._inotify.watched():
+            if p == path or path in p.parents:
+                self._inotify.remove(p)
+
+    def next_batch(self, timeout: Optional[float] = None) -> Optional[WatchBatch]:
+        batch = WatchBatch()
+        first = None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        wait = timeout
+
+        while True:
+            events = self._inotify.read(wait)
+
+            if not events and first is not None:
+                return batch
+
+            for (d, name, mask) in events:
+                if self._add_event(batch, d, name, mask) and first is None:
+                    first = time.monotonic()
+
+            # events on ignored files alone don't start a batch
+            if first is None:
+                if deadline is not None:
+                    wait = deadline - time.monotonic()
+
+                    if wait <= 0:
+                        return None
+                continue
+
+            wait = min(self.debounce, max(0.0, first + self.maxWait - time.monotonic()))
+
+            if wait <= 0:
+                return batch
+
+    # False when the event was dropped
+    def _add_event(self, batch: WatchBatch, d: Optional[Path], name: str, mask: int) -> bool:
+        if mask & IN_Q_OVERFLOW:
+            batch.overflow = True
+            return True
+        if d is None:
+            return False
+
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            batch.removed.add(d)
+            return True
+
+        if self._ignore and self._ignore(d, name):
+            return False
+
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                batch.created.add(d / name)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                batch.removed.add(d / name)
+            else:
+                return False
+        else:
+            batch.changed.add(d)
+
+        return True
+
+    def close(self):
+        self._inotify.close()
@@ -1,7 +1,9 @@
 import sys
 import os
 import re
+import copy
 import datetime
+from functools import lru_cache
 from pathlib import Path
 
 from dataclasses import dataclass
@@ -116,6 +118,32 @@ class TimeSpan:
         self.length = self.end - self.start
 
 
+# in start order, spans that overlap or are less than `gap` seconds apart become one
+def merge_spans(times: List[TimeSpan], gap: int) -> List[TimeSpan]:
+    merged = []
+
+    for t in sorted(times, key=lambda t: t.start):
+        if merged and t.start <= merged[-1].end + gap:
+            last = merged[-1]
+            last.end = max(last.end, t.end)
+            last.length = last.end - last.start
+        else:
+            merged.append(copy.copy(t))
+
+    return merged
+
+
+# the 1080p30 reference encode_cost counts in, mediaTable applies the same formula to whole columns
+cost_ref_pixels = 1920 * 1080
+cost_ref_fps = 30
+
+
+# rough encode effort in seconds of 1080p30 video, unknown dimensions or fps count as 1080p30
+def encode_cost(seconds: float, width: float, height: float, fps: float) -> float:
+    pixels = width * height if width and height else cost_ref_pixels
+    return seconds * (pixels / cost_ref_pixels) * ((fps or cost_ref_fps) / cost_ref_fps)
+
+
 _valid_fps = [23.976, 24, 25, 29.97, 30, 48, 50, 59.94, 60, 72, 75, 90, 100, 120]
 
 
@@ -153,6 +181,8 @@ class EncodeConfig:
     isRenc: bool
     fps: int
     setfps: float
+    width: float
+    height: float
     exclude: bool
     excludeReason: str
     mods: str
@@ -170,6 +200,8 @@ class EncodeConfig:
         self.times = []
         self.fps = fps
         self.setfps = None
+        self.width = 0
+        self.height = 0
         self.exclude = False
         self.mods = ''
 
@@ -233,6 +265,10 @@ class EncodeConfig:
         else:
             self.multiTimes = False
 
+    # frames are written at the forced rate when there is one
+    def encodeCost(self, seconds: float) -> float:
+        return encode_cost(seconds, self.width, self.height, self.setfps or self.fps)
+
     def printTimes(self, pref, color=False):
         length = lambda t: re.sub('^0:', '', str(datetime.timedelta(seconds=t.length)))
         return f"\n{pref}".join(map(lambda t: f'{shellcolors.WARNING if color and t.length > 1800 else ""}{length(t)}\t{t.start} -> {t.end}{shellcolors.OFF}', self.times))
@@ -245,8 +281,21 @@ class EncodeBatch:
     shortDir: str
 
 
-_rx_num_delim = re.compile(r'([^\d]|\d+)')
+_rx_digit_runs = re.compile(r'(\d+)')
+_rx_dblcmd_runs = re.compile(r'(_+|\d+)')
 _max_neg = sys.maxsize * -1
+_sort_key_cache_size = 1 << 16
+
+
+# Per-character weight table, chars missing from the position table weigh their code point and are
+# added on first lookup, so keys are built with one C-level map over each text run.
+class SortWeights(dict):
+    def __missing__(self, c: str) -> int:
+        v = ord(c)
+        self[c] = v
+        return v
+
+
 _windows_sort_pos = {
     ' ': _max_neg + 1,
     '!': _max_neg + 2,
@@ -281,33 +330,29 @@ _windows_sort_pos = {
     '-': 2
 }
 _windows_sort_num_offset = _max_neg + 30
+_windows_sort_weights = SortWeights(_windows_sort_pos)
 
 
-def windows_file_sort_keys(key: str) -> List:
+def windows_file_sort_keys(key: str) -> Tuple:
     if not key:
-        return [_max_neg]
+        return (_max_neg,)
 
-    m = _rx_num_delim.findall(key.casefold())
-    if m:
-        i = 0
+    return _windows_file_sort_keys(key)
 
-        while i < len(m):
-            if m[i].isdigit():
-                m[i] = _windows_sort_num_offset + int(m[i])
-            else:
-                v = _windows_sort_pos.get(m[i])
-
-                if v == 0:
-                    i += 1
-                    continue
-                elif v:
-                    m[i] = v
-                else:
-                    m[i] = ord(m[i])
-            i += 1
-        return m
-    else:
-        return [key]
+
+@lru_cache(maxsize=_sort_key_cache_size)
+def _windows_file_sort_keys(key: str) -> Tuple:
+    res: List[int] = []
+    weights = _windows_sort_weights.__getitem__
+    parts = _rx_digit_runs.split(key.casefold())
+
+    # split alternates text and digit runs, starting and ending with a (possibly empty) text run
+    for i in range(1, len(parts), 2):
+        res.extend(map(weights, parts[i - 1]))
+        res.append(_windows_sort_num_offset + int(parts[i]))
+
+    res.extend(map(weights, parts[-1]))
+    return tuple(res)
 
 
 _dblcmd_sort_pos = {
@@ -346,89 +391,69 @@ _dblcmd_sort_dunder_offset = _max_neg + 20
 # leave buffer for dunder handling
 _dblcmd_sort_pos_max = max(_dblcmd_sort_pos.values())
 _dblcmd_sort_num_offset = ((_dblcmd_sort_pos_max - _max_neg) * 2) + _max_neg
+_dblcmd_sort_weights = SortWeights(_dblcmd_sort_pos)
 
 
-def dblcmd_file_sort_keys(key: str, parent: Path) -> List:
+def dblcmd_file_sort_keys(key: str, parent: Path, is_file: bool = None) -> Tuple:
     if not key:
-        return [_max_neg]
+        return (_max_neg,)
 
-    if parent is None:
-        key_path = Path(key)
-    else:
-        key_path = Path(parent / key)
+    # callers that got the entry from the walker already know its type, only stat when they don't
+    if is_file is None:
+        is_file = parent is None or Path(parent / key).is_file()
 
-    if parent is None or key_path.is_file():
-        key_suffix = key_path.suffix
-        key_stem = re.sub(re.escape(key_suffix) + '$', '', key)
+    return _dblcmd_file_sort_keys(key, is_file)
+
+
+@lru_cache(maxsize=_sort_key_cache_size)
+def _dblcmd_file_sort_keys(key: str, is_file: bool) -> Tuple:
+    if is_file:
+        key_suffix = Path(key).suffix
+        key_stem = key[:-len(key_suffix)] if key_suffix and key.endswith(key_suffix) else key
     else:
         key_suffix = ''
         key_stem = key
 
-    res: List[Union[str, int]] = []
+    if not key_stem:
+        return (key,)
 
-    m: List[str] = _rx_num_delim.findall(key_stem.casefold())
-    if m:
-        dblcmd_file_sort_key_parts(m, res)
+    res: List[int] = []
+    dblcmd_sort_weights(key_stem.casefold(), res)
+    res.append(_max_neg)
 
-        res.append(_max_neg)
+    if key_suffix:
+        dblcmd_sort_weights(key_suffix.casefold(), res)
 
-        if key_suffix:
-            dblcmd_file_sort_key_parts(_rx_num_delim.findall(key_suffix.casefold()), res)
+    return tuple(res)
 
-        return res
-    else:
-        return [key]
-
-
-def dblcmd_file_sort_key_parts(m: List[str], res: List[Union[str, int]]):
-    i = 0
-
-    while i < len(m):
-        if m[i] == '_':
-            undc = 0
-            num = False
-            follow = None
-            i += 1
-
-            while i < len(m):
-                if m[i] == '_':
-                    undc += 1
-                elif m[i].isdigit():
-                    i -= 1
-                    num = True
-                    break
-                elif m[i] in _dblcmd_sort_dunder_pre_alpha:
-                    follow = _dblcmd_sort_pos[m[i]] - _max_neg
-                    i -= 1
-                    break
-                else:
-                    i -= 1
-                    break
-                i += 1
-
-            res.append(_dblcmd_sort_dunder_offset)
-            if num:
-                res.append(_dblcmd_sort_dunder_offset)
-                res.append(undc)
-                res.append(0)
-            elif follow:
-                res.append(_dblcmd_sort_dunder_offset)
-                res.append(undc)
-                res.append(follow)
-            else:
-                res.append(_dblcmd_sort_dunder_offset + 1)
-                res.append(undc * -1)
-                res.append(0)
-        elif m[i].isdigit():
-            res.append(_dblcmd_sort_num_offset + int(m[i]))
+
+def dblcmd_sort_weights(text: str, res: List[int]):
+    weights = _dblcmd_sort_weights.__getitem__
+    parts = _rx_dblcmd_runs.split(text)
+
+    for i in range(1, len(parts), 2):
+        res.extend(map(weights, parts[i - 1]))
+        run = parts[i]
+
+        if not run[0] == '_':
+            res.append(_dblcmd_sort_num_offset + int(run))
+            continue
+
+        # underscore runs weigh by their length and by what comes right after them,
+        # an empty text run means the next run is a number
+        undc = len(run) - 1
+        follow = parts[i + 1][:1]
+
+        if not follow and i + 2 < len(parts):
+            res.extend((_dblcmd_sort_dunder_offset, _dblcmd_sort_dunder_offset, undc, 0))
+        elif follow in _dblcmd_sort_dunder_pre_alpha:
+            res.extend((_dblcmd_sort_dunder_offset, _dblcmd_sort_dunder_offset, undc, _dblcmd_sort_pos[follow] - _max_neg))
         else:
-            v = _dblcmd_sort_pos.get(m[i])
+            res.extend((_dblcmd_sort_dunder_offset, _dblcmd_sort_dunder_offset + 1, undc * -1, 0))
 
-            if v == 0:
-                i += 1
-                continue
-            elif v:
-                res.append(v)
-            else:
-                res.append(ord(m[i]))
-        i += 1
+    res.extend(map(weights, parts[-1]))
+
+
+def sort_key_cache_clear():
+    _windows_file_sort_keys.cache_clear()
+    _dblcmd_file_sort_keys.cache_clear()
@@ -1,4 +1,5 @@
 import glob
+import csv
 import sys
 import os
 import pwd
@@ -9,15 +10,25 @@ import datetime
 import traceback
 import math
 import json
-from functools import reduce
+import time
+import hashlib
+import signal
+import threading
+import subprocess
 from pathlib import Path
+from dataclasses import dataclass
 from argparse import ArgumentParser
 from tabulate import tabulate
 from tqdm import tqdm
 
-from typing import List, Any, Dict, Tuple, Callable, Union
+from typing import List, Any, Dict, Iterable, Iterator, Tuple, Callable, Set, Union
 
 import encodingCommon as enc
+import probeCommon as probe
+import dirWalker as walker
+import dirWatcher
+import variantGrouping as grouping
+import queueRunner as runner
 
 shellcolors = enc.shellcolors
 
@@ -25,9 +36,6 @@ _rx_options = r'( \[(([mqxr]*?[0-9.]+ ?)*?)\])*'
 _rx_times_str = re.compile(r'^(.+)~([\d;:\- ]+)' + _rx_options + '$')
 _rx_renc_str = re.compile(r'^(.+)~(renc)' + _rx_options + '$')
 _rx_converted = re.compile(r'(-\d+)?(-nvenc-[cq\d]+)')
-# _rx_enc_settings_strip = re.compile(r'(~.+)|((-\d+)?-nvenc-[cq\d]+)')
-_rx_enc_settings_strip = re.compile(r'~.+')
-_rx_enc_res_strip = re.compile(r'-nvenc-.+')
 
 _file_filters = {
     'converted': _rx_converted
@@ -46,6 +54,19 @@ ap.add_argument("-tbr", "--target-bitrate", type=str, help="Target bitrate")
 ap.add_argument('-win', "--win", action='store_true', help="Write queue for windows")
 ap.add_argument("--plan", action='store_true', help="Don't write queue")
 ap.add_argument("--clean", action='store_true', help="Show folders needing cleaning")
+ap.add_argument("--manifest", type=str, nargs='?', const='queue.ndjson', help="Also write an NDJSON record per queued segment (default queue.ndjson next to the queue)")
+ap.add_argument("--merge-gap", type=int, help="Merge spans of a file that overlap or are less than this many seconds apart")
+ap.add_argument("--single-pass", action='store_true', help="Write files with several spans as one ffmpeg command that decodes the source once for all outputs. Those outputs end in -ff as ffmpeg's -cq scale differs from HandBrake's -q")
+ap.add_argument("--shards", type=int, default=1, help="Split the queue into N files balanced by estimated encode cost")
+ap.add_argument("--order", type=str, default='directory', choices=runner.policies.keys(), help="Queue order: directory, shortest or longest estimated encode first")
+ap.add_argument("--run", action='store_true', help="Encode the planned queue now instead of writing queue.sh")
+ap.add_argument("--sessions", type=int, default=2, help="Concurrent encoder sessions for --run (NVENC session limit)")
+ap.add_argument("--chunk-minutes", type=float, default=0, help="With --run, split renc files and spans longer than this into chunks encoded in parallel, then joined (needs ffmpeg)")
+ap.add_argument("--redo-existing", action='store_true', help="Queue segments even when a complete encode of them is already in the dest folder")
+ap.add_argument("--stage-dir", type=str, help="With --run, copy upcoming sources to this local scratch folder while earlier ones encode, outputs are written there too and moved back")
+ap.add_argument("--stage-gb", type=float, default=50, help="Space --stage-dir may fill with staged sources")
+ap.add_argument("--no-journal", action='store_true', help="Don't skip segments the completion journal says are finished, or record new ones")
+ap.add_argument("--encoder", type=str, default='handbrake', choices=runner.encoders.keys(), help="Encoder used by --run (stub fakes encodes, no GPU needed)")
 ap.add_argument("-iff", "--ignore-fps-factor", action='store_true', help="Ignore FPs Factor error")
 ap.add_argument("-renc", "--renc", action='store_true', help="Reencode all")
 ap.add_argument("-fps", "--list-fps", action='store_true', help="List FPS details")
@@ -54,6 +75,9 @@ ap.add_argument("-btrl", "--bitrate-limit", type=int, default=5, help="Override
 ap.add_argument("-btr", "--list-bitrate", action='store_true', help="List bitrate details")
 ap.add_argument("-btre", "--list-bitrate-error", action='store_true', help="List out of bounds bitrates")
 ap.add_argument("-len", "--list-length", action='store_true', help="List out video length")
+ap.add_argument("--stream", action='store_true', help="With the list modes, print each folder's rows as soon as it's scanned instead of one table at the end")
+ap.add_argument("--stats", action='store_true', help="Library statistics: percentiles, bitrate histograms by extension and estimated encode hours")
+ap.add_argument("--export", type=str, help="With the list modes, also write every scanned file's raw values to PATH (.csv, .ndjson or .jsonl)")
 ap.add_argument("-fs", "--list-folder-summaries", action='store_true', help="List details by folder")
 ap.add_argument("--excl-ungrp", action='store_true', help="Exclude ungrouped files")
 ap.add_argument("-minmb", "--min-mbytes", type=int, default=-1, help="Min file size in MB")
@@ -61,23 +85,43 @@ ap.add_argument("-ff", "--file-filter", type=str, choices=_file_filters.keys(),
 ap.add_argument("-df", "--dir-filter", type=str, choices=_dir_filters.keys(), help="Directory filter")
 ap.add_argument("-ns", "--nautilus-sort", action='store_true', help="Sort like Nautilus file browser")
 ap.add_argument("--sort-test", action='store_true', help="Test file sorter")
+ap.add_argument("--bench-startup", action='store_true', help="Time cold starts of each mode")
 ap.add_argument("--no-bar", action='store_true', help="Don't use progress bar")
+ap.add_argument("--no-cache", action='store_true', help="Don't read or write the probe cache")
+ap.add_argument("--rebuild-cache", action='store_true', help="Discard the probe cache and probe every file again")
+ap.add_argument("--cache-dir", type=str, help="Probe cache directory (default: $XDG_CACHE_HOME/hbscripter)")
+ap.add_argument("-pb", "--probe-backend", type=str, default='cv2', choices=probe.backend_chains.keys(), help="Metadata probe backend (header falls back to cv2, cached only reads the probe cache)")
+ap.add_argument("--probe-compare", action='store_true', help="Compare header probe results against cv2")
+ap.add_argument("--watch", action='store_true', help="Keep running and update the queue as files change (inotify)")
+ap.add_argument("--debounce", type=float, default=1.0, help="Seconds of quiet before --watch re-plans changed folders")
+ap.add_argument("--full", action='store_true', help="Ignore the directory index and rescan every directory")
+ap.add_argument("-wt", "--walk-threads", type=int, default=1, help="List directories with N threads (helps on network mounts)")
+ap.add_argument("--max-captures", type=int, default=4, help="Max video captures open at once, across all probe workers")
+ap.add_argument("-j", "--jobs", type=int, default=1, help="Probe files with N worker processes")
 _args = ap.parse_args()
 
-# takes a while, so avoid if --help called
-import cv2
+if _args.run and _args.watch:
+    ap.error('--run can\'t be combined with --watch')
+if _args.run and _args.plan:
+    ap.error('--plan is a dry run and can\'t be combined with --run')
+if _args.run and _args.single_pass:
+    ap.error('--single-pass only applies to written queues')
+if _args.stage_dir and not _args.run:
+    ap.error('--stage-dir needs --run')
+if _args.sessions < 1:
+    ap.error('--sessions needs at least 1 session')
 
 
-def windows_sorter(f: Callable[[Any], str], iterr: List, parent: Path = None):
+def windows_sorter(f: Callable[[Any], str], iterr: List, parent: Path = None, is_file: bool = None):
     iterr.sort(key=lambda x: enc.windows_file_sort_keys(f(x)))
 
 
-def nautilus_sorter(f: Callable[[Any], str], iterr: List, parent: Path = None):
+def nautilus_sorter(f: Callable[[Any], str], iterr: List, parent: Path = None, is_file: bool = None):
     iterr.sort(key=lambda x: f(x).strip('/').strip('_').casefold())
 
 
-def dblcmd_sorter(f: Callable[[Any], str], iterr: List, parent: Path = None):
-    iterr.sort(key=lambda x: enc.dblcmd_file_sort_keys(f(x), parent))
+def dblcmd_sorter(f: Callable[[Any], str], iterr: List, parent: Path = None, is_file: bool = None):
+    iterr.sort(key=lambda x: enc.dblcmd_file_sort_keys(f(x), parent, is_file))
 
 
 _max_fps = 30
@@ -106,13 +150,24 @@ _extensions = {
 }
 
 _root_map = None
+_probe_cache: probe.ProbeCache = None
+_probe_backends = probe.get_backends(_args.probe_backend, _args.max_captures)
+_probe_results: Dict[Path, Union[probe.ProbeResult, Exception]] = {}
+_listings: Dict[Path, walker.DirListing] = {}
+# dest folder -> title (name plus span counter) -> encoded outputs found there
+_outputs: Dict[Path, Set[str]] = {}
+_output_durations: Dict[Path, Union[float, None]] = {}
+# sources are planned with their length rounded up, outputs can also gain or drop a frame at each end
+_output_tolerance = 3.0
+_dir_index: walker.DirIndex = None
+_rx_ansi = re.compile(r'\x1b\[[0-9;]*m')
 _list_details = _args.list_fps or _args.list_fps_error or _args.list_bitrate or _args.list_bitrate_error or _args.list_length
 _list_error_only = _args.list_fps_error or _args.list_bitrate_error
 _list_fps = _args.list_fps or _args.list_fps_error
 _list_bitrate = _args.list_bitrate or _args.list_bitrate_error
 _file_filter = None
 _dir_filter = None
-_file_sorter: Callable[[Callable[[Any], str], List, Path], None] = nautilus_sorter if _args.nautilus_sort else windows_sorter if _args.win else dblcmd_sorter
+_file_sorter: Callable[[Callable[[Any], str], List, Path, bool], None] = nautilus_sorter if _args.nautilus_sort else windows_sorter if _args.win else dblcmd_sorter
 _root_dir = Path(_args.root_dir).resolve() if _args.root_dir else Path('./').resolve()
 _set_title = 'title' if _args.win else 'set_title'
 _script_preamble = '' if  _args.win else '''#! /usr/bin/env bash
@@ -148,6 +203,11 @@ if _args.dir_filter:
 if _args.bitrate_limit:
     _max_bitrate = int(_args.bitrate_limit)
 
+if _args.export and not _list_details:
+    ap.error('--export needs one of the list modes')
+if _args.export and Path(_args.export).suffix.lower() not in ['.csv', '.ndjson', '.jsonl']:
+    ap.error('--export writes .csv, .ndjson or .jsonl files')
+
 
 def logts() -> str:
     return datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
@@ -197,42 +257,81 @@ def print_table(data: List[Dict[str, Union[str, int]]],
     for d in data:
         if isinstance(d, str):
             rows.append([d])
-            continue
+        else:
+            rows.append(table_row(d, col_order, data_row_color, prefixes, unset_cell_color))
 
-        row = []
-        row_color = data_row_color
+    print(tabulate(rows, headers=headers if show_headers else (), tablefmt=tablefmt))
 
-        def add_cell(cell_value):
-            pref = ''
-            cell_value = str(cell_value)
 
-            if prefixes:
-                clear = False
+def table_row(d: Dict[str, Union[str, int]], col_order: List[str], data_row_color: str = None, prefixes: List[str] = None,
+              unset_cell_color: str = shellcolors.BLACK) -> List[str]:
+    row = []
+    row_color = d.get('_rowcolor', data_row_color)
 
-                while not clear:
-                    clear = True
+    for k in col_order:
+        pref = ''
+        cell_value = str(d[k]) if k in d else ''
 
-                    for p in prefixes:
-                        if cell_value.startswith(p):
-                            pref += p
-                            cell_value = cell_value.replace(p, '')
-                            clear = False
-            if pref:
-                pref = f'{data_row_color}{pref}{shellcolors.OFF}'
-            row.append(f'{pref}{row_color}{cell_value.replace(unset_cell_color, row_color)}{shellcolors.OFF}')
+        if prefixes:
+            clear = False
 
-        if '_rowcolor' in d:
-            row_color = d['_rowcolor']
+            while not clear:
+                clear = True
 
-        for k in col_order:
-            if k in d:
-                add_cell(d[k])
-            else:
-                add_cell('')
+                for p in prefixes:
+                    if cell_value.startswith(p):
+                        pref += p
+                        cell_value = cell_value.replace(p, '')
+                        clear = False
+        if pref:
+            pref = f'{data_row_color}{pref}{shellcolors.OFF}'
+        row.append(f'{pref}{row_color}{cell_value.replace(unset_cell_color, row_color)}{shellcolors.OFF}')
 
-        rows.append(row)
+    return row
 
-    print(tabulate(rows, headers=headers if show_headers else (), tablefmt=tablefmt))
+
+def visible_len(s: str) -> int:
+    return len(_rx_ansi.sub('', s))
+
+
+# print_table for rows that arrive a batch at a time: each batch is printed right away and dropped. Columns are
+# left aligned and padded to the widths given up front, which have to fit every value of their column, so each
+# row lines up with the header and the rows printed before it.
+class TableStream:
+    rows: int
+
+    def __init__(self, col_order: List[str], widths: Dict[str, int], data_row_color: str = None, prefixes: List[str] = None,
+                 show_headers: bool = True, out: Callable[[str], None] = print):
+        self.rows = 0
+        self._col_order = col_order
+        self._widths = [max(widths.get(k, 0), len(k) if show_headers else 0) for k in col_order]
+        self._data_row_color = data_row_color
+        self._prefixes = prefixes
+        self._show_headers = show_headers
+        self._out = out
+
+    def _line(self, cells: List[str]) -> str:
+        parts = []
+
+        for (i, c) in enumerate(cells):
+            parts.append(c + ' ' * (self._widths[i] - visible_len(c)))
+
+        return '  '.join(parts).rstrip()
+
+    def write(self, data: List[Union[Dict[str, Union[str, int]], str]]):
+        for d in data:
+            if not self.rows and self._show_headers:
+                self._out(self._line(list(self._col_order)))
+                self._out('  '.join('-' * w for w in self._widths))
+
+            if isinstance(d, str):
+                self._out(d.rstrip())
+            else:
+                # tabulate shows floats in their shortest form, 30 rather than 30.0
+                d = {k: f'{v:g}' if isinstance(v, float) else v for (k, v) in d.items()}
+                self._out(self._line(table_row(d, self._col_order, self._data_row_color, self._prefixes)))
+
+            self.rows += 1
 
 
 enc.init(_extensions, error)
@@ -245,115 +344,649 @@ def escape_shell_str(obj):
         return str(obj).replace('"', '""').replace('$', r'\$')
 
 
+def cache_dir() -> Path:
+    return Path(_args.cache_dir).resolve() if _args.cache_dir else probe.default_cache_dir()
+
+
+def open_probe_cache():
+    global _probe_cache
+
+    if _args.no_cache:
+        return
+
+    _probe_cache = probe.ProbeCache(cache_dir() / 'probe.sqlite', _args.rebuild_cache)
+
+
+# options that change which segments are planned, how they're probed, encoded or ordered
+_plan_options = [
+    'renc', 'ignore_fps_factor', 'probe_backend', 'target_bitrate', 'merge_gap', 'single_pass', 'redo_existing',
+    'no_journal', 'order', 'encoder', 'chunk_minutes', 'nautilus_sort', 'win', 'min_mbytes', 'file_filter', 'dir_filter'
+]
+
+
+def open_dir_index():
+    global _dir_index
+
+    root_key = hashlib.sha1(_root_dir.as_posix().encode()).hexdigest()[:16]
+    # anything that changes which files are planned or how they're probed invalidates the whole index
+    fingerprint = '|'.join(f'{o}={getattr(_args, o)}' for o in _plan_options)
+    full = _args.full or _args.no_cache or _args.rebuild_cache
+    _dir_index = walker.DirIndex(cache_dir() / f'index-{root_key}.pickle', fingerprint, full)
+
+
+def close_dir_index():
+    if _dir_index:
+        log_trace(f'Directory index: {_dir_index.reused} reused, {_dir_index.rescanned} rescanned, {_dir_index.scansReused} plans reused')
+        _dir_index.save()
+
+
+def close_probe_cache():
+    if _probe_cache:
+        log_trace(f'Probe cache: {_probe_cache.hits} hits, {_probe_cache.misses} misses')
+        _probe_cache.close()
+
+
+def log_probe_resources():
+    if not _args.trace:
+        return
+
+    session = probe.get_session(_args.max_captures)
+    (rss, workers_rss) = probe.peak_rss_mb()
+    log_trace(f'Probe handles: peak {session.peakOpen}/{session.maxOpen} captures open, peak {session.peakFds} fds (peaks per process)')
+    log_trace(f'Peak RSS: {rss} MB, workers {workers_rss} MB')
+
+
+def prefetch_probes(files: List[Path], on_done: Callable[[], None] = None):
+    _probe_results.update(probe.probe_files(files, _args.jobs, _probe_cache, on_done, _probe_backends, _args.max_captures))
+
+
+def probe_file(f: Path) -> probe.ProbeResult:
+    if f in _probe_results:
+        res = _probe_results.pop(f)
+
+        if isinstance(res, Exception):
+            raise res
+
+        return res
+
+    st = f.stat()
+
+    if _probe_cache:
+        res = _probe_cache.get(f, st)
+
+        if res:
+            return res
+
+    res = probe.probe_path(str(f), _probe_backends)
+
+    if _probe_cache:
+        _probe_cache.put(f, st, res)
+
+    return res
+
+
 def cmd_path_map(path: Path):
     return '"' + escape_shell_str(path) + '"'
 
 
+def map_root_path(path: Path) -> Path:
+    return Path(path.as_posix().replace(_root_map[0], _root_map[1])) if _root_map else path
+
+
+def index_outputs(listing: walker.DirListing):
+    _outputs[listing.path] = {p.name for p in listing.videos if '-nvenc' in p.stem}
+
+
+def dest_outputs(dest_folder: Path) -> Set[str]:
+    # the walk indexes dest folders as it passes them, this covers -nr and folders created since
+    if dest_folder not in _outputs:
+        try:
+            index_outputs(walker.list_dir(dest_folder, _extensions.keys()))
+        except OSError:
+            _outputs[dest_folder] = set()
+
+    return _outputs[dest_folder]
+
+
+def output_duration(p: Path) -> Union[float, None]:
+    if p not in _output_durations:
+        try:
+            pr = probe_file(p)
+            _output_durations[p] = pr.frames / pr.fps if pr.fps else None
+        except Exception:
+            _output_durations[p] = None
+
+    return _output_durations[p]
+
+
+# an earlier encode under the exact name this config produces, so the same span, cq and fps, that's as long
+# as the span. Outputs of other settings are left alone and the source is encoded again.
+def existing_output(f: enc.EncodeConfig, seg: runner.Segment) -> Union[Path, None]:
+    if seg.output.name not in dest_outputs(seg.output.parent):
+        return None
+
+    expected = seg.length if seg.length is not None else f.videoLen
+
+    # spans running past the end only encode up to it
+    if seg.start is not None and f.videoLen > seg.start:
+        expected = min(expected, f.videoLen - seg.start)
+
+    got = output_duration(seg.output)
+
+    return seg.output if got is not None and abs(got - expected) <= _output_tolerance else None
+
+
+def batch_jobs(b: enc.EncodeBatch, journal: runner.Journal = None) -> Iterator[runner.FileJob]:
+    for f in b.files:
+        options = ['--preset', 'H.265 NVENC 1080p']
+        quality = ''
+        fps = ''
+
+        if _args.target_bitrate:
+            options += ['--vb', str(f.targetBitrate)]
+            quality = ''
+        else:
+            options += ['-q', f'{f.targetCq}.0']
+            quality = f'-cq{f.targetCq}'
+
+        if f.setfps and not f.setfps == 0:
+            options += ['-r', str(f.setfps), '--pfr']
+
+        if f.setfps:
+            fps = f'-r{f.setfps}'
+
+        dest_folder = b.destFolder
+        # ffmpeg's -cq isn't HandBrake's -q, so its outputs never pass for HandBrake encodes of the span
+        encoder = '-ff' if single_pass(f) else ''
+        enc_suffix = f'-nvenc{quality}{fps}{encoder}'
+        title = f.name
+        max_title_len = 20
+
+        if len(title) > max_title_len + 3:
+            title = f'{title[0:max_title_len]}...'
+
+        times = f.times
+
+        if times:
+            segments = []
+            ti = 0
+            for t in times:
+                cnt = f'-{ti}' if len(times) > 1 else ''
+                segments.append(runner.Segment(dest_folder / f'{f.name}{cnt}{enc_suffix}.mp4', t.start, t.length, f.encodeCost(t.length)))
+                ti += 1
+            seconds = sum(t.length for t in times)
+        else:
+            segments = [runner.Segment(dest_folder / f'{f.name}{enc_suffix}.mp4', cost=f.encodeCost(f.videoLen))]
+            seconds = f.videoLen
+
+        job = runner.FileJob(title, f.sourcePath, dest_folder, dest_folder / f.fileName, options, segments, seconds, config=f)
+
+        if journal:
+            job.segments = [seg for seg in segments if not journal.done(f.sourcePath, seg)]
+            job.done = len(segments) - len(job.segments)
+
+        if not _args.redo_existing:
+            pending = []
+
+            for seg in job.segments:
+                (job.existing if existing_output(f, seg) else pending).append(seg)
+
+            job.segments = pending
+
+        yield job
+
+
+def cmd_options(options: List[str]) -> str:
+    return ' '.join(runner.shell_arg(o, _args.win) for o in options)
+
+
+# ffmpeg counterpart of the HandBrake options, close to what the 1080p NVENC preset does
+def ffmpeg_options(f: enc.EncodeConfig) -> List[str]:
+    options = ['-c:v', 'hevc_nvenc', '-preset', 'p5',
+               '-vf', "scale='min(1920,iw)':'min(1080,ih)':force_original_aspect_ratio=decrease:force_divisible_by=2",
+               '-c:a', 'aac', '-b:a', '160k', '-ac', '2']
+
+    if _args.target_bitrate:
+        options += ['-b:v', f'{f.targetBitrate}k']
+    else:
+        options += ['-rc', 'vbr', '-cq', str(f.targetCq), '-b:v', '0']
+
+    if f.setfps:
+        options += ['-fpsmax', str(f.setfps)]
+
+    return options
+
+
+# Every span is an output of the same ffmpeg run, output side -ss/-t cut them from one decode of the source
+# instead of reopening and seeking it per span. The whole file up to the last span's end gets decoded, so it
+# pays off on files with many cuts rather than a few far apart.
+def single_pass(f: enc.EncodeConfig) -> bool:
+    return _args.single_pass and len(f.times) > 1
+
+
+def single_pass_command(job: runner.FileJob) -> str:
+    exe = 'ffmpeg.exe' if _args.win else 'ffmpeg'
+    options = cmd_options(ffmpeg_options(job.config))
+    outputs = ' '.join(f'{options} -ss {seg.start} -t {seg.length} {cmd_path_map(map_root_path(seg.output))}' for seg in job.segments)
+    return f'{exe} -hide_banner -nostdin -y -i {cmd_path_map(map_root_path(job.source))} {outputs}'
+
+
+def journal_command(job: runner.FileJob, seg: runner.Segment) -> str:
+    return (f'journal {cmd_path_map(job.source)} {cmd_path_map(seg.output)} {runner.span_str(seg.start)} '
+            f'{runner.span_str(seg.length)} {cmd_path_map(map_root_path(seg.output))}')
+
+
+def queue_commands(jobs: Iterable[runner.FileJob], tot: int, journal: runner.Journal = None) -> Iterator[str]:
+    qi = 0
+    exe = 'HandBrakeCLI.exe' if _args.win else 'HandBrakeCLI'
+    dest_folders = set()
+
+    for job in jobs:
+        if job.destFolder not in dest_folders:
+            dest_folders.add(job.destFolder)
+
+            if not job.destFolder.exists():
+                os.makedirs(job.destFolder)
+
+            # os.chown(b.destFolder, _nobody_uid, _users_gid)
+            # os.chmod(b.destFolder, 0o0777)
+
+        source_path = map_root_path(job.source)
+        cmd = f'{exe} {cmd_options(job.options)} -i {cmd_path_map(source_path)}'
+        title = escape_shell_str(job.title)
+        # decided on the file's spans, not the segments left, so outputs keep the -ff name they were planned under
+        one_pass = single_pass(job.config)
+
+        for seg in job.segments:
+            qi += 1
+            title_cmd = f'{_set_title} "{qi}/{tot} {title}" && ' if _set_title else ''
+            dest_path = map_root_path(seg.output)
+
+            # not journaled, so it's a leftover of an encode that was cut short
+            if journal and seg.output.exists():
+                yield f'del /f /q {cmd_path_map(dest_path)}' if _args.win else f'rm -f {cmd_path_map(dest_path)}'
+
+            if one_pass:
+                continue
+            elif seg.start is None:
+                yield f'{title_cmd}{cmd} -o {cmd_path_map(dest_path)}'
+            else:
+                yield f'{title_cmd}{cmd} -o {cmd_path_map(dest_path)} --start-at seconds:{seg.start} --stop-at seconds:{seg.length}'
+
+            if journal and not _args.win:
+                yield journal_command(job, seg)
+
+        if one_pass:
+            title_cmd = f'{_set_title} "{qi}/{tot} {title}" && ' if _set_title else ''
+            yield f'{title_cmd}{single_pass_command(job)}'
+
+            if journal and not _args.win:
+                for seg in job.segments:
+                    yield journal_command(job, seg)
+
+        if _args.win:
+            yield f'move /y {cmd_path_map(source_path)} {cmd_path_map(map_root_path(job.moveTo))}'
+        else:
+            # if Path(f.fileName).suffix == '.mkv':
+            #     dest1 = dest_folder / f'{f.fileName}v'
+            #     dest2 = dest_folder / f'{f.fileName}'
+            #     # yield f'mv {cmd_path_map(source_path)} {cmd_path_map(dest1)} && mv {cmd_path_map(dest1)} {cmd_path_map(dest2)}'
+            #     yield f'mv {cmd_path_map(source_path)} {cmd_path_map(dest1)}'
+            # else:
+            #     yield f'mv {cmd_path_map(source_path)} {cmd_path_map(dest_folder / f.fileName)}'
+
+            #yield 'sleep 1'
+            #yield f'ls -lha {cmd_path_map(dest_folder)}'
+            #yield f'ls -lha "$(dirname {cmd_path_map(source_path)})"'
+
+            yield f'mv {cmd_path_map(source_path)} {cmd_path_map(map_root_path(job.moveTo))}'
+
+
+class QueueWriter(runner.AtomicFile):
+    count: int
+
+    def __init__(self, path: Path, preamble: str):
+        super().__init__(path)
+        self.count = 0
+        self._preamble = preamble
+        self._delim = " && ^\n" if _args.win else ";\n"
+
+    def write(self, cmd: str):
+        self._f.write((self._delim if self.count else self._preamble) + cmd)
+        self.count += 1
+
+    def commit(self):
+        if self.count:
+            if _set_title:
+                self.write(f'{_set_title} "Queue Completed"')
+        else:
+            self._f.write('echo no items')
+
+        super().commit()
+
+
+# one NDJSON record per pending segment, paths as the queue sees them
+class ManifestWriter(runner.AtomicFile):
+    count: int
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.count = 0
+
+    def write_job(self, job: runner.FileJob, shard: int = None):
+        ec: enc.EncodeConfig = job.config
+
+        for seg in job.segments:
+            record = {
+                'source': str(map_root_path(job.source)),
+                'dest': str(map_root_path(seg.output)),
+                'moveTo': str(map_root_path(job.moveTo)),
+                'start': seg.start,
+                'length': seg.length if seg.length is not None else ec.videoLen,
+                'cq': None if _args.target_bitrate else ec.targetCq,
+                'bitrate': ec.targetBitrate if _args.target_bitrate else None,
+                'setfps': ec.setfps,
+                'fps': ec.fps,
+                'sourceBitrate': ec.sourceBitrate,
+                'videoLength': ec.videoLen,
+                'width': ec.width,
+                'height': ec.height,
+                'cost': round(seg.cost, 1),
+                'options': job.options
+            }
+
+            if shard is not None:
+                record['shard'] = shard + 1
+
+            self._f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.count += 1
+
+
+_export_fields = ['dir', 'file', 'ext', 'size', 'fps', 'frames', 'width', 'height', 'seconds', 'bitrate', 'grp_enc', 'grp_res',
+                  'fps_over', 'bitrate_over', 'listed']
+
+
+# one record per scanned file for --export, plain values without colours, None where the probe failed
+class CsvExport(runner.AtomicFile):
+    count: int
+
+    def __init__(self, path: Path):
+        super().__init__(path, newline='')
+        self.count = 0
+        self._w = csv.DictWriter(self._f, fieldnames=_export_fields)
+        self._w.writeheader()
+
+    def write(self, record: Dict[str, Any]):
+        self._w.writerow(record)
+        self.count += 1
+
+
+class NdjsonExport(runner.AtomicFile):
+    count: int
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.count = 0
+
+    def write(self, record: Dict[str, Any]):
+        self._f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+
+
+export_writers: Dict[str, Callable[[Path], Union[CsvExport, NdjsonExport]]] = {
+    '.csv': CsvExport,
+    '.ndjson': NdjsonExport,
+    '.jsonl': NdjsonExport
+}
+
+
+def open_export() -> Union[CsvExport, NdjsonExport, None]:
+    if not _args.export:
+        return None
+
+    path = Path(_args.export).resolve()
+    return export_writers[path.suffix.lower()](path)
+
+
+def export_record(dir_clean: str, f: Path, datum: Dict[str, Any]) -> Dict[str, Any]:
+    seconds = datum['_seconds']
+    bitrate = datum['_size'] / 1000000 * 8 / seconds if seconds else None
+
+    return {
+        'dir': dir_clean,
+        'file': f.name,
+        'ext': f.suffix.lower(),
+        'size': datum['_size'],
+        'fps': datum['_fps'] or None,
+        'frames': datum['_frames'] if seconds else None,
+        'width': datum['_width'] or None,
+        'height': datum['_height'] or None,
+        'seconds': seconds,
+        'bitrate': bitrate,
+        'grp_enc': datum['_grp_enc'],
+        'grp_res': datum['_grp_res'],
+        'fps_over': datum['_fps'] > _max_fps,
+        # same rounding the listing applies before comparing
+        'bitrate_over': bitrate is not None and round(bitrate, 1) > _args.bitrate_limit,
+        'listed': datum['_include']
+    }
+
+
+def manifest_tee(jobs: Iterable[runner.FileJob], mw: Union[ManifestWriter, None], shard: int = None) -> Iterator[runner.FileJob]:
+    for job in jobs:
+        if mw:
+            mw.write_job(job, shard)
+        yield job
+
+
+def open_journal() -> Union[runner.Journal, None]:
+    return None if _args.no_journal else runner.Journal(_root_dir / runner.journal_name)
+
+
+def log_skips(jobs: List[runner.FileJob]) -> int:
+    tot = 0
+    done = 0
+    existing = 0
+    saved = 0
+
+    for j in jobs:
+        tot += len(j.segments)
+        done += j.done
+        existing += len(j.existing)
+        saved += sum(s.cost for s in j.existing)
+
+    if done:
+        log(f'Skipping {done} segments already finished according to the journal')
+    if existing:
+        log(f'Skipping {existing} segments already encoded in their dest folders, saving {saved / 3600:.2f} 1080p30 encode hours')
+
+    return tot
+
+
+def queue_file_name(shard: int = None) -> str:
+    return runner.queue_file_name(shard, _args.win)
+
+
+def log_shards(shards: List[List[runner.FileJob]]):
+    total = sum(j.cost for shard in shards for j in shard) or 1
+    data = []
+
+    for (i, shard) in enumerate(shards):
+        cost = sum(j.cost for j in shard)
+
+        data.append({
+            'queue': queue_file_name(i),
+            'files': len(shard),
+            'segments': sum(len(j.segments) for j in shard),
+            '1080p30 hours': round(cost / 3600, 2),
+            'share': f'{cost / total:.0%}',
+            '_rowcolor': shellcolors.OKGREEN
+        })
+
+    print_table(data, col_order=['queue', 'files', 'segments', '1080p30 hours', 'share'])
+
+
+def log_policies(jobs: List[runner.FileJob]):
+    data = []
+
+    for (name, policy) in runner.policies.items():
+        (makespan, mean_done) = runner.simulate(policy(jobs), _args.sessions)
+
+        data.append({
+            'order': name,
+            'makespan h': round(makespan / 3600, 2),
+            'mean file done h': round(mean_done / 3600, 2),
+            '_rowcolor': shellcolors.OKGREEN if name == _args.order else shellcolors.OFF
+        })
+
+    log(f'Predicted with {_args.sessions} sessions, in 1080p30 encode hours')
+    print_table(data, col_order=['order', 'makespan h', 'mean file done h'])
+
+
 def write_queue(batches: List[enc.EncodeBatch], queue_dir: Path) -> object:
-    cmds = []
-    # tot = reduce(lambda a,b: a + len(b.files), batches, 0)
-    tot = reduce(lambda a, b: a + reduce(lambda at, bt: at + (1 if not bt.multiTimes else len(bt.times)), b.files, 0), batches, 0)
+    journal = open_journal()
+    # planned once, the journal and dest folder checks behind every job are too costly to repeat for the count
+    jobs = [j for b in batches for j in batch_jobs(b, journal)]
+    tot = log_skips(jobs)
+
     log(f'Queue Size: {tot}')
+    shards = None
+
+    if _args.plan:
+        log_policies(jobs)
+
+    if _args.shards > 1:
+        shards = [runner.policies[_args.order](shard) for shard in runner.shard_jobs(jobs, _args.shards)]
+        log_shards(shards)
 
     if _args.plan:
         return
 
-    qi = 0
+    preamble = _script_preamble
 
-    for b in batches:
-        if not b.destFolder.exists() and b.files:
-            os.makedirs(b.destFolder)
+    if journal:
+        journal.compact()
 
-        # os.chown(b.destFolder, _nobody_uid, _users_gid)
-        # os.chmod(b.destFolder, 0o0777)
+        if not _args.win:
+            preamble += runner.journal_function(cmd_path_map(map_root_path(journal.path)))
 
-        for f in b.files:
-            cmd = ''
-            quality = ''
-            fps = ''
+    mw = ManifestWriter(queue_dir / _args.manifest) if _args.manifest else None
 
-            if _args.win:
-                cmd = f'HandBrakeCLI.exe --preset "H.265 NVENC 1080p"'
-            else:
-                cmd = f'HandBrakeCLI --preset "H.265 NVENC 1080p"'
+    try:
+        if shards:
+            for (i, shard) in enumerate(shards):
+                with QueueWriter(queue_dir / queue_file_name(i), preamble) as qw:
+                    for cmd in queue_commands(manifest_tee(shard, mw, i), sum(len(j.segments) for j in shard), journal):
+                        qw.write(cmd)
+        else:
+            with QueueWriter(queue_dir / queue_file_name(), preamble) as qw:
+                for cmd in queue_commands(manifest_tee(runner.policies[_args.order](jobs), mw), tot, journal):
+                    qw.write(cmd)
+    except BaseException:
+        if mw:
+            mw.discard()
+        raise
 
-            if _args.target_bitrate:
-                cmd += f' --vb {f.targetBitrate}'
-                quality = ''
-            else:
-                cmd += f' -q {f.targetCq}.0'
-                quality = f'-cq{f.targetCq}'
+    if mw:
+        mw.commit()
+        log(f'Wrote {mw.count} manifest records to {mw.path}')
 
-            if f.setfps and not f.setfps == 0:
-                cmd += f' -r {f.setfps} --pfr'
+    # queue files left over from an earlier run with a different split would encode the same work twice
+    if shards:
+        (queue_dir / queue_file_name()).unlink(missing_ok=True)
 
-            if f.setfps:
-                fps = f'-r{f.setfps}'
+    i = len(shards) if shards else 0
 
-            if _root_map:
-                source_path = Path(f.sourcePath.as_posix().replace(_root_map[0], _root_map[1]))
-                dest_folder = Path(b.destFolder.as_posix().replace(_root_map[0], _root_map[1]))
-            else:
-                source_path = f.sourcePath
-                dest_folder = b.destFolder
-
-            cmd += f' -i {cmd_path_map(source_path)}'
-            enc_suffix = f'-nvenc{quality}{fps}'
-            title = f.name
-            max_title_len = 20
-
-            if len(title) > max_title_len + 3:
-                title = f'{title[0:max_title_len]}...'
-
-            title = escape_shell_str(title)
-
-            if f.times:
-                ti = 0
-                for t in f.times:
-                    qi += 1
-                    cnt = f'-{ti}' if f.multiTimes else ''
-                    dest_path = dest_folder / f'{f.name}{cnt}{enc_suffix}.mp4'
-                    title_cmd = f'{_set_title} "{qi}/{tot} {title}" && ' if _set_title else ''
-                    cmds.append(f'{title_cmd}{cmd} -o {cmd_path_map(dest_path)} --start-at seconds:{t.start} --stop-at seconds:{t.length}')
-                    ti += 1
-            else:
-                qi += 1
-                dest_path = dest_folder / f'{f.name}{enc_suffix}.mp4'
-                title_cmd = f'{_set_title} "{qi}/{tot} {title}" && ' if _set_title else ''
-                cmds.append(f'{title_cmd}{cmd} -o {cmd_path_map(dest_path)}')
+    while (queue_dir / queue_file_name(i)).exists():
+        (queue_dir / queue_file_name(i)).unlink()
+        i += 1
 
-            if _args.win:
-                cmds.append(f'move /y {cmd_path_map(source_path)} {cmd_path_map(dest_folder / f.fileName)}')
-            else:
-                # if Path(f.fileName).suffix == '.mkv':
-                #     dest1 = dest_folder / f'{f.fileName}v'
-                #     dest2 = dest_folder / f'{f.fileName}'
-                #     # cmds.append(f'mv {cmd_path_map(source_path)} {cmd_path_map(dest1)} && mv {cmd_path_map(dest1)} {cmd_path_map(dest2)}')
-                #     cmds.append(f'mv {cmd_path_map(source_path)} {cmd_path_map(dest1)}')
-                # else:
-                #     cmds.append(f'mv {cmd_path_map(source_path)} {cmd_path_map(dest_folder / f.fileName)}')
-
-                #cmds.append('sleep 1')
-                #cmds.append(f'ls -lha {cmd_path_map(dest_folder)}')
-                #cmds.append(f'ls -lha "$(dirname {cmd_path_map(source_path)})"')
-
-                cmds.append(f'mv {cmd_path_map(source_path)} {cmd_path_map(dest_folder / f.fileName)}')
-    qfp = os.path.join(queue_dir, 'queue.bat' if _args.win else 'queue.sh')
-    qf = open(qfp, "w")
-    qf.truncate()
-    cmd_delim = " && ^\n" if _args.win else ";\n"
-
-    if cmds:
-        if _set_title:
-            cmds.append(f'{_set_title} "Queue Completed"')
-        qf.write(_script_preamble + cmd_delim.join(cmds))
-    else:
-        qf.write(cmd_delim.join(['echo no items']))
 
-    qf.close()
-    # st = os.stat(qfp)
-    # os.chmod(qfp, st.st_mode | stat.S_IEXEC)
 
+def probe_duration(path: Path) -> Union[float, None]:
+    try:
+        pr = probe.probe_path(str(path), probe.get_backends('header', _args.max_captures))
+    except probe.ProbeError:
+        return None
+
+    return pr.frames / pr.fps if pr.fps else None
+
+
+def run_queue(batches: List[enc.EncodeBatch]):
+    journal = open_journal()
+
+    if journal:
+        journal.compact()
+
+    jobs = runner.policies[_args.order]([j for b in batches for j in batch_jobs(b, journal)])
+    log_skips(jobs)
+    chunk_len = _args.chunk_minutes * 60
+    tasks = sum(len(runner.split_segment(j, seg, chunk_len)) or 1 for j in jobs for seg in j.segments)
+    workers = max(1, min(_args.sessions, tasks))
+    encoder = runner.encoders[_args.encoder]()
+    bars = [] if _args.no_bar else [tqdm(total=100, position=i, desc=f'#{i} idle', bar_format='{desc:40.40} {percentage:3.0f}%|{bar}|') for i in range(workers)]
+    log(f'Running {len(jobs)} files on {workers} sessions')
+    log_lock = threading.Lock()
+
+    def on_start(wi: int, job: runner.FileJob, seg: runner.Segment):
+        if bars:
+            bars[wi].reset()
+            bars[wi].set_description(f'#{wi} {seg.start or 0}s {job.title}', refresh=True)
+        else:
+            with log_lock:
+                log(f'#{wi} {seg.output.name}')
+
+    def on_progress(wi: int, pct: float):
+        if bars:
+            bars[wi].n = pct
+            bars[wi].refresh()
+
+    def on_done(wi: int, job: runner.FileJob, seg: runner.Segment, status: int):
+        if status == 0:
+            return
+
+        msg = f'#{wi} exited with {status}: {seg.output.name}'
+
+        if bars:
+            tqdm.write(f'{shellcolors.FAIL}{msg}{shellcolors.OFF}')
+        else:
+            with log_lock:
+                error(msg)
+
+    # stub outputs aren't real videos, so there's nothing to probe
+    duration = None if _args.encoder == 'stub' else probe_duration
+    stager = runner.Stager(Path(_args.stage_dir) / f'.hbscripter-stage-{os.getpid()}', int(_args.stage_gb * 1073741824)) if _args.stage_dir else None
+    stats = runner.run_jobs(jobs, workers, encoder, journal, on_start, on_progress if bars else None, on_done, chunk_len, duration, stager)
+
+    for b in bars:
+        b.close()
+
+    data = []
+    realtime = lambda sec, busy: f'{sec / busy:.1f}x' if busy else '-'
+
+    for (wi, ws) in enumerate(stats.workers):
+        data.append({
+            'session': f'#{wi}',
+            'segments': ws.segments,
+            'failed': ws.failed,
+            'busy': str(datetime.timedelta(seconds=round(ws.busy))),
+            'media': str(datetime.timedelta(seconds=round(ws.seconds))),
+            'speed': realtime(ws.seconds, ws.busy),
+            '_rowcolor': shellcolors.FAIL if ws.failed else shellcolors.OKGREEN
+        })
+
+    print_table(data, col_order=['session', 'segments', 'failed', 'busy', 'media', 'speed'])
+    if stats.cleaned:
+        log(f'Removed {stats.cleaned} unfinished outputs from interrupted encodes')
+
+    log(f'{stats.segments} segments, {stats.moved}/{stats.files} files done in {datetime.timedelta(seconds=round(stats.wall))}: '
+        f'{realtime(stats.seconds, stats.wall)} realtime, {stats.outputBytes / 1073741824:.2f} GB written')
+
+    if stager:
+        log(f'Staged {stager.staged} sources ({stager.stagedBytes / 1073741824:.2f} GB) through {_args.stage_dir}')
+
+    for f in stats.failed:
+        error(f'Not moved, encode failed: {f}')
 
 
 def flag_file(ef: enc.EncodeConfig):
@@ -380,29 +1013,46 @@ def create_batch(enc_files: List[enc.EncodeConfig], dest_folder: Path, short_dir
     no_opt_msg = f'\tNo options set' if noopt else ''
     print(f'{shellcolors.BOLD}{no_opt_msg_color}Files in {short_dir if short_dir else "/"}{no_opt_msg}{shellcolors.OFF}\n\t{file_strs}{shellcolors.OFF}')
 
-    if not _args.plan:
-        batch = list(filter(lambda ef: not ef.exclude, enc_files))
-        if len(batch) > 0:
-            batch = enc.EncodeBatch(batch, dest_folder, short_dir)
-            _single_queue.append(batch)
-
-
-def scan_dir(full_dir: Path):
+    # --plan still collects the batches for its queue size and order predictions, it just doesn't write them
+    batch = list(filter(lambda ef: not ef.exclude, enc_files))
+    if len(batch) > 0:
+        batch = enc.EncodeBatch(batch, dest_folder, short_dir)
+        _single_queue.append(batch)
+
+
+@dataclass
+class DirScan:
+    fullDir: Path
+    shortDir: str
+    destFolder: Path
+    hasFiles: bool
+    cq: int
+    mcq: int
+    mxcq: int
+    skipResCheck: bool
+    noopt: bool
+    candidates: List[Tuple[Path, str, Any, Any]]
+    configsSig: Tuple = ()
+    cached: List[enc.EncodeConfig] = None
+
+
+def read_dir(full_dir: Path) -> DirScan:
     short_dir = full_dir.relative_to(_root_dir).as_posix()
     log_trace(f'Checking {short_dir}')
-    files = [f for f in full_dir.glob('*') if f.is_file() and f.suffix.lower() in _extensions.keys()]
-    configs = dict([(c.stem, c) for c in full_dir.glob('*') if c.is_file() and c.suffix.lower() == '.json'])
-    optfiles = full_dir.glob('_.*')
-
-    for c in configs:
-        with open(configs[c]) as cf:
-            configs[c] = json.load(cf)
+    listing = get_listing(full_dir)
+    files = listing.videos
+    configs = dict([(c.stem, c) for c in listing.configs])
+    optfiles = listing.optFiles
+    # config edits don't change the directory mtime, so they're part of the index key
+    configs_sig = tuple(sorted((c.name, c.stat().st_mtime_ns) for c in listing.configs))
+    dest_folder = full_dir / _dest_folder_name
 
     cq = None
     mcq = 28
     mxcq = 50
     skip_res_check = False
     noopt = True
+    candidates = []
 
     if files:
         for f in optfiles:
@@ -429,20 +1079,20 @@ def scan_dir(full_dir: Path):
                     cq = int(cqv)
                     log_trace(f'cq: {cq}')
 
-        dest_folder = full_dir / _dest_folder_name
+        cached = _dir_index.get_scan(full_dir, configs_sig) if _dir_index else None
 
-        enc_files = []
+        if cached is not None:
+            log_trace(f'Reusing plan for {short_dir}')
+            return DirScan(full_dir, short_dir, dest_folder, True, cq, mcq, mxcq, skip_res_check, noopt, [], configs_sig, cached)
 
-        for f in files:
-            fmcq = mcq
-            fmxcq = mxcq
+        for c in configs:
+            with open(configs[c]) as cf:
+                configs[c] = json.load(cf)
 
+        for f in files:
             if f.stem.startswith('~') or f.stem.startswith('!!'):
                 continue
 
-            ext = f.suffix.lower()
-            clean_path = str(f).replace(_root_dir.as_posix(), '')
-
             valid_cfg = False
 
             if f.name in configs:
@@ -482,46 +1132,92 @@ def scan_dir(full_dir: Path):
             if not valid_cfg:
                 continue
 
-            try:
-                v = cv2.VideoCapture(str(f))
-                fps = v.get(cv2.CAP_PROP_FPS)
-                frames = int(v.get(cv2.CAP_PROP_FRAME_COUNT))
-                vlen = math.ceil(frames / fps) + 1
-                vkb = (f.stat().st_size / 1000) * 8
-                bitrate = math.ceil(vkb / vlen)
-
-                if not skip_res_check:
-                    height = v.get(cv2.CAP_PROP_FRAME_HEIGHT)
-                    width = v.get(cv2.CAP_PROP_FRAME_WIDTH)
-                    res = height if height < width else width
-
-                    if res < 720 and fmcq < 30:
-                        fmcq = 30
-                        if fmxcq < fmcq:
-                            fmxcq = fmcq
-                    elif res < 1080 and fmcq < 28:
-                        fmcq = 28
-                        if fmxcq < fmcq:
-                            fmxcq = fmcq
-
-                log_trace(f'enc_bitrate: {enc_bitrate}')
-                ec = enc.EncodeConfig(full_dir, dest_folder, f.name, name, times, vlen, fps, bitrate, ext, cq, enc_bitrate, mcq, mxcq)
-                log_trace(f'self.targetCq: {ec.targetCq}')
-                log_trace(f'self.setfps: {ec.setfps}')
-
-                if ec.targetCq > mxcq and not enc_bitrate:
-                    ec.resDropped = True
-
-                enc_files.append(ec)
-            except Exception as e:
-                error(f'Error parsing {clean_path}\n{e}')
-                traceback.print_exc()
-
-        if enc_files:
-            _file_sorter(lambda x: x.name, enc_files)
-            create_batch(enc_files, dest_folder, short_dir, full_dir, noopt)
+            candidates.append((f, name, times, enc_bitrate))
+
+    return DirScan(full_dir, short_dir, dest_folder, bool(files), cq, mcq, mxcq, skip_res_check, noopt, candidates, configs_sig)
+
+
+def scan_dir(ds: DirScan):
+    if not ds.hasFiles:
+        log(f'Folder is empty: {ds.shortDir}', shellcolors.OKGREEN)
+        return
+
+    if ds.cached is not None:
+        enc_files = ds.cached
     else:
-        log(f'Folder is empty: {short_dir}', shellcolors.OKGREEN)
+        enc_files = evaluate_dir(ds)
+
+    if enc_files:
+        _file_sorter(lambda x: x.name, enc_files)
+        create_batch(enc_files, ds.destFolder, ds.shortDir, ds.fullDir, ds.noopt)
+
+
+def evaluate_dir(ds: DirScan) -> List[enc.EncodeConfig]:
+    errors = False
+    cq = ds.cq
+    mcq = ds.mcq
+    mxcq = ds.mxcq
+    enc_files = []
+
+    for (f, name, times, enc_bitrate) in ds.candidates:
+        fmcq = mcq
+        fmxcq = mxcq
+
+        ext = f.suffix.lower()
+        clean_path = str(f).replace(_root_dir.as_posix(), '')
+
+        try:
+            pr = probe_file(f)
+            fps = pr.fps
+            frames = pr.frames
+            vlen = math.ceil(frames / fps) + 1
+            vkb = (f.stat().st_size / 1000) * 8
+            bitrate = math.ceil(vkb / vlen)
+
+            if not ds.skipResCheck:
+                height = pr.height
+                width = pr.width
+                res = height if height < width else width
+
+                if res < 720 and fmcq < 30:
+                    fmcq = 30
+                    if fmxcq < fmcq:
+                        fmxcq = fmcq
+                elif res < 1080 and fmcq < 28:
+                    fmcq = 28
+                    if fmxcq < fmcq:
+                        fmxcq = fmcq
+
+            log_trace(f'enc_bitrate: {enc_bitrate}')
+            ec = enc.EncodeConfig(ds.fullDir, ds.destFolder, f.name, name, times, vlen, fps, bitrate, ext, cq, enc_bitrate, mcq, mxcq)
+            ec.width = pr.width
+            ec.height = pr.height
+
+            # merged here so the plan listing, queue, manifest and --run all see the same spans
+            if _args.merge_gap is not None:
+                ec.times = enc.merge_spans(ec.times, _args.merge_gap)
+                ec.multiTimes = len(ec.times) > 1
+
+            log_trace(f'self.targetCq: {ec.targetCq}')
+            log_trace(f'self.setfps: {ec.setfps}')
+
+            if ec.targetCq > mxcq and not enc_bitrate:
+                ec.resDropped = True
+
+            enc_files.append(ec)
+        except probe.ProbeError as e:
+            errors = True
+            error(f'Error parsing {clean_path}\n{e}')
+        except Exception as e:
+            errors = True
+            error(f'Error parsing {clean_path}\n{e}')
+            traceback.print_exc()
+
+    # snapshot before create_batch flags exclusions, and skip dirs with errors so they're retried
+    if _dir_index and not errors:
+        _dir_index.put_scan(ds.fullDir, ds.configsSig, enc_files)
+
+    return enc_files
 
 
 # List headers
@@ -535,7 +1231,38 @@ class LH:
     len_hdr = 'length'
 
 
-def file_details(f: Path, get_fps, get_bitrate, get_length) -> Dict[str, Union[str, int]]:
+# a group's rows in listing order
+def sort_rows(rows: List[Dict[str, Any]]):
+    _file_sorter(lambda dt: dt[LH.path_hdr], rows)
+
+
+# named groups of more than one row are set apart by blank rows and get their paths marked
+def grouped_rows(groups: List[Tuple[str, List[Dict[str, Any]]]]) -> List[Union[Dict[str, Any], str]]:
+    grp_data = []
+    grp_sep = ' '
+
+    for (gn, g) in groups:
+        if _args.excl_ungrp and not gn:
+            continue
+
+        if len(g) > 1:
+            if grp_data and not isinstance(grp_data[-1], str):
+                grp_data.append(grp_sep)
+            grp_data.extend(g)
+            grp_data.append(grp_sep)
+            if not _args.excl_ungrp and gn:
+                for dt in g:
+                    dt[LH.path_hdr] = '| ' + dt[LH.path_hdr]
+        else:
+            grp_data.extend(g)
+
+    if grp_data and isinstance(grp_data[-1], str):
+        grp_data.pop()
+
+    return grp_data
+
+
+def display_name(f: Path) -> str:
     fname = f.name
 
     # print(len(fname))
@@ -550,30 +1277,34 @@ def file_details(f: Path, get_fps, get_bitrate, get_length) -> Dict[str, Union[s
         else:
             fname = f'{f.stem[:lencap+10]}...'
 
-    datum = {LH.path_hdr: fname, '_stem': f.stem, '_include': False}
+    return fname
 
-    ms1 = _rx_enc_settings_strip.search(f.stem)
-    ms2 = _rx_enc_res_strip.search(f.stem)
 
-    if ms1:
-        datum['_grp_enc'] = _rx_enc_settings_strip.sub('', f.stem)
-        datum['_grp_res'] = None
-    elif ms2:
-        datum['_grp_enc'] = None
-        datum['_grp_res'] = _rx_enc_res_strip.sub('', f.stem)
-    else:
-        datum['_grp_enc'] = None
-        datum['_grp_res'] = f.stem
+def file_details(f: Path, get_fps, get_bitrate, get_length, table: 'mediaTable.MediaTable' = None, dir_id: int = 0) -> Dict[str, Union[str, int]]:
+    datum = {LH.path_hdr: display_name(f), '_stem': f.stem, '_include': False}
+    (datum['_grp_enc'], datum['_grp_res']) = grouping.group_keys(f.stem)
+
+    try:
+        pr = probe_file(f)
+    except probe.ProbeError as e:
+        log_trace(e)
+        pr = probe.ProbeResult(0, 0, 0, 0)
 
-    v = cv2.VideoCapture(str(f))
-    fps = v.get(cv2.CAP_PROP_FPS)
-    frames = int(v.get(cv2.CAP_PROP_FRAME_COUNT))
+    size = f.stat().st_size
+
+    if table is not None:
+        table.add(dir_id, f, size, pr.fps, pr.frames, pr.width, pr.height)
+
+    fps = pr.fps
+    frames = pr.frames
 
     if fps == 0:
         vlen = None
     else:
         vlen = math.ceil(frames / fps) + 1
 
+    datum.update({'_size': size, '_fps': fps, '_frames': frames, '_width': pr.width, '_height': pr.height, '_seconds': vlen})
+
     if get_fps:
         above_threshold = fps > _max_fps
         datum['_fps_exc'] = above_threshold
@@ -588,7 +1319,7 @@ def file_details(f: Path, get_fps, get_bitrate, get_length) -> Dict[str, Union[s
 
     if get_bitrate:
         if vlen:
-            vmb = (f.stat().st_size / 1000000) * 8
+            vmb = (size / 1000000) * 8
             bitrate = round(vmb / vlen, 1)
 
             above_threshold = bitrate > _args.bitrate_limit
@@ -621,7 +1352,16 @@ def file_details(f: Path, get_fps, get_bitrate, get_length) -> Dict[str, Union[s
     return datum
 
 
+def skip_file(f: Path) -> bool:
+    if _file_filter and not re.search(_file_filter, f.name, flags=re.IGNORECASE):
+        return True
+    return f.stat().st_size < _min_bytes
+
+
 def list_details(dirs: Union[List[Path], Path], file_count):
+    # numpy takes a while to import, only the list and stats modes need it
+    import mediaTable
+
     expanded_table = True if sum([_list_fps, _list_bitrate]) > 1 or _args.list_folder_summaries else False
     folder_summaries_only = True if sum([_list_fps, _list_bitrate]) < 1 else False
     data: List[Union[Dict[str, Union[str, int]], str]] = []
@@ -632,7 +1372,14 @@ def list_details(dirs: Union[List[Path], Path], file_count):
     if isinstance(dirs, Path):
         if dirs.is_file():
             fd = file_details(dirs, _list_fps or folder_summaries_only, _list_bitrate or folder_summaries_only, _args.list_length)
+
             print_table([fd], data_row_color=shellcolors.OKGREEN, col_order=col_order, show_headers=sum([_list_fps, _list_bitrate]) > 1)
+            ex = open_export()
+
+            if ex:
+                ex.write(export_record('', dirs, fd))
+                ex.commit()
+                log(f'Exported {ex.count} rows to {ex.path}')
             return
         else:
             print('Bad args combo')
@@ -641,108 +1388,109 @@ def list_details(dirs: Union[List[Path], Path], file_count):
     def clean_path(p: Path):
         return p.relative_to(_root_dir).as_posix()
 
-    _file_sorter(lambda x: clean_path(x), dirs, _root_dir)
+    def dir_files(d: Path) -> List[Path]:
+        files = get_listing(d).videos
+        _file_sorter(lambda x: x.name, files, d, True)
+        return files
+
+    _file_sorter(lambda x: clean_path(x), dirs, _root_dir, False)
+
+    listing = ((d, dir_files(d)) for d in dirs)
+    stream = None
+
+    if _args.stream:
+        # everything was listed by the walk already, so the widths cost a pass over names and not a probe. Probed
+        # columns get the widest value their format prints, the rows can't be looked at before they're streamed.
+        listing = list(listing)
+        count_width = len(str(file_count))
+        widths = {
+            LH.dir_hdr: max((len(clean_path(d)) for d in dirs), default=0),
+            LH.path_hdr: max([len(display_name(f)) + 2 for (d, files) in listing for f in files] + [count_width]),
+            # six significant digits, or a folder's count over the limit
+            LH.fps_hdr: max(7, count_width + len(f' > {_max_fps}')),
+            LH.bitrate_hdr: max(7, count_width + len(f' > {_max_bitrate}')),
+            # 99 days, 23:59:59
+            LH.len_hdr: 17,
+            LH.files_hdr: count_width,
+            max_fps_hdr: count_width,
+            max_bitrate_hdr: count_width,
+            LH.fullpath_hdr: max((len(str(p)) for (d, files) in listing for p in [d, *files]), default=0)
+        }
+
+    if _args.jobs > 1 and not _args.stream:
+        listing = list(listing)
+        to_probe = [f for (d, files) in listing for f in files if not skip_file(f)]
+
+        if not _args.no_bar and len(to_probe) > 30:
+            pbar = tqdm(total=len(to_probe), desc='Probing files')
+        else:
+            pbar = None
+            if _args.no_bar:
+                print('Probing files')
+
+        prefetch_probes(to_probe, pbar.update if pbar else None)
 
-    if not _args.no_bar and file_count > 30:
+        if pbar:
+            pbar.close()
+            pbar = None
+    elif not _args.no_bar and file_count > 30:
         pbar = tqdm(total=file_count, desc='Scanning files')
     else:
         pbar = None
         if _args.no_bar:
             print('Scanning files')
 
-    fld_count = 0
-
-    for d in dirs:
-        groupings: List[Union[str, List[Dict[str, Union[str, int]]]]] = []
-
-        dir_clean = clean_path(d)
+    if _args.stream:
+        # print_table drops the columns no row has, here they have to be known before the first row
+        if folder_summaries_only:
+            cols = [LH.dir_hdr, LH.files_hdr, max_fps_hdr, max_bitrate_hdr]
+        else:
+            cols = [LH.dir_hdr, LH.path_hdr]
+            cols += [LH.fps_hdr] if _list_fps else []
+            cols += [LH.bitrate_hdr] if _list_bitrate else []
+            cols += [LH.len_hdr] if _args.list_length else []
 
-        if not dir_clean:
-            dir_clean = '[root]'
+            # summaries of folders with nothing to list keep their counts
+            if _args.list_folder_summaries and _list_error_only:
+                cols += [LH.files_hdr] + ([max_fps_hdr] if _list_fps else []) + ([max_bitrate_hdr] if _list_bitrate else [])
 
-        files = [f for f in d.glob('*') if f.is_file() and f.suffix.lower() in _extensions.keys()]
-        _file_sorter(lambda x: x.name, files, d)
+        cols += [LH.fullpath_hdr] if _args.trace else []
 
-        fld_datum = {LH.dir_hdr: dir_clean, '_fld_datum': True, '_include': False}
+        print()
+        stream = TableStream(cols, widths, shellcolors.OKGREEN, ['| '], expanded_table, tqdm.write if pbar else print)
 
-        for f in files:
-            if _file_filter and not re.search(_file_filter, f.name, flags=re.IGNORECASE):
-                if pbar:
-                    pbar.update()
-                continue
-            if f.stat().st_size < _min_bytes:
-                if pbar:
-                    pbar.update()
-                continue
+    # streaming probes just ahead of the folder being printed instead of the whole tree up front
+    if _args.stream and _args.jobs > 1:
+        ahead = probe.probe_iter((f for (d, files) in listing for f in files if not skip_file(f)), _args.jobs, _probe_cache,
+                                 _probe_backends, _args.max_captures)
+    else:
+        ahead = None
 
+    fld_count = 0
+    table = mediaTable.MediaTable()
+    ex = open_export()
+    # folders whose rows wait for the counts, all of them unless streaming
+    pending: List[Tuple[Path, int, Dict[str, Union[str, int]], List]] = []
+    # a streamed folder waiting to see if a second one is listed, see drop_folder_headers
+    held: List[Union[Dict[str, Union[str, int]], str]] = []
+
+    # with fewer than two folders listed the compact table leaves out the folder header rows
+    def drop_folder_headers(rows: List) -> List:
+        return [d for d in rows if '_fld_datum' not in d or not d['_fld_datum']]
+
+    def finish_folder(d: Path, fld_datum: Dict[str, Union[str, int]], rows: List, files: int, fps_over: int, btr_over: int) -> List:
+        nonlocal fld_count
+        section: List[Union[Dict[str, Union[str, int]], str]] = []
+
+        if files:
             if _args.list_folder_summaries:
-                if LH.files_hdr not in fld_datum:
-                    fld_datum[LH.files_hdr] = 1
-                else:
-                    fld_datum[LH.files_hdr] += 1
-
-            datum = file_details(f, _list_fps or folder_summaries_only, _list_bitrate or folder_summaries_only, _args.list_length)
-
+                fld_datum[LH.files_hdr] = files
             if _list_fps or folder_summaries_only:
-                if max_fps_hdr not in fld_datum:
-                    fld_datum[max_fps_hdr] = 0
-
-                if datum['_fps_exc']:
-                    if folder_summaries_only:
-                        fld_datum['_rowcolor'] = shellcolors.FAIL
-
-                    fld_datum[max_fps_hdr] += 1
-
+                fld_datum[max_fps_hdr] = fps_over
             if _list_bitrate or folder_summaries_only:
-                if max_bitrate_hdr not in fld_datum:
-                    fld_datum[max_bitrate_hdr] = 0
-
-                if '_btr_exc' in datum and datum['_btr_exc']:
-                    if folder_summaries_only:
-                        fld_datum['_rowcolor'] = shellcolors.FAIL
-
-                    fld_datum[max_bitrate_hdr] += 1
-
-            if datum['_include'] or folder_summaries_only:
-                fld_datum['_include'] = True
-
-            if pbar:
-                pbar.update()
-
-            if not folder_summaries_only and datum['_include']:
-                if not groupings:
-                    groupings.append([datum['_grp_enc'] or '', datum])
-                else:
-                    prev_grouping = groupings[-1]
-
-                    if datum['_grp_enc']:
-                        grouping = []
-
-                        if prev_grouping[0] == '':
-                            while True:
-                                if isinstance(prev_grouping[-1], str):
-                                    prev_grouping.pop()
-                                    break
-                                elif prev_grouping[-1]['_grp_res'] and prev_grouping[-1]['_grp_res'].startswith(datum['_grp_enc']):
-                                    prev_datum = prev_grouping.pop()
-                                    prev_datum['_grp_enc'] = datum['_grp_enc']
-                                    grouping.append(prev_datum)
-                                else:
-                                    break
-
-                            _file_sorter(lambda dt: dt[LH.path_hdr], grouping)
-
-                        if not prev_grouping:
-                            groupings.pop()
-
-                        grouping.insert(0, datum['_grp_enc'])
-                        grouping.append(datum)
-                        groupings.append(grouping)
-                    else:
-                        if not prev_grouping[0] or datum['_grp_res'].startswith(prev_grouping[0]):
-                            prev_grouping.append(datum)
-                        else:
-                            groupings.append(['', datum])
+                fld_datum[max_bitrate_hdr] = btr_over
+            if folder_summaries_only and (fps_over or btr_over):
+                fld_datum['_rowcolor'] = shellcolors.FAIL
 
         if fld_datum['_include']:
             fld_count += 1
@@ -751,11 +1499,11 @@ def list_details(dirs: Union[List[Path], Path], file_count):
             fld_datum['fullpath'] = d
 
         if _args.list_folder_summaries:
-            data.append(fld_datum)
+            section.append(fld_datum)
 
         if not folder_summaries_only and fld_datum['_include']:
             if not _args.list_folder_summaries:
-                data.append({LH.dir_hdr: shellcolors.OKBLUE + fld_datum[LH.dir_hdr] + shellcolors.OFF, '_fld_datum': True})
+                section.append({LH.dir_hdr: shellcolors.OKBLUE + fld_datum[LH.dir_hdr] + shellcolors.OFF, '_fld_datum': True})
             else:
                 fld_datum[LH.dir_hdr] = shellcolors.OKBLUE + fld_datum[LH.dir_hdr] + shellcolors.OFF
                 fld_datum[LH.path_hdr] = fld_datum[LH.files_hdr]
@@ -773,36 +1521,95 @@ def list_details(dirs: Union[List[Path], Path], file_count):
                         fld_datum[LH.bitrate_hdr] = f'{shellcolors.FAIL}{str(fld_datum[max_bitrate_hdr])}{shellcolors.OFF} > {_max_bitrate}'
                     fld_datum.pop(max_bitrate_hdr)
 
-            grp_data = []
-            grp_sep = ' '
+            grp_data = grouped_rows(grouping.group_variants(rows, sort_rows))
+
+            if grp_data:
+                section.extend(grp_data)
+            else:
+                section.pop()
+
+        return section
+
+    try:
+        for (d, files) in listing:
+            rows: List[Dict[str, Union[str, int]]] = []
+
+            dir_clean = clean_path(d)
+
+            if not dir_clean:
+                dir_clean = '[root]'
 
-            for g in groupings:
-                gn = g.pop(0)
+            fld_datum = {LH.dir_hdr: dir_clean, '_fld_datum': True, '_include': False}
+            dir_id = table.add_dir(dir_clean)
+            lo = table.rows
 
-                if _args.excl_ungrp and not gn:
+            for f in files:
+                if skip_file(f):
+                    if pbar:
+                        pbar.update()
                     continue
 
-                if len(g) > 1:
-                    if grp_data and not isinstance(grp_data[-1], str):
-                        grp_data.append(grp_sep)
-                    grp_data = grp_data + g
-                    grp_data.append(grp_sep)
-                    if not _args.excl_ungrp and gn:
-                        for dt in g:
-                            dt[LH.path_hdr] = '| ' + dt[LH.path_hdr]
-                else:
-                    grp_data = grp_data + g
+                if ahead:
+                    _probe_results.update([next(ahead)])
 
-            if grp_data:
-                if isinstance(grp_data[-1], str):
-                    grp_data.pop()
+                datum = file_details(f, _list_fps or folder_summaries_only, _list_bitrate or folder_summaries_only, _args.list_length, table, dir_id)
+
+                if ex:
+                    ex.write(export_record(dir_clean, f, datum))
+
+                if datum['_include'] or folder_summaries_only:
+                    fld_datum['_include'] = True
+
+                if pbar:
+                    pbar.update()
+
+                if not folder_summaries_only and datum['_include']:
+                    rows.append(datum)
+
+            if stream:
+                held += finish_folder(d, fld_datum, rows, *table.range_counts(_max_fps, _args.bitrate_limit, lo))
 
-                data = data + grp_data
+                if expanded_table or fld_count >= 2:
+                    stream.write(held)
+                    held = []
             else:
-                data.pop()
+                pending.append((d, dir_id, fld_datum, rows))
+    except BaseException:
+        if ex:
+            ex.discard()
+        raise
+
+    if ahead:
+        ahead.close()
+
+    if ex:
+        ex.commit()
+        log(f'Exported {ex.count} rows to {ex.path}')
+
+    if held:
+        # nothing is printed yet, and like print_table the compact table has no folder column without the headers
+        stream = TableStream([c for c in cols if not c == LH.dir_hdr], widths, shellcolors.OKGREEN, ['| '], expanded_table, print)
+        stream.write(drop_folder_headers(held))
+
+    if pending:
+        # one pass over the columns counts every folder at once
+        (files, fps_over, btr_over) = table.dir_counts(_max_fps, _args.bitrate_limit)
+
+        for (d, dir_id, fld_datum, rows) in pending:
+            data.extend(finish_folder(d, fld_datum, rows, int(files[dir_id]), int(fps_over[dir_id]), int(btr_over[dir_id])))
+
+    if stream:
+        if pbar:
+            pbar.close()
+
+        if not stream.rows:
+            log('No data to list')
+
+        print('\n')
+        return
 
     if fld_count < 2 and not expanded_table:
-        data = list(filter(lambda d: '_fld_datum' not in d or not d['_fld_datum'], data))
+        data = drop_folder_headers(data)
 
     if pbar:
         pbar.close()
@@ -816,40 +1623,231 @@ def list_details(dirs: Union[List[Path], Path], file_count):
     print('\n')
 
 
-def scan_dirs(skip_dunder_dirs=True) -> Tuple[List[Path], int, List[Path]]:
-    log(f'Scanning {_root_dir}')
-    sdirs = [_root_dir]
+_stats_percentiles = [5, 25, 50, 75, 95, 100]
+_stats_bitrate_edges = [0, 1, 2, 3, 5, 8, 12, 20, math.inf]
+
+
+def library_stats(dirs: List[Path]):
+    import numpy as np
+    import mediaTable
+
+    _file_sorter(lambda x: x.relative_to(_root_dir).as_posix(), dirs, _root_dir, False)
+    files = []
+    table = mediaTable.MediaTable()
+
+    for d in dirs:
+        dir_id = table.add_dir(d.relative_to(_root_dir).as_posix())
+        files += [(dir_id, f) for f in get_listing(d).videos if not skip_file(f)]
+
+    pbar = tqdm(total=len(files), desc='Probing files') if not _args.no_bar and len(files) > 30 else None
+
+    if _args.jobs > 1:
+        prefetch_probes([f for (dir_id, f) in files], pbar.update if pbar else None)
+
+    for (dir_id, f) in files:
+        try:
+            pr = probe_file(f)
+        except Exception as e:
+            log_trace(e)
+            pr = probe.ProbeResult(0, 0, 0, 0)
+
+        table.add(dir_id, f, f.stat().st_size, pr.fps, pr.frames, pr.width, pr.height)
+
+        if pbar and _args.jobs <= 1:
+            pbar.update()
+
+    if pbar:
+        pbar.close()
+
+    if not table.rows:
+        log('No data to list')
+        return
+
+    length = table.length()
+    bitrate = table.bitrate()
+    unreadable = int(np.isnan(length).sum())
+
+    print()
+    print_table([{
+        'files': table.rows,
+        'folders': len(dirs),
+        'GB': round(int(table.column('size').sum()) / 1073741824, 2),
+        'media h': round(float(np.nansum(length)) / 3600, 2),
+        '1080p30 encode h': round(table.encode_cost() / 3600, 2),
+        'unreadable': unreadable,
+        '_rowcolor': shellcolors.WARNING if unreadable else shellcolors.OKGREEN
+    }], col_order=['files', 'folders', 'GB', 'media h', '1080p30 encode h', 'unreadable'])
+
+    qs = [f'p{q}' if q < 100 else 'max' for q in _stats_percentiles]
+    data = []
+
+    for (name, values) in [('fps', table.column('fps')), ('bitrate Mbps', bitrate), ('length min', length / 60), ('height', table.column('height'))]:
+        # zeros are failed probes, not measurements
+        values = np.where(values > 0, values, np.nan)
+        datum = {'': name, '_rowcolor': shellcolors.OKGREEN}
+
+        for (q, v) in zip(qs, mediaTable.percentiles(values, _stats_percentiles)):
+            datum[q] = '-' if v is None else round(v, 2)
+
+        data.append(datum)
+
+    print()
+    print_table(data, col_order=[''] + qs)
+
+    edges = _stats_bitrate_edges
+    bins = [f'{edges[i]:g}-{edges[i + 1]:g}' if math.isfinite(edges[i + 1]) else f'{edges[i]:g}+' for i in range(len(edges) - 1)]
+    hist = table.histogram_by_ext(bitrate, edges)
+    data = []
+
+    for (ei, ext) in sorted(enumerate(table.exts), key=lambda x: -int(hist[x[0]].sum())):
+        datum = {'ext': ext, 'files': int(hist[ei].sum()), '_rowcolor': shellcolors.OKGREEN}
+        datum.update({b: int(c) or '' for (b, c) in zip(bins, hist[ei])})
+        data.append(datum)
+
+    print()
+    log('Files by bitrate, Mbps')
+    print_table(data, col_order=['ext', 'files'] + bins)
+    print()
+
+
+def compare_probes(dirs: List[Path]):
+    fields = ['fps', 'frames', 'width', 'height']
+    col_order = [LH.path_hdr, 'field', 'header', 'cv2']
+    data = []
+    compared = 0
+    unsupported = 0
+
+    _file_sorter(lambda x: x.relative_to(_root_dir).as_posix(), dirs, _root_dir, False)
+
+    for d in dirs:
+        files = get_listing(d).videos
+        _file_sorter(lambda x: x.name, files, d, True)
+
+        for f in files:
+            hr = probe.header_probe(str(f))
+
+            if not hr:
+                unsupported += 1
+                log_trace(f'Header probe unsupported: {f}')
+                continue
+
+            compared += 1
+            cr = probe.cv2_probe(str(f), _args.max_captures)
+
+            for fld in fields:
+                if not getattr(hr, fld) == getattr(cr, fld):
+                    data.append({LH.path_hdr: f.relative_to(_root_dir).as_posix(), 'field': fld, 'header': getattr(hr, fld), 'cv2': getattr(cr, fld)})
+
+    if data:
+        print_table(data, data_row_color=shellcolors.FAIL, col_order=col_order)
+        print()
+
+    mismatched = len(set(map(lambda dt: dt[LH.path_hdr], data)))
+    log(f'Header probe: {compared} compared, {mismatched} mismatched, {unsupported} unsupported', shellcolors.FAIL if mismatched else shellcolors.OKGREEN)
+
+
+def get_listing(d: Path) -> walker.DirListing:
+    listing = _listings.pop(d, None)
+
+    if listing:
+        return listing
+    if _dir_index:
+        return _dir_index.listing(d, _extensions.keys())
+
+    return walker.list_dir(d, _extensions.keys())
+
+
+def include_subdir(subdir: str, d: str, skip_dunder_dirs=True) -> bool:
+    if _dir_filter and not re.search(_dir_filter, str(d), flags=re.IGNORECASE):
+        return False
+    elif skip_dunder_dirs and (d.startswith('.') or d.startswith(_dest_folder_name) or d.startswith('_.')):
+        return False
+    elif d == '___hbscripter' or '___hbscripter' in subdir:
+        return False
+    elif skip_dunder_dirs and '__..' in subdir:
+        return False
+
+    return True
+
+
+def scan_dirs(skip_dunder_dirs=True, root: Path = None) -> Tuple[List[Path], int, List[Path]]:
+    root = root or _root_dir
+    log(f'Scanning {root}')
+    sdirs = [root]
+    wanted = {root}
     cleanup = []
+    cleanup_pending = set()
     file_count = 0
 
     if not _args.non_recursive:
-        for subdir, dirs, files in os.walk(_root_dir):
-            file_count += len(files)
-            for d in dirs:
-                fdir = Path(os.path.join(subdir, d))
+        if _args.walk_threads > 1:
+            listings = walker.walk_parallel(root, _extensions.keys(), _args.walk_threads, _dir_index)
+        else:
+            listings = walker.walk(root, _extensions.keys(), _dir_index)
+
+        for listing in listings:
+            subdir = str(listing.path)
+            file_count += listing.fileCount
+
+            if listing.path in wanted:
+                _listings[listing.path] = listing
+            elif listing.path.name == _dest_folder_name:
+                index_outputs(listing)
+
+            # dest folders are listed later in the same walk, so their cleanup check waits for that listing
+            if listing.path in cleanup_pending:
+                cleanup_pending.remove(listing.path)
+                if listing.hasFiles:
+                    cleanup.append(listing.path)
+
+            for d in listing.subdirs:
+                fdir = listing.path / d
 
                 if _dir_filter and not re.search(_dir_filter, str(d), flags=re.IGNORECASE):
                     continue
                 elif skip_dunder_dirs and d == _dest_folder_name:
-                    if [f for f in fdir.glob('*') if f.is_file()]:
-                        cleanup.append(fdir)
-                    continue
-                elif skip_dunder_dirs and (d.startswith('.') or d.startswith(_dest_folder_name) or d.startswith('_.')):
-                    continue
-                elif d == '___hbscripter' or '___hbscripter' in subdir:
+                    if d in listing.linkedSubdirs:
+                        dest_listing = walker.list_dir(fdir, _extensions.keys())
+                        index_outputs(dest_listing)
+
+                        if dest_listing.hasFiles:
+                            cleanup.append(fdir)
+                    else:
+                        cleanup_pending.add(fdir)
                     continue
-                elif skip_dunder_dirs and '__..' in subdir:
+                elif not include_subdir(subdir, d, skip_dunder_dirs):
                     continue
 
                 sdirs.append(fdir)
+                wanted.add(fdir)
     else:
-        file_count += len(list(_root_dir.glob('*')))
+        listing = get_listing(root)
+        _listings[root] = listing
+        file_count += listing.fileCount + len(listing.subdirs)
 
     return (sdirs, file_count, cleanup)
 
 
 def run():
-    if _list_details:
+    open_probe_cache()
+    open_dir_index()
+
+    try:
+        scan()
+    finally:
+        close_dir_index()
+        close_probe_cache()
+        log_probe_resources()
+
+
+def scan():
+    if _args.probe_compare:
+        (scanDirs, file_count, cleanup) = scan_dirs(skip_dunder_dirs=False)
+        compare_probes(scanDirs)
+    elif _args.stats:
+        (scanDirs, file_count, cleanup) = scan_dirs()
+        library_stats(scanDirs)
+    elif _list_details:
         if _root_dir.is_file():
             list_details(_root_dir, 1)
         else:
@@ -858,31 +1856,219 @@ def run():
     else:
         (scanDirs, file_count, cleanup) = scan_dirs()
 
-        _file_sorter(lambda x: str(x), scanDirs, _root_dir)
+        _file_sorter(lambda x: str(x), scanDirs, _root_dir, False)
         if cleanup:
             clean_dirs: List[str] = list(map(lambda p: p.relative_to(_root_dir).as_posix(), cleanup))
-            _file_sorter(lambda x: x, clean_dirs, _root_dir)
+            _file_sorter(lambda x: x, clean_dirs, _root_dir, False)
             lst = '\n\t'.join(clean_dirs)
             log(f'Media to cleanup:\n\t{lst}\n', shellcolors.OKGREEN)
 
         if _args.clean:
             return
 
-        for d in scanDirs:
-            scan_dir(d)
+        if _args.jobs > 1:
+            dir_scans = [read_dir(d) for d in scanDirs]
+            prefetch_probes([c[0] for ds in dir_scans for c in ds.candidates])
+
+            for ds in dir_scans:
+                scan_dir(ds)
+        else:
+            for d in scanDirs:
+                scan_dir(read_dir(d))
 
         if _single_queue is not None:
             print(len(_single_queue))
-            _file_sorter(lambda x: x.shortDir, _single_queue, _root_dir)
-            write_queue(_single_queue, Path(_root_dir))
+            _file_sorter(lambda x: x.shortDir, _single_queue, _root_dir, False)
+
+            if _args.run:
+                run_queue(_single_queue)
+            else:
+                write_queue(_single_queue, Path(_root_dir))
 
+        if _args.watch:
+            watch(scanDirs)
 
-if __name__ == '__main__':
-    if _args.sort_test:
-        files = [Path(f) for f in glob.glob('./windows_sorting/*.txt')]
-        _file_sorter(lambda f: f.name, files, _root_dir)
 
-        for f in files:
-            print(f.name)
+def watch_ignored(d: Path, name: str) -> bool:
+    # our own writes would otherwise re-trigger a plan
+    if d == _root_dir and runner.own_file(name):
+        return True
+
+    return bool(_args.manifest) and d / runner.temp_target(name) == (_root_dir / _args.manifest).resolve()
+
+
+def replan_dir(d: Path):
+    short_dir = d.relative_to(_root_dir).as_posix()
+    _single_queue[:] = [b for b in _single_queue if not b.shortDir == short_dir]
+    _listings.pop(d, None)
+    dest_folder = d / _dest_folder_name
+
+    # outputs may have landed since the last plan, the dest folder isn't watched
+    for name in _outputs.pop(dest_folder, set()):
+        _output_durations.pop(dest_folder / name, None)
+
+    if _dir_index:
+        _dir_index.invalidate(d)
+
+    if d.is_dir():
+        scan_dir(read_dir(d))
+
+
+def watch(scanDirs: List[Path]):
+    watched = set()
+
+    try:
+        watcher = dirWatcher.Watcher(_args.debounce, ignore=watch_ignored)
+    except OSError as e:
+        error(f'Watch mode unavailable: {e}')
+        return
+
+    def add_watches(dirs: List[Path]):
+        for d in dirs:
+            try:
+                watcher.add(d)
+                watched.add(d)
+            except OSError as e:
+                error(f'Failed watching {d}: {e}')
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt()
+
+    # treat a service stop like ctrl-c so the index and probe cache are saved on the way out
+    signal.signal(signal.SIGTERM, stop)
+
+    add_watches(scanDirs)
+    log(f'Watching {len(watched)} folders under {_root_dir}')
+
+    try:
+        with watcher:
+            while True:
+                batch = watcher.next_batch()
+                changed = set(batch.changed)
+
+                if batch.overflow:
+                    log('Watch events overflowed, re-planning everything', shellcolors.WARNING)
+                    _single_queue.clear()
+                    (dirs, file_count, cleanup) = scan_dirs()
+                    add_watches(dirs)
+                    changed = set(dirs)
+
+                for d in batch.removed:
+                    watcher.remove_tree(d)
+                    gone = [w for w in watched if w == d or d in w.parents]
+                    watched.difference_update(gone)
+                    changed.update(gone)
+
+                for d in batch.created:
+                    if d.parent in watched and d.is_dir() and include_subdir(str(d.parent), d.name):
+                        (dirs, file_count, cleanup) = scan_dirs(root=d)
+                        add_watches(dirs)
+                        changed.update(dirs)
+
+                changed = [d for d in changed if d in watched or not d.exists()]
+
+                if not changed:
+                    continue
+
+                _file_sorter(lambda x: str(x), changed, _root_dir, False)
+
+                log_trace(f'Re-planning {len(changed)} folders')
+
+                for d in changed:
+                    replan_dir(d)
+
+                _file_sorter(lambda x: x.shortDir, _single_queue, _root_dir, False)
+                write_queue(_single_queue, Path(_root_dir))
+
+                if _probe_cache:
+                    _probe_cache.commit()
+    except KeyboardInterrupt:
+        log('Stopped watching')
+
+
+_sort_golden_path = Path(__file__).resolve().parent / 'windows_sorting_golden.json'
+_sort_modes: Dict[str, Callable[[List[str]], None]] = {
+    'windows': lambda names: windows_sorter(lambda x: x, names),
+    'dblcmd': lambda names: dblcmd_sorter(lambda x: x, names, None, True),
+    'dblcmd dirs': lambda names: dblcmd_sorter(lambda x: x, names, None, False),
+    'nautilus': lambda names: nautilus_sorter(lambda x: x, names)
+}
+
+
+def sort_test():
+    files = [Path(f) for f in glob.glob('./windows_sorting/*.txt')]
+    _file_sorter(lambda f: f.name, files, _root_dir)
+
+    for f in files:
+        print(f.name)
+
+    with open(_sort_golden_path, encoding='utf-8') as f:
+        golden = json.load(f)
+
+    data = []
+    failed = False
+
+    for (mode, expected) in golden['orders'].items():
+        names = list(golden['names'])
+        _sort_modes[mode](names)
+        diff = next((i for (i, (n, e)) in enumerate(zip(names, expected)) if not n == e), None)
+        failed = failed or diff is not None
+
+        data.append({
+            'sorter': mode,
+            'names': len(names),
+            'result': 'ok' if diff is None else f'#{diff} is {names[diff]!r}, expected {expected[diff]!r}',
+            '_rowcolor': shellcolors.OKGREEN if diff is None else shellcolors.FAIL
+        })
+
+    print_table(data, col_order=['sorter', 'names', 'result'])
+
+    if failed:
+        sys.exit(1)
+
+
+def bench_startup(runs=5):
+    base = [sys.executable, str(Path(__file__).resolve()), '-rd', str(_root_dir), '--no-bar']
+
+    if _args.cache_dir:
+        base += ['--cache-dir', _args.cache_dir]
+
+    modes = {
+        'help': ['--help'],
+        'sort-test': ['--sort-test'],
+        'clean': ['--clean'],
+        'plan cached': ['--plan', '-pb', 'cached'],
+        'plan header': ['--plan', '-pb', 'header', '--no-cache'],
+        'plan cv2': ['--plan', '-pb', 'cv2', '--no-cache']
+    }
+    data = []
+
+    for (mode, margs) in modes.items():
+        times = []
+
+        for i in range(runs):
+            start = time.perf_counter()
+            subprocess.run(base + margs, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            times.append((time.perf_counter() - start) * 1000)
+
+        imports = subprocess.run([sys.executable, '-X', 'importtime'] + base[1:] + margs, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+        loads_cv2 = any(ln.rstrip().endswith('| cv2') for ln in imports.splitlines())
+
+        data.append({
+            'mode': mode,
+            'mean ms': round(sum(times) / len(times), 1),
+            'min ms': round(min(times), 1),
+            'cv2': 'yes' if loads_cv2 else 'no',
+            '_rowcolor': shellcolors.WARNING if loads_cv2 else shellcolors.OKGREEN
+        })
+
+    print_table(data, col_order=['mode', 'mean ms', 'min ms', 'cv2'])
+
+
+if __name__ == '__main__':
+    if _args.bench_startup:
+        bench_startup()
+    elif _args.sort_test:
+        sort_test()
     else:
         run()
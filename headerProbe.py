@@ -0,0 +1,325 @@
+import os
+import math
+import struct
+
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+# Reads fps, frame count and dimensions straight from container headers, mirroring how FFmpeg (and so
+# cv2.VideoCapture) derives them. Anything the headers can't answer exactly returns None so the caller
+# can fall back to cv2.
+
+HeaderInfo = Tuple[float, int, float, float]
+
+_int_max = 2147483647
+_av_time_base = 1000000
+
+_mp4_exts = ['.mp4', '.mov', '.m4v', '.f4v']
+_mkv_exts = ['.mkv', '.mkvv', '.webm']
+
+_ebml_header_id = 0x1A45DFA3
+_mkv_segment_id = 0x18538067
+_mkv_info_id = 0x1549A966
+_mkv_tracks_id = 0x1654AE6B
+_mkv_cluster_id = 0x1F43B675
+_mkv_timestamp_scale_id = 0x2AD7B1
+_mkv_duration_id = 0x4489
+_mkv_track_entry_id = 0xAE
+_mkv_track_type_id = 0x83
+_mkv_default_duration_id = 0x23E383
+_mkv_video_id = 0xE0
+_mkv_pixel_width_id = 0xB0
+_mkv_pixel_height_id = 0xBA
+_mkv_track_type_video = 1
+
+
+def supports(ext: str) -> bool:
+    ext = ext.lower()
+    return ext in _mp4_exts or ext in _mkv_exts
+
+
+def probe(path: str) -> Optional[HeaderInfo]:
+    ext = os.path.splitext(path)[1].lower()
+
+    try:
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+
+            if ext in _mp4_exts:
+                return _mp4_probe(f, size)
+            if ext in _mkv_exts:
+                return _mkv_probe(f, size)
+    except (OSError, struct.error, ValueError):
+        return None
+
+    return None
+
+
+# port of libavutil av_reduce, FFmpeg stores frame rates as rationals reduced this way
+def av_reduce(num: int, den: int, max_val: int) -> Tuple[int, int]:
+    a0n, a0d = 0, 1
+    a1n, a1d = 1, 0
+    gcd = math.gcd(num, den)
+
+    if gcd:
+        num //= gcd
+        den //= gcd
+
+    if num <= max_val and den <= max_val:
+        a1n, a1d = num, den
+        den = 0
+
+    while den:
+        x = num // den
+        next_den = num - den * x
+        a2n = x * a1n + a0n
+        a2d = x * a1d + a0d
+
+        if a2n > max_val or a2d > max_val:
+            if a1n:
+                x = (max_val - a0n) // a1n
+            if a1d:
+                x = min(x, (max_val - a0d) // a1d)
+
+            if den * (2 * x * a1d + a0d) > num * a1d:
+                a1n, a1d = x * a1n + a0n, x * a1d + a0d
+            break
+
+        a0n, a0d = a1n, a1d
+        a1n, a1d = a2n, a2d
+        num = den
+        den = next_den
+
+    return a1n, a1d
+
+
+def _read_at(f: BinaryIO, pos: int, length: int) -> bytes:
+    f.seek(pos)
+    data = f.read(length)
+
+    if len(data) < length:
+        raise ValueError('Truncated header')
+
+    return data
+
+
+def _mp4_boxes(f: BinaryIO, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    pos = start
+
+    while pos + 8 <= end:
+        size, typ = struct.unpack('>I4s', _read_at(f, pos, 8))
+        hlen = 8
+
+        if size == 1:
+            size = struct.unpack('>Q', _read_at(f, pos + 8, 8))[0]
+            hlen = 16
+        elif size == 0:
+            size = end - pos
+
+        if size < hlen:
+            return
+
+        yield typ, pos + hlen, min(pos + size, end)
+        pos += size
+
+
+def _mp4_find(f: BinaryIO, span: Optional[Tuple[int, int]], typ: bytes) -> Optional[Tuple[int, int]]:
+    if not span:
+        return None
+
+    for t, s, e in _mp4_boxes(f, span[0], span[1]):
+        if t == typ:
+            return s, e
+
+    return None
+
+
+def _mp4_probe(f: BinaryIO, size: int) -> Optional[HeaderInfo]:
+    moov = _mp4_find(f, (0, size), b'moov')
+
+    if not moov:
+        return None
+
+    # like cv2, use the first video track
+    for typ, s, e in _mp4_boxes(f, moov[0], moov[1]):
+        if typ == b'trak':
+            mdia = _mp4_find(f, (s, e), b'mdia')
+            hdlr = _mp4_find(f, mdia, b'hdlr')
+
+            if hdlr and _read_at(f, hdlr[0] + 8, 4) == b'vide':
+                return _mp4_video_track(f, mdia)
+
+    return None
+
+
+def _mp4_video_track(f: BinaryIO, mdia: Tuple[int, int]) -> Optional[HeaderInfo]:
+    mdhd = _mp4_find(f, mdia, b'mdhd')
+    stbl = _mp4_find(f, _mp4_find(f, mdia, b'minf'), b'stbl')
+    stsd = _mp4_find(f, stbl, b'stsd')
+    stts = _mp4_find(f, stbl, b'stts')
+
+    if not mdhd or not stsd or not stts:
+        return None
+
+    version = _read_at(f, mdhd[0], 1)[0]
+    timescale = struct.unpack('>I', _read_at(f, mdhd[0] + (20 if version == 1 else 12), 4))[0]
+
+    # FFmpeg only derives the frame rate from the header when the sample durations are constant,
+    # otherwise it estimates it from packet timestamps, which needs cv2
+    entry_count = struct.unpack('>I', _read_at(f, stts[0] + 4, 4))[0]
+
+    if not entry_count == 1:
+        return None
+
+    frames, delta = struct.unpack('>II', _read_at(f, stts[0] + 8, 8))
+
+    if not timescale or not delta or not frames:
+        return None
+
+    num, den = av_reduce(timescale, delta, _int_max)
+    width, height = struct.unpack('>HH', _read_at(f, stsd[0] + 40, 4))
+
+    return num / den, frames, float(width), float(height)
+
+
+def _ebml_vint(f: BinaryIO, keep_marker: bool) -> Tuple[int, int, bool]:
+    first = f.read(1)
+
+    if not first:
+        raise ValueError('Truncated element')
+
+    b = first[0]
+    length = 1
+    mask = 0x80
+
+    while length <= 8 and not b & mask:
+        mask >>= 1
+        length += 1
+
+    if length > 8:
+        raise ValueError('Invalid EBML length')
+
+    rest = f.read(length - 1)
+
+    if len(rest) < length - 1:
+        raise ValueError('Truncated element')
+
+    value = b if keep_marker else b & (mask - 1)
+    unknown = value == mask - 1
+
+    for c in rest:
+        value = (value << 8) | c
+        unknown = unknown and c == 0xFF
+
+    return value, length, unknown and not keep_marker
+
+
+def _mkv_elements(f: BinaryIO, start: int, end: int) -> Iterator[Tuple[int, int, int]]:
+    pos = start
+
+    while pos < end:
+        f.seek(pos)
+        eid, id_len, _ = _ebml_vint(f, True)
+        size, size_len, unknown = _ebml_vint(f, False)
+        data_start = pos + id_len + size_len
+        data_end = end if unknown else min(data_start + size, end)
+
+        yield eid, data_start, data_end
+        pos = data_end
+
+
+def _mkv_uint(f: BinaryIO, start: int, end: int) -> int:
+    return int.from_bytes(_read_at(f, start, end - start), 'big')
+
+
+def _mkv_float(f: BinaryIO, start: int, end: int) -> float:
+    data = _read_at(f, start, end - start)
+
+    if len(data) == 4:
+        return struct.unpack('>f', data)[0]
+    if len(data) == 8:
+        return struct.unpack('>d', data)[0]
+
+    raise ValueError('Invalid float element')
+
+
+def _mkv_probe(f: BinaryIO, size: int) -> Optional[HeaderInfo]:
+    segment = None
+
+    for eid, s, e in _mkv_elements(f, 0, size):
+        if eid == _mkv_segment_id:
+            segment = (s, e)
+            break
+        elif not eid == _ebml_header_id:
+            return None
+
+    if not segment:
+        return None
+
+    timestamp_scale = 1000000
+    duration = None
+    track = None
+    seen_info = False
+
+    for eid, s, e in _mkv_elements(f, segment[0], segment[1]):
+        if eid == _mkv_info_id:
+            seen_info = True
+            for cid, cs, ce in _mkv_elements(f, s, e):
+                if cid == _mkv_timestamp_scale_id:
+                    timestamp_scale = _mkv_uint(f, cs, ce)
+                elif cid == _mkv_duration_id:
+                    duration = _mkv_float(f, cs, ce)
+        elif eid == _mkv_tracks_id:
+            track = _mkv_video_track(f, s, e)
+        elif eid == _mkv_cluster_id:
+            break
+
+        if seen_info and track:
+            break
+
+    if not track or not duration:
+        return None
+
+    default_duration, width, height = track
+
+    if not default_duration or not width or not height:
+        return None
+
+    num, den = av_reduce(1000000000, default_duration, 30000)
+
+    # outside this range FFmpeg leaves r_frame_rate to be estimated from packets
+    if not (den * 5 < num < den * 1000):
+        return None
+
+    fps = num / den
+    duration_us = int(duration * timestamp_scale * 1000 / _av_time_base)
+    frames = math.floor(duration_us / _av_time_base * fps + 0.5)
+
+    return fps, frames, float(width), float(height)
+
+
+def _mkv_video_track(f: BinaryIO, start: int, end: int) -> Optional[Tuple[int, int, int]]:
+    for eid, s, e in _mkv_elements(f, start, end):
+        if not eid == _mkv_track_entry_id:
+            continue
+
+        track_type = None
+        default_duration = None
+        width = None
+        height = None
+
+        for cid, cs, ce in _mkv_elements(f, s, e):
+            if cid == _mkv_track_type_id:
+                track_type = _mkv_uint(f, cs, ce)
+            elif cid == _mkv_default_duration_id:
+                default_duration = _mkv_uint(f, cs, ce)
+            elif cid == _mkv_video_id:
+                for vid, vs, ve in _mkv_elements(f, cs, ce):
+                    if vid == _mkv_pixel_width_id:
+                        width = _mkv_uint(f, vs, ve)
+                    elif vid == _mkv_pixel_height_id:
+                        height = _mkv_uint(f, vs, ve)
+
+        if track_type == _mkv_track_type_video:
+            return default_duration, width, height
+
+    return None
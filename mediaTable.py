@@ -0,0 +1,122 @@
+from pathlib import Path
+
+import numpy as np
+
+import encodingCommon as enc
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+_initial_rows = 1024
+
+# round() per value, which is what file rows use. np.round scales by ten first and takes 1.05 down to 1.0 where
+# round() goes up, so a folder's "btr > N" count could disagree with the rows shown in red
+_round_bitrate = np.frompyfunc(lambda v: round(float(v), 1), 1, 1)
+
+
+# Probe results of a whole tree as one array per field, rows are appended as files are probed and every
+# aggregate is computed over the columns instead of file by file. Directories and extensions are stored as
+# indexes into `dirs` and `exts`.
+class MediaTable:
+    dirs: List[str]
+    exts: List[str]
+    paths: List[Path]
+    rows: int
+
+    def __init__(self):
+        self.dirs = []
+        self.exts = []
+        self.paths = []
+        self.rows = 0
+        self._ext_ids: Dict[str, int] = {}
+        self._cols = {
+            'dir': np.zeros(_initial_rows, dtype=np.int32),
+            'ext': np.zeros(_initial_rows, dtype=np.int16),
+            'size': np.zeros(_initial_rows, dtype=np.int64),
+            'fps': np.zeros(_initial_rows, dtype=np.float64),
+            'frames': np.zeros(_initial_rows, dtype=np.int64),
+            'width': np.zeros(_initial_rows, dtype=np.float64),
+            'height': np.zeros(_initial_rows, dtype=np.float64)
+        }
+
+    def add_dir(self, name: str) -> int:
+        self.dirs.append(name)
+        return len(self.dirs) - 1
+
+    def add(self, dir_id: int, path: Path, size: int, fps: float, frames: int, width: float, height: float):
+        if self.rows == len(self._cols['dir']):
+            for (k, a) in self._cols.items():
+                self._cols[k] = np.concatenate([a, np.zeros_like(a)])
+
+        ext = path.suffix.lower()
+
+        if ext not in self._ext_ids:
+            self._ext_ids[ext] = len(self.exts)
+            self.exts.append(ext)
+
+        i = self.rows
+        self._cols['dir'][i] = dir_id
+        self._cols['ext'][i] = self._ext_ids[ext]
+        self._cols['size'][i] = size
+        self._cols['fps'][i] = fps
+        self._cols['frames'][i] = frames
+        self._cols['width'][i] = width
+        self._cols['height'][i] = height
+        self.paths.append(path)
+        self.rows += 1
+
+    def column(self, name: str, lo: int = 0, hi: int = None) -> np.ndarray:
+        return self._cols[name][lo:self.rows if hi is None else hi]
+
+    # seconds, rounded up plus one like the planner does, NaN where the probe found no fps
+    def length(self, lo: int = 0, hi: int = None) -> np.ndarray:
+        fps = self.column('fps', lo, hi)
+        frames = self.column('frames', lo, hi)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(fps > 0, np.ceil(frames / np.where(fps > 0, fps, 1)) + 1, np.nan)
+
+    # Mbit/s rounded to one decimal, as list_details shows it
+    def bitrate(self, lo: int = 0, hi: int = None) -> np.ndarray:
+        return _round_bitrate(self.column('size', lo, hi) / 1000000 * 8 / self.length(lo, hi)).astype(float)
+
+    # file count and the number of files over each limit per directory
+    def dir_counts(self, max_fps: float, max_bitrate: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        dirs = self.column('dir')
+        n = len(self.dirs)
+
+        with np.errstate(invalid='ignore'):
+            fps_over = self.column('fps') > max_fps
+            bitrate_over = self.bitrate() > max_bitrate
+
+        return (np.bincount(dirs, minlength=n),
+                np.bincount(dirs, weights=fps_over, minlength=n).astype(np.int64),
+                np.bincount(dirs, weights=bitrate_over, minlength=n).astype(np.int64))
+
+    # the same counts for rows lo:hi only, which stays proportional to the rows when called per directory
+    def range_counts(self, max_fps: float, max_bitrate: float, lo: int = 0, hi: int = None) -> Tuple[int, int, int]:
+        with np.errstate(invalid='ignore'):
+            return (len(self.column('dir', lo, hi)),
+                    int((self.column('fps', lo, hi) > max_fps).sum()),
+                    int((self.bitrate(lo, hi) > max_bitrate).sum()))
+
+    # counts per extension (rows, in `exts` order) and bin (columns), NaN values aren't counted
+    def histogram_by_ext(self, values: np.ndarray, edges: Sequence[float]) -> np.ndarray:
+        valid = ~np.isnan(values)
+        bins = np.digitize(values[valid], edges[1:-1])
+        exts = self.column('ext')[valid].astype(np.int64)
+        nb = len(edges) - 1
+        return np.bincount(exts * nb + bins, minlength=len(self.exts) * nb).reshape(len(self.exts), nb)
+
+    # enc.encode_cost over every row, files without a length add nothing
+    def encode_cost(self) -> float:
+        width = self.column('width')
+        height = self.column('height')
+        fps = self.column('fps')
+        pixels = np.where((width > 0) & (height > 0), width * height, enc.cost_ref_pixels)
+        cost = self.length() * (pixels / enc.cost_ref_pixels) * (np.where(fps > 0, fps, enc.cost_ref_fps) / enc.cost_ref_fps)
+        return float(np.nansum(cost))
+
+
+def percentiles(values: np.ndarray, qs: Sequence[float]) -> List[Optional[float]]:
+    values = values[~np.isnan(values)]
+    return [float(v) for v in np.percentile(values, qs)] if len(values) else [None] * len(qs)
@@ -0,0 +1,365 @@
+import os
+import sqlite3
+import resource
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+
+import headerProbe
+
+from dataclasses import dataclass
+from typing import List, Any, Deque, Dict, Callable, Iterable, Iterator, Optional, Tuple, Union
+
+_cache_schema_version = 1
+_cache_commit_every = 200
+_default_max_captures = 4
+_proc_fd_dir = '/proc/self/fd'
+
+
+@dataclass
+class ProbeResult:
+    fps: float
+    frames: int
+    width: float
+    height: float
+
+
+def default_cache_dir() -> Path:
+    xdg = os.environ.get('XDG_CACHE_HOME')
+    base = Path(xdg) if xdg else Path.home() / '.cache'
+    return base / 'hbscripter'
+
+
+# rows are keyed by path and only served while size, mtime and inode still match the file
+class ProbeCache:
+    dbPath: Path
+    hits: int
+    misses: int
+
+    def __init__(self, dbPath: Path, rebuild: bool = False):
+        self.dbPath = dbPath
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+
+        os.makedirs(dbPath.parent, exist_ok=True)
+        self._db = sqlite3.connect(str(dbPath))
+
+        version = self._db.execute('PRAGMA user_version').fetchone()[0]
+
+        if rebuild or not version == _cache_schema_version:
+            self._db.execute('DROP TABLE IF EXISTS probe')
+            self._db.execute(f'PRAGMA user_version = {_cache_schema_version}')
+
+        self._db.execute('''CREATE TABLE IF NOT EXISTS probe (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            fps REAL NOT NULL,
+            frames INTEGER NOT NULL,
+            width REAL NOT NULL,
+            height REAL NOT NULL
+        )''')
+        self._db.commit()
+
+    def get(self, path: Path, st: os.stat_result) -> Optional[ProbeResult]:
+        row = self._db.execute(
+            'SELECT size, mtime_ns, inode, fps, frames, width, height FROM probe WHERE path = ?',
+            (str(path),)
+        ).fetchone()
+
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns and row[2] == st.st_ino:
+            self.hits += 1
+            return ProbeResult(row[3], row[4], row[5], row[6])
+
+        self.misses += 1
+        return None
+
+    def put(self, path: Path, st: os.stat_result, res: ProbeResult):
+        # a zero fps means the capture failed to open, which is often transient on network mounts
+        if not res.fps:
+            return
+
+        self._db.execute(
+            'INSERT OR REPLACE INTO probe (path, size, mtime_ns, inode, fps, frames, width, height) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (str(path), st.st_size, st.st_mtime_ns, st.st_ino, res.fps, res.frames, res.width, res.height)
+        )
+        self._pending += 1
+
+        if self._pending >= _cache_commit_every:
+            self._db.commit()
+            self._pending = 0
+
+    def commit(self):
+        self._db.commit()
+        self._pending = 0
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+
+class ProbeError(Exception):
+    pass
+
+
+# Caps how many captures are open at once and guarantees each one is released. Pool workers are handed one
+# shared semaphore (see probe_files), so the cap holds across processes, the counts are this process' own.
+class ProbeSession:
+    maxOpen: int
+    openCount: int
+    peakOpen: int
+    peakFds: int
+
+    def __init__(self, maxOpen: int = _default_max_captures, slots: Any = None):
+        self.maxOpen = maxOpen
+        self.openCount = 0
+        self.peakOpen = 0
+        self.peakFds = 0
+        self._slots = slots if slots is not None else threading.BoundedSemaphore(maxOpen)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._slots:
+            with self._lock:
+                self.openCount += 1
+                self.peakOpen = max(self.peakOpen, self.openCount)
+
+            try:
+                yield
+            finally:
+                with self._lock:
+                    self.openCount -= 1
+
+    @contextmanager
+    def capture(self, path: str) -> Iterator[Any]:
+        # takes a while, so only import once something actually needs it
+        import cv2
+
+        with self.slot():
+            v = cv2.VideoCapture(path)
+
+            with self._lock:
+                self.peakFds = max(self.peakFds, open_fd_count())
+
+            try:
+                yield v
+            finally:
+                v.release()
+
+    def merge_peaks(self, peakOpen: int, peakFds: int):
+        with self._lock:
+            self.peakOpen = max(self.peakOpen, peakOpen)
+            self.peakFds = max(self.peakFds, peakFds)
+
+
+_session: Optional[ProbeSession] = None
+
+
+def get_session(maxOpen: int = _default_max_captures) -> ProbeSession:
+    global _session
+
+    if _session is None:
+        _session = ProbeSession(maxOpen)
+
+    return _session
+
+
+def open_fd_count() -> int:
+    try:
+        return len(os.listdir(_proc_fd_dir))
+    except OSError:
+        return 0
+
+
+# peak resident set of this process and of its largest finished child (pool workers), in MB
+def peak_rss_mb() -> Tuple[float, float]:
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(own / 1024, 1), round(children / 1024, 1)
+
+
+def cv2_probe(path: str, maxOpen: int = _default_max_captures) -> ProbeResult:
+    import cv2
+
+    with get_session(maxOpen).capture(path) as v:
+        return ProbeResult(
+            v.get(cv2.CAP_PROP_FPS),
+            int(v.get(cv2.CAP_PROP_FRAME_COUNT)),
+            v.get(cv2.CAP_PROP_FRAME_WIDTH),
+            v.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        )
+
+
+def header_probe(path: str) -> Optional[ProbeResult]:
+    info = headerProbe.probe(path)
+    return ProbeResult(*info) if info else None
+
+
+class ProbeBackend:
+    name: str = ''
+
+    # None means the backend can't answer for this file and the next one in the chain is tried
+    def probe(self, path: str) -> Optional[ProbeResult]:
+        raise NotImplementedError
+
+
+class Cv2Backend(ProbeBackend):
+    name = 'cv2'
+    maxOpen: int
+
+    # the limit travels with the backend so pool workers build their own session with it
+    def __init__(self, maxOpen: int = _default_max_captures):
+        self.maxOpen = maxOpen
+
+    def probe(self, path: str) -> Optional[ProbeResult]:
+        return cv2_probe(path, self.maxOpen)
+
+
+class HeaderBackend(ProbeBackend):
+    name = 'header'
+
+    def probe(self, path: str) -> Optional[ProbeResult]:
+        return header_probe(path)
+
+
+# the probe cache sits in front of every chain, so 'cached' probes nothing and never loads cv2
+backend_chains: Dict[str, Callable[[int], List[ProbeBackend]]] = {
+    'cv2': lambda maxOpen: [Cv2Backend(maxOpen)],
+    'header': lambda maxOpen: [HeaderBackend(), Cv2Backend(maxOpen)],
+    'cached': lambda maxOpen: []
+}
+
+
+def get_backends(name: str, maxOpen: int = _default_max_captures) -> List[ProbeBackend]:
+    return backend_chains[name](maxOpen)
+
+
+def probe_path(path: str, backends: List[ProbeBackend]) -> ProbeResult:
+    for b in backends:
+        res = b.probe(path)
+
+        if res:
+            return res
+
+    raise ProbeError(f'No probe backend could read {path}' if backends else f'Not in probe cache: {path}')
+
+
+def _init_worker(maxOpen: int, slots: Any):
+    global _session
+    _session = ProbeSession(maxOpen, slots)
+
+
+# exceptions are returned rather than raised so one bad file doesn't abort the whole map,
+# the worker's session peaks ride along so the parent can report them
+def _probe_worker(backends: List[ProbeBackend], path: str) -> Tuple[Union[ProbeResult, Exception], int, int]:
+    try:
+        res = probe_path(path, backends)
+    except Exception as e:
+        res = e
+
+    session = get_session()
+    return res, session.peakOpen, session.peakFds
+
+
+def probe_files(paths: List[Path], jobs: int, cache: Optional[ProbeCache] = None, on_done: Callable[[], None] = None,
+                backends: List[ProbeBackend] = None, maxOpen: int = _default_max_captures) -> Dict[Path, Union[ProbeResult, Exception]]:
+    if backends is None:
+        backends = get_backends('cv2')
+
+    results: Dict[Path, Union[ProbeResult, Exception]] = {}
+    misses: List[Path] = []
+    stats: Dict[Path, os.stat_result] = {}
+
+    for p in paths:
+        try:
+            st = p.stat()
+        except Exception as e:
+            results[p] = e
+            if on_done:
+                on_done()
+            continue
+
+        res = cache.get(p, st) if cache else None
+
+        if res:
+            results[p] = res
+            if on_done:
+                on_done()
+        else:
+            stats[p] = st
+            misses.append(p)
+
+    if misses and not backends:
+        for p in misses:
+            results[p] = ProbeError(f'Not in probe cache: {p}')
+            if on_done:
+                on_done()
+    elif misses:
+        # map keeps submission order, so results are merged back deterministically
+        ctx = multiprocessing.get_context()
+
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx, initializer=_init_worker, initargs=(maxOpen, ctx.BoundedSemaphore(maxOpen))) as pool:
+            chunksize = max(1, min(16, len(misses) // (jobs * 4)))
+
+            session = get_session(maxOpen)
+
+            for p, (res, peak_open, peak_fds) in zip(misses, pool.map(partial(_probe_worker, backends), [str(p) for p in misses], chunksize=chunksize)):
+                results[p] = res
+                session.merge_peaks(peak_open, peak_fds)
+
+                if cache and isinstance(res, ProbeResult):
+                    cache.put(p, stats[p], res)
+                if on_done:
+                    on_done()
+
+    return results
+
+
+# Same results as probe_files, but yielded in input order while later paths are still being probed, with at most
+# `window` files handed out ahead of the caller. A listing can print its first folder before the tree is probed.
+def probe_iter(paths: Iterable[Path], jobs: int, cache: Optional[ProbeCache] = None, backends: List[ProbeBackend] = None,
+               maxOpen: int = _default_max_captures, window: int = None) -> Iterator[Tuple[Path, Union[ProbeResult, Exception]]]:
+    if backends is None:
+        backends = get_backends('cv2')
+
+    window = window or jobs * 4
+    session = get_session(maxOpen)
+    ahead: Deque[Tuple[Path, Optional[os.stat_result], Union[Future, ProbeResult, Exception]]] = deque()
+    ctx = multiprocessing.get_context()
+
+    def finish(p: Path, st: Optional[os.stat_result], res: Union[Future, ProbeResult, Exception]) -> Tuple[Path, Union[ProbeResult, Exception]]:
+        if isinstance(res, Future):
+            (res, peak_open, peak_fds) = res.result()
+            session.merge_peaks(peak_open, peak_fds)
+
+            if cache and isinstance(res, ProbeResult):
+                cache.put(p, st, res)
+
+        return p, res
+
+    # workers are only started once something misses the cache
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=ctx, initializer=_init_worker, initargs=(maxOpen, ctx.BoundedSemaphore(maxOpen))) as pool:
+        for p in paths:
+            try:
+                st = p.stat()
+                res = cache.get(p, st) if cache else None
+            except Exception as e:
+                (st, res) = (None, e)
+
+            if res is None:
+                res = pool.submit(_probe_worker, backends, str(p)) if backends else ProbeError(f'Not in probe cache: {p}')
+
+            ahead.append((p, st, res))
+
+            if len(ahead) >= window:
+                yield finish(*ahead.popleft())
+
+        while ahead:
+            yield finish(*ahead.popleft())
@@ -0,0 +1,735 @@
+import os
+import re
+import math
+import heapq
+import time
+import queue
+import stat
+import shutil
+import threading
+import subprocess
+from pathlib import Path
+
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_rx_progress = re.compile(rb'(\d+(?:\.\d+)?) %')
+journal_name = '.hbscripter-journal'
+_rx_queue_file = re.compile(r'queue(?:-\d+)?\.(?:sh|bat)')
+_rx_shell_special = re.compile(r'[\s"\'$`\\|&;<>()*?\[\]{}~#!^%]')
+# chunk boundaries can each gain or drop a frame and renc lengths are rounded up when planned
+_duration_tolerance = 3.0
+
+
+@dataclass
+class Segment:
+    output: Path
+    # no span means the whole file
+    start: Optional[int] = None
+    length: Optional[int] = None
+    # estimated effort, see encodingCommon.encode_cost
+    cost: float = 0
+
+
+@dataclass
+class FileJob:
+    title: str
+    source: Path
+    destFolder: Path
+    moveTo: Path
+    options: List[str]
+    segments: List[Segment]
+    seconds: float = 0
+    # segments the journal says are already finished, they're left out of `segments`
+    done: int = 0
+    # segments with a complete output already in the dest folder, also left out
+    existing: List[Segment] = field(default_factory=list)
+    # the planner's config the job was made from
+    config: Any = None
+
+    @property
+    def cost(self) -> float:
+        return sum(s.cost for s in self.segments)
+
+
+@dataclass
+class ChunkGroup:
+    chunks: List[Segment]
+    remaining: int
+    failed: bool = False
+
+
+@dataclass
+class SegmentTask:
+    job: FileJob
+    segment: Segment
+    # set when the task only encodes one chunk of `segment`
+    chunk: Optional[Segment] = None
+    group: Optional[ChunkGroup] = None
+
+
+@dataclass
+class WorkerStats:
+    segments: int = 0
+    failed: int = 0
+    busy: float = 0
+    seconds: float = 0
+
+
+@dataclass
+class RunStats:
+    files: int = 0
+    moved: int = 0
+    segments: int = 0
+    cleaned: int = 0
+    failed: List[str] = field(default_factory=list)
+    seconds: float = 0
+    outputBytes: int = 0
+    wall: float = 0
+    workers: List[WorkerStats] = field(default_factory=list)
+
+
+@dataclass
+class JournalEntry:
+    status: int
+    size: int
+
+
+def queue_file_name(shard: int = None, win: bool = False) -> str:
+    return f'queue{"" if shard is None else f"-{shard + 1}"}.{"bat" if win else "sh"}'
+
+
+def temp_path(path: Path) -> Path:
+    return path.with_name(f'.{path.name}.tmp')
+
+
+# name of the file a temp file from temp_path() replaces, other names are returned as they are
+def temp_target(name: str) -> str:
+    return name[1:-4] if name.startswith('.') and name.endswith('.tmp') else name
+
+
+# Everything written next to the queue: the queue and its shards and the journal, plus the temp files they're
+# written through. Watch mode ignores these, or every queue write would trigger another plan.
+def own_file(name: str) -> bool:
+    name = temp_target(name)
+    return name == journal_name or bool(_rx_queue_file.fullmatch(name))
+
+
+# Written to a temp file as it's produced, the finished file replaces the old one in a single rename so readers
+# never pick up half a file
+class AtomicFile:
+    path: Path
+
+    def __init__(self, path: Path, newline: str = None):
+        self.path = path
+        self._tmp_path = temp_path(path)
+        self._f = open(self._tmp_path, 'w', encoding='utf-8', newline=newline)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type:
+            self.discard()
+        else:
+            self.commit()
+
+    def write(self, text: str):
+        self._f.write(text)
+
+    def commit(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+        self._f.close()
+
+        # keep the exec bit and such if the file was chmodded by hand
+        if self.path.exists():
+            os.chmod(self._tmp_path, stat.S_IMODE(self.path.stat().st_mode))
+
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        self._f.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+
+def span_str(v: Optional[int]) -> str:
+    return '-' if v is None else str(v)
+
+
+# Append-only record of finished segments, one tab separated line each: status, size, start, length, source,
+# output. queue.sh appends to it too (see journal_function), so both the runner and the next plan can tell a
+# segment that completed from an output left behind by one that was cut short. The last line for a segment wins.
+class Journal:
+    path: Path
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._entries: Dict[Tuple[str, str, str, str], JournalEntry] = {}
+        self._lock = threading.Lock()
+
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+
+                    if not len(parts) == 6:
+                        continue
+
+                    try:
+                        self._entries[(parts[4], parts[5], parts[2], parts[3])] = JournalEntry(int(parts[0]), int(parts[1]))
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def key(source: Path, segment: Segment) -> Tuple[str, str, str, str]:
+        return str(source), str(segment.output), span_str(segment.start), span_str(segment.length)
+
+    def done(self, source: Path, segment: Segment) -> bool:
+        e = self._entries.get(self.key(source, segment))
+
+        if not e or e.status:
+            return False
+
+        try:
+            return segment.output.stat().st_size == e.size
+        except OSError:
+            return False
+
+    def record(self, source: Path, segment: Segment, status: int, size: int):
+        key = self.key(source, segment)
+
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(f'{status}\t{size}\t{key[2]}\t{key[3]}\t{key[0]}\t{key[1]}\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._entries[key] = JournalEntry(status, size)
+
+    # drops failures and everything belonging to sources that have since been moved into the done folder
+    def compact(self):
+        with self._lock:
+            if not self._entries and not self.path.exists():
+                return
+
+            keep = {k: e for (k, e) in self._entries.items() if not e.status and Path(k[0]).exists()}
+            tmp_path = temp_path(self.path)
+
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for (k, e) in keep.items():
+                    f.write(f'{e.status}\t{e.size}\t{k[2]}\t{k[3]}\t{k[0]}\t{k[1]}\n')
+
+            os.replace(tmp_path, self.path)
+            self._entries = keep
+
+
+# one command line argument as the queue script needs it, quoted once it has anything the shell would act on
+def shell_arg(value: str, win: bool = False) -> str:
+    if not _rx_shell_special.search(value):
+        return value
+
+    if win:
+        return '"' + value.replace('"', '""').replace('%', '%%') + '"'
+
+    return '"' + re.sub(r'(["$`\\])', r'\\\1', value) + '"'
+
+
+# bash counterpart of Journal.record, called after each segment's encode succeeded. Takes the journal keys
+# (local paths) plus the output path as the queue sees it, which differs when the root is mapped.
+def journal_function(path: str) -> str:
+    return f'''function journal() {{
+  printf '0\\t%s\\t%s\\t%s\\t%s\\t%s\\n' "$(stat -c %s "$5")" "$3" "$4" "$1" "$2" >> {path};
+}}
+
+'''
+
+
+class Encoder:
+    # returns the exit status, progress takes the segment's percent done
+    def encode(self, job: FileJob, segment: Segment, progress: Callable[[float], None]) -> int:
+        raise NotImplementedError
+
+    # joins chunk outputs into one file without re-encoding
+    def concat(self, parts: List[Path], output: Path) -> int:
+        raise NotImplementedError
+
+
+def segment_args(job: FileJob, segment: Segment) -> List[str]:
+    args = job.options + ['-i', str(job.source), '-o', str(segment.output)]
+
+    if segment.start is not None:
+        args += ['--start-at', f'seconds:{segment.start}', '--stop-at', f'seconds:{segment.length}']
+
+    return args
+
+
+class HandBrakeEncoder(Encoder):
+    exe: str
+
+    def __init__(self, exe: str = 'HandBrakeCLI'):
+        self.exe = exe
+
+    def encode(self, job: FileJob, segment: Segment, progress: Callable[[float], None]) -> int:
+        p = subprocess.Popen([self.exe] + segment_args(job, segment), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+        # HandBrakeCLI redraws its progress line with \r, so read raw chunks rather than lines
+        while True:
+            chunk = p.stdout.read1(4096)
+
+            if not chunk:
+                break
+
+            m = None
+            for m in _rx_progress.finditer(chunk):
+                pass
+
+            if m:
+                progress(float(m.group(1)))
+
+        return p.wait()
+
+    # ffmpeg's concat demuxer with stream copy, the chunks all come from the same encoder settings
+    def concat(self, parts: List[Path], output: Path) -> int:
+        list_path = output.with_name(f'.{output.name}.concat')
+
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for p in parts:
+                escaped = str(p).replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+
+        try:
+            return subprocess.run(
+                ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', str(list_path),
+                 '-map', '0', '-c', 'copy', str(output)],
+                stdout=subprocess.DEVNULL
+            ).returncode
+        finally:
+            list_path.unlink(missing_ok=True)
+
+
+# Pretends to encode, for trying the runner without a GPU: takes `speed` seconds per media minute and
+# writes a small placeholder output. Sources whose name contains `failOn` exit with status 1.
+class StubEncoder(Encoder):
+    speed: float
+    failOn: Optional[str]
+
+    def __init__(self, speed: float = 0.05, failOn: str = None):
+        self.speed = speed
+        self.failOn = failOn
+
+    def encode(self, job: FileJob, segment: Segment, progress: Callable[[float], None]) -> int:
+        length = segment.length if segment.length is not None else job.seconds
+        steps = 10
+
+        for i in range(steps):
+            time.sleep(self.speed * length / 60 / steps)
+            progress((i + 1) * 100 / steps)
+
+        if self.failOn and self.failOn in job.source.name:
+            return 1
+
+        with open(segment.output, 'wb') as f:
+            f.write(b'\0' * 1024)
+
+        return 0
+
+    def concat(self, parts: List[Path], output: Path) -> int:
+        with open(output, 'wb') as out:
+            for p in parts:
+                with open(p, 'rb') as f:
+                    shutil.copyfileobj(f, out)
+
+        return 0
+
+
+encoders: Dict[str, Callable[[], Encoder]] = {
+    'handbrake': lambda: HandBrakeEncoder(),
+    'stub': lambda: StubEncoder()
+}
+
+
+# Longest-processing-time first: the costliest files go to whichever shard has the least work so far, then each
+# shard puts its files back in queue order. Files are never split, so all segments and the mv stay together.
+def shard_jobs(jobs: List[FileJob], n: int) -> List[List[FileJob]]:
+    loads = [(0.0, i) for i in range(n)]
+    shards: List[List[Tuple[int, FileJob]]] = [[] for _ in range(n)]
+
+    for (qi, job) in sorted(enumerate(jobs), key=lambda x: -x[1].cost):
+        (load, i) = heapq.heappop(loads)
+        shards[i].append((qi, job))
+        heapq.heappush(loads, (load + job.cost, i))
+
+    return [[job for (qi, job) in sorted(shard, key=lambda x: x[0])] for shard in shards]
+
+
+# whole files are reordered so each mv still follows its file's last segment, sorts are stable so equal costs
+# keep queue order
+policies: Dict[str, Callable[[List[FileJob]], List[FileJob]]] = {
+    'directory': lambda jobs: list(jobs),
+    'shortest': lambda jobs: sorted(jobs, key=lambda j: j.cost),
+    'longest': lambda jobs: sorted(jobs, key=lambda j: -j.cost)
+}
+
+
+# Replays run_jobs on estimated costs: each segment goes to whichever worker frees up first. Returns the
+# makespan and the mean time until a file is finished, in cost units.
+def simulate(jobs: List[FileJob], workers: int) -> Tuple[float, float]:
+    free = [0.0] * workers
+    finished = 0.0
+
+    for job in jobs:
+        end = 0.0
+
+        for seg in job.segments:
+            t = heapq.heappop(free) + seg.cost
+            heapq.heappush(free, t)
+            end = max(end, t)
+
+        finished += end
+
+    return max(free), finished / len(jobs) if jobs else 0.0
+
+
+# Splits a segment longer than 1.5 chunks into chunk_len pieces, the parts are hidden files next to the output
+# so they're never mistaken for finished encodes
+def split_segment(job: FileJob, segment: Segment, chunk_len: float) -> List[Segment]:
+    start = segment.start or 0
+    length = segment.length if segment.length is not None else job.seconds
+
+    if not chunk_len or length <= chunk_len * 1.5:
+        return []
+
+    count = math.ceil(length / chunk_len)
+    chunks = []
+
+    for i in range(count):
+        chunk_start = start + round(i * chunk_len)
+        chunk_end = start + length if i == count - 1 else start + round((i + 1) * chunk_len)
+        output = segment.output.with_name(f'.{segment.output.stem}.part{i:03}{segment.output.suffix}')
+        chunks.append(Segment(output, chunk_start, chunk_end - chunk_start, segment.cost * (chunk_end - chunk_start) / length))
+
+    return chunks
+
+
+# Copies upcoming sources to local scratch in queue order while earlier ones encode, so the encoder reads local
+# disk instead of the share. Copying pauses while the staged sources would go over `budget` bytes, and each copy
+# is deleted as soon as its file's last segment is done. A source the workers reach before its copy started is
+# read from the share as usual. Outputs are written under the same scratch folder and moved back once encoded.
+class Stager:
+    root: Path
+    budget: int
+    staged: int
+    stagedBytes: int
+
+    def __init__(self, root: Path, budget: int):
+        self.root = root
+        self.budget = budget
+        self.staged = 0
+        self.stagedBytes = 0
+        self._used = 0
+        # id(job) -> copying, staged, skipped or released
+        self._state: Dict[int, str] = {}
+        self._sizes: Dict[int, int] = {}
+        self._dirs: Dict[int, Path] = {}
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    # bytes held on scratch right now, copies still being made included
+    @property
+    def used(self) -> int:
+        return self._used
+
+    def start(self, jobs: List[FileJob]):
+        os.makedirs(self.root, exist_ok=True)
+
+        for (i, job) in enumerate(jobs):
+            self._dirs[id(job)] = self.root / str(i)
+
+        self._thread = threading.Thread(target=self._run, args=(jobs,), daemon=True)
+        self._thread.start()
+
+    def _run(self, jobs: List[FileJob]):
+        for job in jobs:
+            if not job.segments:
+                continue
+
+            try:
+                size = job.source.stat().st_size
+            except OSError:
+                continue
+
+            if size > self.budget:
+                continue
+
+            with self._cond:
+                while not self._stop and id(job) not in self._state and self._used + size > self.budget:
+                    self._cond.wait()
+
+                if self._stop:
+                    return
+                if id(job) in self._state:
+                    continue
+
+                self._state[id(job)] = 'copying'
+                self._sizes[id(job)] = size
+                self._used += size
+
+            local = self._dirs[id(job)] / job.source.name
+
+            try:
+                os.makedirs(local.parent, exist_ok=True)
+                shutil.copyfile(job.source, local)
+                state = 'staged'
+            except OSError:
+                local.unlink(missing_ok=True)
+                state = 'skipped'
+
+            with self._cond:
+                self._state[id(job)] = state
+
+                if state == 'staged':
+                    self.staged += 1
+                    self.stagedBytes += size
+                else:
+                    self._used -= size
+
+                self._cond.notify_all()
+
+    # waits for a copy that's already under way, a copy that hasn't started won't be made anymore
+    def source(self, job: FileJob) -> Path:
+        with self._cond:
+            self._state.setdefault(id(job), 'skipped')
+
+            while self._state[id(job)] == 'copying':
+                self._cond.wait()
+
+            if self._state[id(job)] == 'staged':
+                return self._dirs[id(job)] / job.source.name
+
+        return job.source
+
+    def output(self, job: FileJob, segment: Segment) -> Path:
+        d = self._dirs[id(job)]
+        os.makedirs(d, exist_ok=True)
+        return d / segment.output.name
+
+    def release(self, job: FileJob):
+        with self._cond:
+            if self._state.get(id(job)) == 'staged':
+                self._used -= self._sizes[id(job)]
+
+            self._state[id(job)] = 'released'
+            self._cond.notify_all()
+
+        shutil.rmtree(self._dirs[id(job)], ignore_errors=True)
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+
+        if self._thread:
+            self._thread.join()
+
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def move_source(job: FileJob):
+    os.makedirs(job.moveTo.parent, exist_ok=True)
+    shutil.move(str(job.source), str(job.moveTo))
+
+
+# Segments are handed out in queue order to `workers` threads, each driving one encoder session. Segments longer
+# than chunk_len seconds are split into chunks that are encoded like separate segments, whoever finishes the last
+# chunk joins them and checks the result's duration with `duration` (skipped when it's None). A file's source is
+# only moved into the done folder once all of its segments exited cleanly, by whichever worker finished the last
+# one. A failed segment leaves the source in place and the rest of the queue carries on. With a stager, encodes
+# read staged sources and write to scratch.
+def run_jobs(jobs: List[FileJob], workers: int, encoder: Encoder, journal: Journal = None,
+             on_start: Callable[[int, FileJob, Segment], None] = None,
+             on_progress: Callable[[int, float], None] = None,
+             on_done: Callable[[int, FileJob, Segment, int], None] = None,
+             chunk_len: float = 0, duration: Callable[[Path], Optional[float]] = None,
+             stager: Stager = None) -> RunStats:
+    stats = RunStats(files=len(jobs), workers=[WorkerStats() for _ in range(workers)])
+    tasks: queue.Queue = queue.Queue()
+    remaining: Dict[int, int] = {}
+    failed: Dict[int, bool] = {}
+    lock = threading.Lock()
+
+    for job in jobs:
+        remaining[id(job)] = len(job.segments)
+        failed[id(job)] = False
+
+        for s in job.segments:
+            chunks = split_segment(job, s, chunk_len)
+
+            if chunks:
+                group = ChunkGroup(chunks, len(chunks))
+
+                for c in chunks:
+                    tasks.put(SegmentTask(job, s, c, group))
+            else:
+                tasks.put(SegmentTask(job, s))
+
+    def move(job: FileJob):
+        try:
+            move_source(job)
+        except OSError as e:
+            with lock:
+                stats.failed.append(f'{job.source}: {e}')
+            return
+
+        with lock:
+            stats.moved += 1
+
+    def finish(job: FileJob, ok: bool):
+        with lock:
+            failed[id(job)] = failed[id(job)] or not ok
+            remaining[id(job)] -= 1
+            last = remaining[id(job)] == 0
+            ok = not failed[id(job)]
+
+        if last and stager:
+            stager.release(job)
+
+        if last and not ok:
+            with lock:
+                stats.failed.append(str(job.source))
+        elif last:
+            move(job)
+
+    def join_chunks(job: FileJob, segment: Segment, group: ChunkGroup) -> int:
+        parts = [c.output for c in group.chunks]
+
+        try:
+            status = encoder.concat(parts, segment.output)
+        except OSError:
+            status = -1
+
+        if status == 0 and duration:
+            expected = segment.length if segment.length is not None else job.seconds
+            got = duration(segment.output)
+
+            if got is None or abs(got - expected) > _duration_tolerance:
+                with lock:
+                    stats.failed.append(f'{segment.output}: joined duration {got}s, expected {expected}s')
+                segment.output.unlink(missing_ok=True)
+                status = -1
+
+        return status
+
+    def encode(job: FileJob, target: Segment, progress: Callable[[float], None]) -> int:
+        if not stager:
+            return encoder.encode(job, target, progress)
+
+        output = stager.output(job, target)
+        status = encoder.encode(replace(job, source=stager.source(job)), replace(target, output=output), progress)
+
+        if status == 0:
+            shutil.move(str(output), str(target.output))
+        else:
+            output.unlink(missing_ok=True)
+
+        return status
+
+    def work(wi: int):
+        ws = stats.workers[wi]
+
+        while True:
+            try:
+                t: SegmentTask = tasks.get_nowait()
+            except queue.Empty:
+                return
+
+            target = t.chunk or t.segment
+
+            if on_start:
+                on_start(wi, t.job, target)
+
+            started = time.monotonic()
+
+            try:
+                os.makedirs(t.job.destFolder, exist_ok=True)
+
+                # anything already there wasn't journaled, so it's what's left of an interrupted encode
+                if target.output.exists():
+                    target.output.unlink()
+                    with lock:
+                        stats.cleaned += 1
+
+                status = encode(t.job, target, (lambda pct: on_progress(wi, pct)) if on_progress else (lambda pct: None))
+            except OSError:
+                status = -1
+
+            seconds = target.length if target.length is not None else t.job.seconds
+            ws.busy += time.monotonic() - started
+            ws.segments += 1
+
+            if status == 0:
+                ws.seconds += seconds
+            else:
+                ws.failed += 1
+
+            if on_done:
+                on_done(wi, t.job, target, status)
+
+            if t.group:
+                with lock:
+                    t.group.failed = t.group.failed or not status == 0
+                    t.group.remaining -= 1
+                    last = t.group.remaining == 0
+
+                if not last:
+                    continue
+
+                status = -1 if t.group.failed else join_chunks(t.job, t.segment, t.group)
+
+                # the journal only knows whole segments, so a rerun encodes every chunk again either way
+                for c in t.group.chunks:
+                    c.output.unlink(missing_ok=True)
+
+            try:
+                size = t.segment.output.stat().st_size
+            except OSError:
+                size = 0
+
+            if journal:
+                journal.record(t.job.source, t.segment, status, size)
+
+            if status == 0:
+                seg_seconds = t.segment.length if t.segment.length is not None else t.job.seconds
+
+                with lock:
+                    stats.segments += 1
+                    stats.seconds += seg_seconds
+                    stats.outputBytes += size
+
+            finish(t.job, status == 0)
+
+    # every segment was journaled before an interruption, only the move is left
+    for job in jobs:
+        if not job.segments:
+            move(job)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=work, args=(i,), daemon=True) for i in range(workers)]
+
+    if stager:
+        stager.start(jobs)
+
+    try:
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        if stager:
+            stager.close()
+
+    stats.wall = time.monotonic() - started
+    return stats
@@ -0,0 +1,157 @@
+import os
+from pathlib import Path
+
+import dirWalker as walker
+
+_exts = ['.mp4', '.mkv']
+
+
+def make_tree(root: Path):
+    (root / 'a' / 'a1').mkdir(parents=True)
+    (root / 'b').mkdir()
+    (root / 'x.mp4').write_bytes(b'x')
+    (root / 'x.json').write_text('{}')
+    (root / '_.cq.24').write_text('')
+    (root / 'notes.txt').write_text('')
+    (root / 'a' / 'y.MKV').write_bytes(b'x')
+    (root / 'a' / 'a1' / 'z.mp4').write_bytes(b'x')
+    os.symlink(root / 'a', root / 'link')
+
+
+def test_list_dir_classifies_entries(tmp_path: Path):
+    make_tree(tmp_path)
+    listing = walker.list_dir(tmp_path, _exts)
+
+    assert listing.videos == [tmp_path / 'x.mp4']
+    assert listing.configs == [tmp_path / 'x.json']
+    assert listing.optFiles == [tmp_path / '_.cq.24']
+    assert sorted(listing.subdirs) == ['a', 'b', 'link']
+    assert listing.linkedSubdirs == ['link']
+    assert listing.fileCount == 4
+    assert listing.hasFiles
+
+
+def test_list_dir_extension_case(tmp_path: Path):
+    make_tree(tmp_path)
+    assert walker.list_dir(tmp_path / 'a', _exts).videos == [tmp_path / 'a' / 'y.MKV']
+
+
+def test_walk_matches_os_walk(tmp_path: Path):
+    make_tree(tmp_path)
+
+    expected = [Path(d) for (d, dirs, files) in os.walk(tmp_path)]
+
+    assert [l.path for l in walker.walk(tmp_path, _exts)] == expected
+    assert tmp_path / 'link' not in [l.path for l in walker.walk(tmp_path, _exts)]
+
+
+def bump_mtime(d: Path):
+    st = os.stat(d)
+    os.utime(d, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+
+
+def index_pass(root: Path, index_path: Path, fingerprint: str = 'fp', full: bool = False) -> walker.DirIndex:
+    index = walker.DirIndex(index_path, fingerprint, full)
+    list(walker.walk(root, _exts, index))
+    index.save()
+    return index
+
+
+def test_index_reuses_unchanged_dirs(tmp_path: Path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    make_tree(root)
+    index_path = tmp_path / 'index.pickle'
+
+    assert index_pass(root, index_path).rescanned == 4
+
+    (root / 'b' / 'new.mp4').write_bytes(b'x')
+    bump_mtime(root / 'b')
+    index = walker.DirIndex(index_path, 'fp')
+    listings = {l.path: l for l in walker.walk(root, _exts, index)}
+
+    assert (index.reused, index.rescanned) == (3, 1)
+    assert listings[root / 'b'].videos == [root / 'b' / 'new.mp4']
+
+
+def test_index_fingerprint_and_full(tmp_path: Path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    make_tree(root)
+    index_path = tmp_path / 'index.pickle'
+    index_pass(root, index_path)
+
+    assert index_pass(root, index_path, 'other').reused == 0
+    assert index_pass(root, index_path, 'other').reused == 4
+    assert index_pass(root, index_path, 'other', full=True).reused == 0
+
+
+def test_index_drops_deleted_dirs(tmp_path: Path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    make_tree(root)
+    index_path = tmp_path / 'index.pickle'
+    index_pass(root, index_path)
+
+    (root / 'b').rmdir()
+    index = index_pass(root, index_path)
+
+    assert index.reused + index.rescanned == 3
+
+
+def test_index_scan_reuse(tmp_path: Path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    make_tree(root)
+    index_path = tmp_path / 'index.pickle'
+
+    index = walker.DirIndex(index_path, 'fp')
+    list(walker.walk(root, _exts, index))
+    index.put_scan(root / 'a', ('sig',), {'planned': 1})
+    index.save()
+
+    index = walker.DirIndex(index_path, 'fp')
+    list(walker.walk(root, _exts, index))
+
+    assert index.get_scan(root / 'a', ('sig',)) == {'planned': 1}
+    assert index.get_scan(root / 'a', ('changed config',)) is None
+    assert index.get_scan(root / 'b', ('sig',)) is None
+    assert index.scansReused == 1
+
+
+def test_index_invalidate(tmp_path: Path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    make_tree(root)
+    index = walker.DirIndex(tmp_path / 'index.pickle', 'fp')
+    list(walker.walk(root, _exts, index))
+    index.put_scan(root / 'a', ('sig',), {'planned': 1})
+
+    index.invalidate(root / 'a')
+
+    assert index.get_scan(root / 'a', ('sig',)) is None
+    assert index.listing(root / 'a', _exts).videos == [root / 'a' / 'y.MKV']
+    assert index.rescanned == 5
+
+
+def test_walk_parallel_matches_walk(tmp_path: Path):
+    make_tree(tmp_path)
+
+    for i in range(20):
+        d = tmp_path / 'b' / f'd{i}' / 'deeper'
+        d.mkdir(parents=True)
+        (d / f'{i}.mp4').write_bytes(b'x')
+
+    expected = list(walker.walk(tmp_path, _exts))
+
+    assert list(walker.walk_parallel(tmp_path, _exts, 8)) == expected
+
+
+def test_walk_parallel_stops_early(tmp_path: Path):
+    make_tree(tmp_path)
+
+    walk = walker.walk_parallel(tmp_path, _exts, 4)
+    first = next(walk)
+    walk.close()
+
+    assert first.path == tmp_path
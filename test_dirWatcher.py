@@ -0,0 +1,120 @@
+from pathlib import Path
+
+import pytest
+
+import dirWatcher
+import queueRunner as runner
+from queueRunner import Segment
+
+
+@pytest.fixture
+def watcher(tmp_path: Path):
+    try:
+        w = dirWatcher.Watcher(0.05, 0.5, ignore=lambda d, name: name.endswith('.tmp'))
+    except OSError as e:
+        pytest.skip(f'inotify unavailable: {e}')
+
+    w.add(tmp_path)
+
+    with w:
+        yield w
+
+
+def test_file_changes_are_batched(tmp_path: Path, watcher: dirWatcher.Watcher):
+    (tmp_path / 'a.mp4').write_bytes(b'x')
+    (tmp_path / 'b.mp4').write_bytes(b'x')
+
+    batch = watcher.next_batch(1.0)
+
+    assert batch is not None
+    assert batch.changed == {tmp_path}
+    assert watcher.next_batch(0.2) is None
+
+
+def test_new_subdir_is_reported(tmp_path: Path, watcher: dirWatcher.Watcher):
+    (tmp_path / 'sub').mkdir()
+
+    batch = watcher.next_batch(1.0)
+
+    assert batch.created == {tmp_path / 'sub'}
+    assert not batch.changed
+
+
+def test_removed_subdir_is_reported(tmp_path: Path, watcher: dirWatcher.Watcher):
+    (tmp_path / 'sub').mkdir()
+    watcher.next_batch(1.0)
+    (tmp_path / 'sub').rmdir()
+
+    batch = watcher.next_batch(1.0)
+
+    assert tmp_path / 'sub' in batch.removed
+
+
+def test_ignored_writes_alone_make_no_batch(tmp_path: Path, watcher: dirWatcher.Watcher):
+    for i in range(5):
+        (tmp_path / f'.queue-{i}.sh.tmp').write_text('x')
+
+    assert watcher.next_batch(0.3) is None
+
+
+def test_ignored_writes_join_a_real_batch(tmp_path: Path, watcher: dirWatcher.Watcher):
+    (tmp_path / '.queue.sh.tmp').write_text('x')
+    (tmp_path / 'a.mp4').write_bytes(b'x')
+
+    batch = watcher.next_batch(1.0)
+
+    assert batch.changed == {tmp_path}
+    assert watcher.next_batch(0.2) is None
+
+
+@pytest.fixture
+def own_watcher(tmp_path: Path):
+    try:
+        w = dirWatcher.Watcher(0.05, 0.5, ignore=lambda d, name: d == tmp_path and runner.own_file(name))
+    except OSError as e:
+        pytest.skip(f'inotify unavailable: {e}')
+
+    w.add(tmp_path)
+
+    with w:
+        yield w
+
+
+def test_queue_write_is_ignored(tmp_path: Path, own_watcher: dirWatcher.Watcher):
+    with runner.AtomicFile(tmp_path / runner.queue_file_name()) as f:
+        f.write('echo\n')
+
+    assert own_watcher.next_batch(0.3) is None
+
+
+def test_shard_writes_are_ignored(tmp_path: Path, own_watcher: dirWatcher.Watcher):
+    for i in range(3):
+        for win in [False, True]:
+            with runner.AtomicFile(tmp_path / runner.queue_file_name(i, win)) as f:
+                f.write('echo\n')
+
+    assert own_watcher.next_batch(0.3) is None
+
+
+def test_journal_writes_are_ignored(tmp_path: Path, own_watcher: dirWatcher.Watcher):
+    src = tmp_path / 'a.mp4'
+    src.write_bytes(b'x')
+    # let the source's own event drain first
+    own_watcher.next_batch(0.3)
+
+    journal = runner.Journal(tmp_path / runner.journal_name)
+    seg = Segment(tmp_path / 'out' / 'a.mkv')
+    journal.record(src, seg, 0, 10)
+    journal.compact()
+
+    assert own_watcher.next_batch(0.3) is None
+
+
+def test_other_files_still_trigger(tmp_path: Path, own_watcher: dirWatcher.Watcher):
+    (tmp_path / 'queue.txt').write_text('x')
+    (tmp_path / 'b.mp4').write_bytes(b'x')
+
+    batch = own_watcher.next_batch(1.0)
+
+    assert batch is not None
+    assert batch.changed == {tmp_path}
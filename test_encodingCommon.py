@@ -0,0 +1,131 @@
+import os
+import random
+from pathlib import Path
+
+import pytest
+
+import benchmarks
+import encodingCommon as enc
+
+_file_names = ['clip 10.mp4', 'clip 9.mp4', 'Clip_2.mkv', 'a.b.c.mp4', '__x.mp4', 'part-1.10.mkv', 'part-1.9.mkv', 'v1.2']
+_dir_names = ['v1.2', 'v1.10', 'season 2', 'Season 10', '__..c', 'a.b']
+
+
+@pytest.fixture
+def names_dir(tmp_path: Path) -> Path:
+    (tmp_path / 'files').mkdir()
+
+    for n in _file_names:
+        (tmp_path / 'files' / n).write_bytes(b'')
+
+    for n in _dir_names:
+        (tmp_path / 'dirs' / n).mkdir(parents=True)
+
+    return tmp_path
+
+
+def no_stat(*args, **kwargs):
+    raise AssertionError('sort key touched the filesystem')
+
+
+@pytest.mark.parametrize('kind, names, is_file', [('files', _file_names, True), ('dirs', _dir_names, False)])
+def test_dblcmd_type_hint_matches_stat(names_dir: Path, monkeypatch, kind: str, names: list, is_file: bool):
+    parent = names_dir / kind
+    expected = sorted(names, key=lambda k: enc.dblcmd_file_sort_keys(k, parent))
+
+    monkeypatch.setattr(os, 'stat', no_stat)
+    monkeypatch.setattr(Path, 'is_file', no_stat)
+
+    assert sorted(names, key=lambda k: enc.dblcmd_file_sort_keys(k, parent, is_file)) == expected
+
+
+def test_dblcmd_type_decides_suffix():
+    # a folder's dotted part is not an extension to sort by
+    assert enc.dblcmd_file_sort_keys('v1.10', None, False) != enc.dblcmd_file_sort_keys('v1.10', None, True)
+
+
+def random_names(count: int) -> list:
+    rnd = random.Random(count)
+    words = ['clip', 'Scene', 'part', 'IMG', 'vid', 'Straße', 'été', 'take', 'b-roll', 'cam', '__', '~', 'Ö']
+    seps = [' ', '_', '-', '.', '__', ' - ', '', '_-', '·', "'"]
+    names = []
+
+    for i in range(count):
+        parts = [f'{rnd.choice(words)}{rnd.choice(seps)}{str(rnd.randint(0, 10 ** rnd.randint(1, 6))).zfill(rnd.choice([0, 2, 4]))}'
+                 for j in range(rnd.randint(1, 4))]
+        names.append(''.join(parts) + rnd.choice(['.mp4', '.MKV', '.txt', '']))
+
+    return names
+
+
+def test_compiled_keys_match_reference():
+    names = random_names(5000)
+    enc.sort_key_cache_clear()
+
+    assert sorted(names, key=enc.windows_file_sort_keys) == sorted(names, key=benchmarks.windows_file_sort_keys_reference)
+
+    for is_file in [True, False]:
+        assert [enc.dblcmd_file_sort_keys(n, None, is_file) for n in names] == \
+            [benchmarks.dblcmd_file_sort_keys_reference(n, is_file) for n in names]
+
+
+def test_sort_bench_keeps_the_reference_order():
+    assert [r['same order'] for r in benchmarks.sort_bench(500)] == ['yes'] * 3
+
+
+def test_encode_cost_reference_is_one_to_one():
+    assert enc.encode_cost(60, 1920, 1080, 30) == 60
+
+
+@pytest.mark.parametrize('width, height, fps, factor', [
+    (3840, 2160, 30, 4),
+    (1920, 1080, 60, 2),
+    (1280, 720, 30, 1280 * 720 / (1920 * 1080)),
+    (0, 0, 60, 2),
+    (1920, 1080, 0, 1),
+    (0, 0, 0, 1)
+])
+def test_encode_cost_scales_with_pixels_and_fps(width: float, height: float, fps: float, factor: float):
+    assert enc.encode_cost(100, width, height, fps) == pytest.approx(100 * factor)
+
+
+def spans(*pairs):
+    return [enc.TimeSpan(s, e, 600) for s, e in pairs]
+
+
+def bounds(times):
+    return [(t.start, t.end, t.length) for t in times]
+
+
+def test_merge_spans_joins_overlaps_and_small_gaps():
+    times = spans(('0:10', '0:30'), ('0:20', '0:40'), ('0:45', '1:00'), ('2:00', '2:10'))
+
+    assert bounds(enc.merge_spans(times, 5)) == [(10, 60, 50), (120, 130, 10)]
+    assert bounds(enc.merge_spans(times, 0)) == [(10, 40, 30), (45, 60, 15), (120, 130, 10)]
+
+
+def test_merge_spans_sorts_by_start():
+    times = spans(('2:00', '2:10'), ('0:10', '0:20'), ('0:15', '0:25'))
+
+    assert bounds(enc.merge_spans(times, 0)) == [(10, 25, 15), (120, 130, 10)]
+
+
+def test_merge_spans_keeps_contained_span_end():
+    times = spans(('0:10', '1:00'), ('0:20', '0:30'))
+
+    assert bounds(enc.merge_spans(times, 0)) == [(10, 60, 50)]
+
+
+def test_merge_spans_leaves_input_untouched():
+    times = spans(('0:10', '0:20'), ('0:20', '0:30'))
+
+    merged = enc.merge_spans(times, 0)
+
+    assert bounds(merged) == [(10, 30, 20)]
+    assert bounds(times) == [(10, 20, 10), (20, 30, 10)]
+
+
+def test_merge_spans_open_end_runs_to_video_length():
+    times = spans(('0:10', '0:20'), ('9:00', None))
+
+    assert bounds(enc.merge_spans(times, 600)) == [(10, 600, 590)]
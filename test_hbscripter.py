@@ -0,0 +1,401 @@
+import csv
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from test_headerProbe import mkv, mp4
+
+# hbscripter parses its arguments at import, so the tests run it as a script
+pytest.importorskip('tabulate')
+pytest.importorskip('tqdm')
+
+if sys.version_info < (3, 12):
+    pytest.skip('hbscripter needs Python 3.12', allow_module_level=True)
+
+_script = Path(__file__).resolve().parent / 'hbscripter.py'
+_rx_log_time = re.compile(r'^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\t', re.MULTILINE)
+_rx_ansi = re.compile(r'\x1b\[[0-9;]*m')
+
+
+def run(*args: str, cwd: Path = _script.parent) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, str(_script), *args], cwd=cwd, capture_output=True, text=True, timeout=120)
+
+
+def run_ok(*args: str) -> str:
+    res = run(*args)
+
+    assert res.returncode == 0, res.stdout + res.stderr
+    return _rx_log_time.sub('', res.stdout)
+
+
+def write_video(path: Path, fps: float, frames: int, width: int = 64, height: int = 48):
+    cv2 = pytest.importorskip('cv2')
+    np = pytest.importorskip('numpy')
+    w = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+
+    for i in range(frames):
+        w.write(np.full((height, width, 3), i % 255, np.uint8))
+
+    w.release()
+
+
+@pytest.fixture
+def videos(tmp_path: Path) -> Path:
+    root = tmp_path / 'videos'
+    (root / 'sub' / 'deeper').mkdir(parents=True)
+    write_video(root / 'a~0:01-0:03.mp4', 25, 100)
+    write_video(root / 'sub' / 'b~renc.mp4', 60, 120, 96, 64)
+    write_video(root / 'sub' / 'c.mp4', 30, 90)
+    write_video(root / 'sub' / 'deeper' / 'd~0:00-0:02 0:03-.mp4', 24, 120)
+    return root
+
+
+def test_jobs_match_serial_queue(videos: Path):
+    serial = run_ok('-rd', str(videos), '--no-bar', '--no-cache')
+    queue = (videos / 'queue.sh').read_text()
+    parallel = run_ok('-rd', str(videos), '--no-bar', '--no-cache', '-j', '3')
+
+    assert parallel == serial
+    assert (videos / 'queue.sh').read_text() == queue
+    assert queue.count('HandBrakeCLI') == 3
+
+
+@pytest.mark.parametrize('mode', ['-fps', '-btr'])
+def test_jobs_match_serial_listing(videos: Path, mode: str):
+    serial = run_ok('-rd', str(videos), '--no-bar', '--no-cache', mode)
+    parallel = run_ok('-rd', str(videos), '--no-bar', '--no-cache', '-j', '3', mode)
+
+    # only the stage caption differs, the pool probes everything before the listing starts
+    assert parallel.replace('Probing files', 'Scanning files') == serial
+    assert 'deeper' in serial
+
+
+def test_golden_sort_orders():
+    res = run('--sort-test')
+
+    assert res.returncode == 0, res.stdout + res.stderr
+
+
+# header-probed stand-ins, a 10 s 29.97 fps 1080p mp4 and a 10 s 25 fps 720p mkv
+@pytest.fixture
+def library(tmp_path: Path) -> Path:
+    root = tmp_path / 'lib'
+    (root / 'sub').mkdir(parents=True)
+    (root / 'a~0:01-0:03.mp4').write_bytes(mp4())
+    (root / 'sub' / 'b~renc.mkv').write_bytes(mkv())
+    (root / 'sub' / 'c.mp4').write_bytes(mp4())
+    return root
+
+
+# adds a two-span 4K title and a 59.94 fps renc dropped to 30 fps
+@pytest.fixture
+def manifest_library(library: Path) -> Path:
+    (library / 'sub' / 'd~0:00-0:02 0:04-0:06 [q24].mp4').write_bytes(mp4(width=3840, height=2160))
+    (library / 'sub' / 'e~renc [r30].mp4').write_bytes(mp4(timescale=60000, stts=[(600, 1001)]))
+    return library
+
+
+def plan(root: Path, *args: str) -> str:
+    return run_ok('-rd', str(root), '--no-bar', '--no-cache', '-pb', 'header', *args)
+
+
+def test_queue_is_replaced_in_place(library: Path):
+    plan(library)
+    queue = library / 'queue.sh'
+    queue.chmod(0o750)
+    queue.write_text('stale')
+
+    plan(library)
+
+    assert queue.stat().st_mode & 0o777 == 0o750
+    assert queue.read_text().count('HandBrakeCLI') == 2
+    assert not [p for p in library.iterdir() if p.name.endswith('.tmp')]
+
+
+def test_empty_queue(tmp_path: Path):
+    plan(tmp_path)
+
+    assert (tmp_path / 'queue.sh').read_text() == 'echo no items'
+
+
+# sub's plan comes from the directory index once its dest folder exists, unless a plan option changed since
+@pytest.mark.parametrize('args, reused', [([], True), (['--merge-gap', '5'], False), (['--redo-existing'], False), (['--order', 'longest'], False)])
+def test_index_reuses_plans_made_with_the_same_options(tmp_path: Path, library: Path, args: list, reused: bool):
+    cached = ['-rd', str(library), '--no-bar', '--cache-dir', str(tmp_path / 'cache'), '-pb', 'header', '-t']
+    # the first plan creates the dest folders, which changes the directories it indexed
+    run_ok(*cached)
+    run_ok(*cached)
+
+    assert ('Reusing plan for sub' in run_ok(*cached, *args)) == reused
+
+
+def test_plan_rejects_run(library: Path):
+    res = run('-rd', str(library), '--plan', '--run')
+
+    assert res.returncode == 2
+    assert '--plan is a dry run' in res.stderr
+    assert not (library / 'queue.sh').exists()
+
+
+# encode and move lines without their set_title prefix
+def commands(queue: str) -> list:
+    return sorted(line.split(' && ')[-1] for line in queue.splitlines() if 'HandBrakeCLI' in line or line.startswith('mv '))
+
+
+def test_shards_split_the_queue(library: Path):
+    plan(library)
+    whole = (library / 'queue.sh').read_text()
+    (library / 'queue.sh').unlink()
+
+    plan(library, '--shards', '2')
+    shards = [(library / f'queue-{i}.sh').read_text() for i in [1, 2]]
+
+    assert not (library / 'queue.sh').exists()
+    assert all('HandBrakeCLI' in q for q in shards)
+    assert commands(shards[0] + shards[1]) == commands(whole)
+
+
+@pytest.mark.parametrize('sessions', ['0', '-1'])
+def test_plan_needs_a_session(library: Path, sessions: str):
+    res = run('-rd', str(library), '--plan', '--sessions', sessions)
+
+    assert res.returncode == 2
+    assert '--sessions needs at least 1 session' in res.stderr
+
+
+def test_manifest_has_a_record_per_segment(manifest_library: Path):
+    plan(manifest_library, '--manifest')
+    records = {Path(r['dest']).name: r for r in map(json.loads, (manifest_library / 'queue.ndjson').read_text().splitlines())}
+    queue = (manifest_library / 'queue.sh').read_text()
+
+    assert len(records) == queue.count('HandBrakeCLI') == 5
+    assert all(f'-o "{r["dest"]}"' in queue for r in records.values())
+
+    spans = {name: (r['start'], r['length'], r['cq'], r['bitrate'], r['setfps'], r['cost']) for (name, r) in records.items()}
+
+    assert spans == {
+        'a-nvenc-cq32.mp4': (1, 2, 32, None, None, 2.0),
+        'b-nvenc-cq32.mp4': (None, 11, 32, None, None, 4.1),
+        'd-0-nvenc-cq24.mp4': (0, 2, 24, None, None, 8.0),
+        'd-1-nvenc-cq24.mp4': (4, 2, 24, None, None, 8.0),
+        'e-nvenc-cq32-r30.0.mp4': (None, 12, 32, None, 30.0, 12.0)
+    }
+    assert records['e-nvenc-cq32-r30.0.mp4']['fps'] == pytest.approx(60000 / 1001)
+
+
+def test_manifest_is_not_left_half_written(manifest_library: Path):
+    manifest = manifest_library / 'queue.ndjson'
+    manifest.write_text('old')
+    # the queue can't be swapped in, so the run fails after every manifest record was written
+    (manifest_library / 'queue.sh').mkdir()
+
+    assert run('-rd', str(manifest_library), '--no-bar', '--no-cache', '-pb', 'header', '--manifest').returncode != 0
+    assert manifest.read_text() == 'old'
+    assert not (manifest_library / '.queue.ndjson.tmp').exists()
+
+
+# a's span is 2 s long, a 29.97 fps output of `frames` frames sits in its dest folder
+def encoded(library: Path, name: str, frames: int):
+    (library / '__..c').mkdir(exist_ok=True)
+    (library / '__..c' / name).write_bytes(mp4(stts=[(frames, 1001)]))
+
+
+def queued(library: Path, *args: str) -> bool:
+    plan(library, *args)
+    queue = (library / 'queue.sh').read_text()
+
+    assert 'mv "' + str(library / 'a~0:01-0:03.mp4') in queue
+    return 'a-nvenc-cq32.mp4' in queue
+
+
+# 149 frames are 4.97 s, within 3 s of the span, 150 frames are 5.005 s
+@pytest.mark.parametrize('frames, skipped', [(60, True), (149, True), (150, False), (300, False)])
+def test_existing_output_duration_tolerance(library: Path, frames: int, skipped: bool):
+    encoded(library, 'a-nvenc-cq32.mp4', frames)
+
+    assert queued(library) != skipped
+
+
+# only the exact name this config produces counts, an encode at other settings doesn't stop a re-encode
+@pytest.mark.parametrize('name', ['a-nvenc-cq28.mp4', 'a-nvenc-cq32-r30.0.mp4', 'a-0-nvenc-cq32.mp4'])
+def test_existing_output_at_other_settings(library: Path, name: str):
+    encoded(library, name, 60)
+
+    assert queued(library)
+
+
+def test_redo_existing(library: Path):
+    encoded(library, 'a-nvenc-cq32.mp4', 60)
+
+    assert not queued(library)
+    assert queued(library, '--redo-existing')
+
+
+# the count in each title comes from the same planning pass that wrote the queue, skipped segments left out
+def test_queue_numbering_leaves_skipped_segments_out(library: Path):
+    encoded(library, 'a-nvenc-cq32.mp4', 60)
+    out = plan(library)
+    queue = (library / 'queue.sh').read_text()
+
+    assert 'Queue Size: 1\n' in _rx_ansi.sub('', out)
+    assert queue.count('HandBrakeCLI') == 1
+    assert 'set_title "1/1 b"' in queue
+
+
+def test_merge_gap_merges_queued_spans(manifest_library: Path):
+    plan(manifest_library, '--merge-gap', '5')
+    queue = (manifest_library / 'queue.sh').read_text()
+
+    assert 'd-nvenc-cq24.mp4" --start-at seconds:0 --stop-at seconds:6' in queue
+    assert 'd-0-nvenc' not in queue
+
+
+def test_merge_gap_shows_in_plan_and_manifest(manifest_library: Path):
+    out = _rx_ansi.sub('', plan(manifest_library, '--plan', '--merge-gap', '5'))
+
+    assert '00:06\t0 -> 6' in out
+    assert '4 -> 6' not in out
+
+    plan(manifest_library, '--merge-gap', '5', '--manifest')
+    records = [json.loads(line) for line in (manifest_library / 'queue.ndjson').read_text().splitlines()]
+
+    assert [(r['start'], r['length']) for r in records if Path(r['dest']).name.startswith('d')] == [(0, 6)]
+
+
+def test_single_pass_decodes_once(manifest_library: Path):
+    plan(manifest_library, '--single-pass')
+    lines = (manifest_library / 'queue.sh').read_text().splitlines()
+    passes = [line for line in lines if 'ffmpeg ' in line]
+
+    assert len(passes) == 1
+    assert passes[0].count(' -i ') == 1
+    assert '-ss 0 -t 2 ' in passes[0] and '-ss 4 -t 2 ' in passes[0]
+    assert sum('HandBrakeCLI' in line for line in lines) == 3
+
+
+# ffmpeg's outputs are named apart from HandBrake's, and a file planned for one pass stays there when a span is done
+def test_single_pass_outputs_are_named_apart(manifest_library: Path):
+    dest = manifest_library / 'sub' / '__..c'
+    dest.mkdir()
+    (dest / 'd-0-nvenc-cq24.mp4').write_bytes(mp4(stts=[(60, 1001)]))
+    (dest / 'd-1-nvenc-cq24.mp4').write_bytes(mp4(stts=[(60, 1001)]))
+    plan(manifest_library, '--single-pass')
+    queue = (manifest_library / 'queue.sh').read_text()
+
+    assert 'd-0-nvenc-cq24-ff.mp4' in queue and 'd-1-nvenc-cq24-ff.mp4' in queue
+
+    (dest / 'd-0-nvenc-cq24-ff.mp4').write_bytes(mp4(stts=[(60, 1001)]))
+    plan(manifest_library, '--single-pass')
+    passes = [line for line in (manifest_library / 'queue.sh').read_text().splitlines() if 'ffmpeg ' in line]
+
+    assert len(passes) == 1
+    assert 'd-0-nvenc' not in passes[0] and '-ss 4 -t 2 ' in passes[0] and 'd-1-nvenc-cq24-ff.mp4' in passes[0]
+
+
+# the listing's rows as lists of cells, without colours, rules and log lines
+def table_cells(out: str) -> list:
+    lines = [_rx_ansi.sub('', line).strip() for line in out.splitlines()]
+    return [re.split(r'\s{2,}', line) for line in lines if line and not line.startswith('-') and 'LOG\t' not in line and line != 'Scanning files']
+
+
+@pytest.mark.parametrize('modes', [['-fps'], ['-btr', '-fps']])
+def test_stream_rows_match_table(manifest_library: Path, modes: list):
+    table = plan(manifest_library, *modes)
+
+    assert table_cells(plan(manifest_library, '--stream', *modes)) == table_cells(table)
+    assert len(table_cells(table)) > 3
+
+
+# every streamed cell starts where its column's rule does, the first rows can't be narrower than later ones
+@pytest.mark.parametrize('modes', [['-btr', '-fps'], ['-fps', '-fs'], ['-btr', '-fps', '-t']])
+def test_stream_rows_share_column_offsets(manifest_library: Path, modes: list):
+    lines = [_rx_ansi.sub('', line) for line in plan(manifest_library, '--stream', *modes).splitlines()]
+    rule = next(i for (i, line) in enumerate(lines) if line.startswith('---'))
+    columns = [m.start() for m in re.finditer(r'-+', lines[rule])]
+    rows = [line for line in lines[rule + 1:] if line.strip() and '\t' not in line]
+
+    assert len(rows) > 5
+    assert all(m.start() in columns for row in rows for m in re.finditer(r'(?:^|(?<=  ))\S', row))
+
+
+# a lone folder prints without its header, streamed or not, and -j probes ahead without reordering rows
+@pytest.mark.parametrize('jobs', ['1', '2'])
+def test_stream_single_folder_matches_table(tmp_path: Path, jobs: str):
+    (tmp_path / 'a.mp4').write_bytes(mp4())
+    (tmp_path / 'b.mp4').write_bytes(mp4(timescale=60000, stts=[(600, 1001)]))
+    table = table_cells(plan(tmp_path, '-fps'))
+
+    assert table_cells(plan(tmp_path, '--stream', '-j', jobs, '-fps')) == table
+    assert [row[0] for row in table] == ['a.mp4', 'b.mp4']
+
+
+def test_stats_summary(manifest_library: Path):
+    out = [table_cells(line)[0] for line in plan(manifest_library, '-fps', '--stats').splitlines() if table_cells(line)]
+    summary = out[out.index(['files', 'folders', 'GB', 'media h', '1080p30 encode h', 'unreadable']) + 1]
+
+    assert summary[:2] == ['5', '2']
+    assert summary[-1] == '0'
+    assert ['.mp4', '4', '4'] in out
+
+
+def test_list_groups_variants(tmp_path: Path):
+    names = ['x~0:00-0:02 0:03-0:05.mp4', 'x-0-nvenc-cq32.mp4', 'x-1-nvenc-cq32.mp4', 'xa-nvenc-cq30.mp4', 'y.mp4',
+             'y-nvenc-cq30.mp4', 'z~renc.mp4']
+
+    for n in names:
+        (tmp_path / n).write_bytes(mp4())
+
+    blocks = [[]]
+
+    for line in _rx_ansi.sub('', plan(tmp_path, '-fps')).splitlines()[2:]:
+        if line.strip():
+            blocks[-1].append(line.strip('| ').split('  ')[0])
+        elif blocks[-1]:
+            blocks.append([])
+
+    assert [b for b in blocks if b] == [
+        ['x-0-nvenc-cq32.mp4', 'x-1-nvenc-cq32.mp4', 'x~0:00-0:02 0:03-0:05.mp4', 'xa-nvenc-cq30.mp4'],
+        ['y.mp4', 'y-nvenc-cq30.mp4'],
+        ['z~renc.mp4']
+    ]
+
+
+def export(root: Path, path: Path, *args: str) -> str:
+    plan(root, '-fps', '--export', str(path), *args)
+    return path.read_text(encoding='utf-8')
+
+
+def test_export_csv(tmp_path: Path, library: Path):
+    rows = list(csv.DictReader(export(library, tmp_path / 'out.csv').splitlines()))
+
+    assert [(r['dir'], r['file'], r['ext']) for r in rows] == [('.', 'a~0:01-0:03.mp4', '.mp4'), ('sub', 'b~renc.mkv', '.mkv'), ('sub', 'c.mp4', '.mp4')]
+    assert rows[0]['frames'] == '300'
+    assert rows[0]['width'] == '1920.0' and rows[0]['height'] == '1080.0'
+    assert float(rows[1]['fps']) == 25.0
+    assert (rows[1]['grp_enc'], rows[1]['grp_res']) == ('b', '')
+    assert all(r['listed'] == 'True' for r in rows)
+
+
+def test_export_ndjson(tmp_path: Path, library: Path):
+    records = [json.loads(line) for line in export(library, tmp_path / 'out.ndjson').splitlines()]
+
+    assert [(r['dir'], r['file']) for r in records] == [('.', 'a~0:01-0:03.mp4'), ('sub', 'b~renc.mkv'), ('sub', 'c.mp4')]
+    assert records[0]['fps'] == pytest.approx(30000 / 1001)
+    assert records[1]['width'] == 1280 and records[1]['height'] == 720
+    assert (records[2]['grp_enc'], records[2]['grp_res']) == (None, 'c')
+    assert records[0]['fps_over'] is False
+
+
+def test_export_stream_matches_table(tmp_path: Path, library: Path):
+    assert export(library, tmp_path / 'stream.jsonl', '--stream') == export(library, tmp_path / 'table.jsonl')
+
+
+def test_export_rejects_other_formats(tmp_path: Path, library: Path):
+    res = run('-rd', str(library), '-fps', '--export', str(tmp_path / 'out.txt'))
+
+    assert res.returncode == 2
+    assert '--export writes .csv, .ndjson or .jsonl files' in res.stderr
@@ -0,0 +1,126 @@
+import struct
+from pathlib import Path
+
+import pytest
+
+import headerProbe
+
+
+def box(typ: bytes, *children: bytes) -> bytes:
+    payload = b''.join(children)
+    return struct.pack('>I4s', 8 + len(payload), typ) + payload
+
+
+def mp4(timescale: int = 30000, stts: list = None, handler: bytes = b'vide', width: int = 1920, height: int = 1080) -> bytes:
+    stts = [(300, 1001)] if stts is None else stts
+    mdhd = box(b'mdhd', bytes(12), struct.pack('>II', timescale, 0), bytes(4))
+    hdlr = box(b'hdlr', bytes(8), handler, bytes(13))
+    # sample entry header, then the visual sample entry fields up to width and height
+    entry = struct.pack('>I4s', 86, b'hvc1') + bytes(6) + struct.pack('>H', 1) + bytes(16) + struct.pack('>HH', width, height) + bytes(50)
+    stsd = box(b'stsd', struct.pack('>II', 0, 1), entry)
+    stts_box = box(b'stts', struct.pack('>II', 0, len(stts)), *[struct.pack('>II', n, d) for (n, d) in stts])
+    trak = box(b'trak', box(b'mdia', mdhd, hdlr, box(b'minf', box(b'stbl', stsd, stts_box))))
+    return box(b'ftyp', b'isom', bytes(4)) + box(b'moov', trak) + box(b'mdat', bytes(16))
+
+
+def ebml_id(eid: int) -> bytes:
+    return eid.to_bytes((eid.bit_length() + 7) // 8, 'big')
+
+
+def el(eid: int, *children: bytes, unknown_size: bool = False) -> bytes:
+    payload = b''.join(children)
+    size = b'\x01' + (b'\xff' * 7 if unknown_size else len(payload).to_bytes(7, 'big'))
+    return ebml_id(eid) + size + payload
+
+
+def uint(eid: int, v: int) -> bytes:
+    return el(eid, v.to_bytes(max(1, (v.bit_length() + 7) // 8), 'big'))
+
+
+def mkv(default_duration: int = 40000000, duration_ms: float = 10000.0, width: int = 1280, height: int = 720,
+        unknown_size: bool = False, cluster_first: bool = False) -> bytes:
+    info = el(headerProbe._mkv_info_id, uint(headerProbe._mkv_timestamp_scale_id, 1000000),
+              el(headerProbe._mkv_duration_id, struct.pack('>d', duration_ms)))
+    video = el(headerProbe._mkv_video_id, uint(headerProbe._mkv_pixel_width_id, width), uint(headerProbe._mkv_pixel_height_id, height))
+    entry = el(headerProbe._mkv_track_entry_id, uint(headerProbe._mkv_track_type_id, 1),
+               uint(headerProbe._mkv_default_duration_id, default_duration), video)
+    tracks = el(headerProbe._mkv_tracks_id, entry)
+    cluster = el(headerProbe._mkv_cluster_id, bytes(8))
+    body = cluster + info + tracks if cluster_first else info + tracks + cluster
+    return el(headerProbe._ebml_header_id) + el(headerProbe._mkv_segment_id, body, unknown_size=unknown_size)
+
+
+def probe_bytes(tmp_path: Path, name: str, data: bytes):
+    p = tmp_path / name
+    p.write_bytes(data)
+    return headerProbe.probe(str(p))
+
+
+def test_mp4_constant_rate(tmp_path: Path):
+    assert probe_bytes(tmp_path, 'a.mp4', mp4()) == (30000 / 1001, 300, 1920.0, 1080.0)
+
+
+def test_mp4_integer_rate(tmp_path: Path):
+    assert probe_bytes(tmp_path, 'a.mov', mp4(12800, [(250, 512)], width=640, height=360)) == (25.0, 250, 640.0, 360.0)
+
+
+def test_mp4_variable_rate_falls_back(tmp_path: Path):
+    assert probe_bytes(tmp_path, 'a.mp4', mp4(stts=[(100, 1001), (1, 2002)])) is None
+
+
+def test_mp4_without_video_track(tmp_path: Path):
+    assert probe_bytes(tmp_path, 'a.mp4', mp4(handler=b'soun')) is None
+
+
+def test_mp4_truncated(tmp_path: Path):
+    data = mp4()
+    assert probe_bytes(tmp_path, 'a.mp4', data[:len(data) // 2]) is None
+
+
+def test_mkv(tmp_path: Path):
+    assert probe_bytes(tmp_path, 'a.mkv', mkv()) == (25.0, 250, 1280.0, 720.0)
+
+
+def test_mkv_ntsc_rate(tmp_path: Path):
+    (fps, frames, width, height) = probe_bytes(tmp_path, 'a.webm', mkv(41708333, 60000.0))
+
+    assert fps == 24000 / 1001
+    assert frames == 1439
+
+
+def test_mkv_unknown_size_segment(tmp_path: Path):
+    assert probe_bytes(tmp_path, 'a.mkv', mkv(unknown_size=True)) == (25.0, 250, 1280.0, 720.0)
+
+
+def test_mkv_cluster_before_tracks_falls_back(tmp_path: Path):
+    assert probe_bytes(tmp_path, 'a.mkv', mkv(cluster_first=True)) is None
+
+
+def test_mkv_rate_out_of_range_falls_back(tmp_path: Path):
+    # 2 fps, FFmpeg estimates these from packets
+    assert probe_bytes(tmp_path, 'a.mkv', mkv(500000000)) is None
+
+
+@pytest.mark.parametrize('name, data', [('a.mkv', b'not a matroska file'), ('a.mp4', b''), ('a.avi', b'RIFF')])
+def test_unreadable_files(tmp_path: Path, name: str, data: bytes):
+    assert probe_bytes(tmp_path, name, data) is None
+
+
+def test_missing_file(tmp_path: Path):
+    assert headerProbe.probe(str(tmp_path / 'missing.mp4')) is None
+
+
+@pytest.mark.parametrize('num, den, max_val, expected', [
+    (60, 2, 100, (30, 1)),
+    (1000000000, 33366666, 30000, (30000, 1001)),
+    (1000000000, 41708333, 30000, (24000, 1001)),
+    (0, 1, 10, (0, 1))
+])
+def test_av_reduce(num: int, den: int, max_val: int, expected):
+    assert headerProbe.av_reduce(num, den, max_val) == expected
+
+
+def test_supports():
+    assert headerProbe.supports('.MP4')
+    assert headerProbe.supports('.webm')
+    assert not headerProbe.supports('.avi')
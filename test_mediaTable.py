@@ -0,0 +1,122 @@
+import math
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import encodingCommon as enc
+import mediaTable
+
+
+def make_table(dirs: int = 5, per_dir: int = 7) -> mediaTable.MediaTable:
+    rng = np.random.default_rng(1)
+    table = mediaTable.MediaTable()
+
+    for d in range(dirs):
+        dir_id = table.add_dir(f'd{d}')
+
+        for i in range(per_dir):
+            fps = float(rng.choice([0, 24, 30, 60]))
+            table.add(dir_id, Path(f'd{d}/f{i}.mp4'), int(rng.integers(1, 5000000)), fps, int(rng.integers(1, 900)), 1920, 1080)
+
+    return table
+
+
+def test_dir_counts_match_rows():
+    table = make_table()
+    (files, fps_over, btr_over) = table.dir_counts(30, 2)
+    fps = table.column('fps')
+    bitrate = table.bitrate()
+
+    for dir_id in range(len(table.dirs)):
+        rows = slice(dir_id * 7, dir_id * 7 + 7)
+        assert files[dir_id] == 7
+        assert fps_over[dir_id] == np.sum(fps[rows] > 30)
+        assert btr_over[dir_id] == np.sum(bitrate[rows] > 2)
+
+
+def test_range_counts_match_dir_counts():
+    table = make_table()
+    (files, fps_over, btr_over) = table.dir_counts(30, 2)
+
+    for dir_id in range(len(table.dirs)):
+        lo = dir_id * 7
+        assert table.range_counts(30, 2, lo, lo + 7) == (files[dir_id], fps_over[dir_id], btr_over[dir_id])
+
+
+def test_range_counts_to_the_end():
+    table = make_table()
+    assert table.range_counts(30, 2, 28) == table.range_counts(30, 2, 28, 35)
+
+
+# X.05 Mbit/s over 2 s: round() takes 1.05 and 8.05 up and 7.05 down, np.round took all three down
+@pytest.mark.parametrize('limit, size, over', [(1, 262500, True), (7, 1762500, False), (8, 2012500, True)])
+def test_bitrate_rounds_like_file_rows(limit: float, size: int, over: bool):
+    table = mediaTable.MediaTable()
+    dir_id = table.add_dir('d')
+    # 30 frames at 30 fps is planned as 2 s
+    table.add(dir_id, Path('a.mp4'), size, 30, 30, 1920, 1080)
+
+    row = round(size / 1000000 * 8 / 2, 1)
+
+    assert (row > limit) == over
+    assert table.bitrate()[0] == row
+    assert table.dir_counts(30, limit)[2][0] == over
+    assert table.range_counts(30, limit, 0)[2] == over
+
+
+def test_table_grows_past_initial_rows():
+    table = mediaTable.MediaTable()
+    dir_id = table.add_dir('d')
+
+    for i in range(mediaTable._initial_rows + 10):
+        table.add(dir_id, Path(f'{i}.mkv'), i, 30, 300, 1920, 1080)
+
+    assert table.rows == mediaTable._initial_rows + 10
+    assert table.column('size')[-1] == mediaTable._initial_rows + 9
+    assert table.exts == ['.mkv']
+
+
+def test_length_is_nan_without_fps():
+    table = mediaTable.MediaTable()
+    dir_id = table.add_dir('d')
+    table.add(dir_id, Path('a.mp4'), 100, 0, 0, 0, 0)
+    table.add(dir_id, Path('b.mp4'), 100, 30, 300, 1920, 1080)
+
+    length = table.length()
+
+    assert np.isnan(length[0])
+    assert length[1] == 11
+
+
+def test_histogram_by_ext():
+    table = mediaTable.MediaTable()
+    dir_id = table.add_dir('d')
+
+    for (name, fps) in [('a.mp4', 24), ('b.mp4', 60), ('c.mkv', 30), ('d.mkv', 0)]:
+        table.add(dir_id, Path(name), 100, fps, 300, 1920, 1080)
+
+    fps = np.where(table.column('fps') > 0, table.column('fps'), np.nan)
+
+    assert table.exts == ['.mp4', '.mkv']
+    assert table.histogram_by_ext(fps, [0, 25, 31, 1000]).tolist() == [[1, 0, 1], [0, 1, 0]]
+
+
+def test_percentiles_skip_nan():
+    assert mediaTable.percentiles(np.array([np.nan, 1.0, 3.0]), [0, 100]) == [1.0, 3.0]
+    assert mediaTable.percentiles(np.array([np.nan]), [50]) == [None]
+
+
+def test_encode_cost_matches_per_file_cost():
+    table = mediaTable.MediaTable()
+    dir_id = table.add_dir('d')
+    files = [(30, 300, 1920, 1080), (60, 600, 3840, 2160), (0, 0, 0, 0), (25, 250, 0, 0), (24, 2400, 1280, 720)]
+    expected = 0
+
+    for (i, (fps, frames, width, height)) in enumerate(files):
+        table.add(dir_id, Path(f'{i}.mp4'), 1, fps, frames, width, height)
+
+        if fps:
+            expected += enc.encode_cost(math.ceil(frames / fps) + 1, width, height, fps)
+
+    assert table.encode_cost() == pytest.approx(expected)
@@ -0,0 +1,156 @@
+import os
+import sys
+import time
+import types
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+import probeCommon as probe
+from test_headerProbe import mp4
+
+
+def test_cache_serves_unchanged_files(tmp_path: Path):
+    f = tmp_path / 'a.mp4'
+    f.write_bytes(b'x')
+    cache = probe.ProbeCache(tmp_path / 'probe.db')
+    cache.put(f, f.stat(), probe.ProbeResult(30, 300, 1920, 1080))
+
+    assert cache.get(f, f.stat()) == probe.ProbeResult(30, 300, 1920, 1080)
+
+    f.write_bytes(b'xy')
+
+    assert cache.get(f, f.stat()) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    cache.close()
+
+
+def test_cache_skips_failed_probes(tmp_path: Path):
+    f = tmp_path / 'a.mp4'
+    f.write_bytes(b'x')
+    cache = probe.ProbeCache(tmp_path / 'probe.db')
+    cache.put(f, f.stat(), probe.ProbeResult(0, 0, 0, 0))
+
+    assert cache.get(f, f.stat()) is None
+    cache.close()
+
+
+def test_cached_chain_never_loads_cv2(tmp_path: Path, monkeypatch):
+    f = tmp_path / 'a.mp4'
+    f.write_bytes(b'x')
+    # any import of cv2 now fails
+    monkeypatch.setitem(sys.modules, 'cv2', None)
+
+    with pytest.raises(probe.ProbeError):
+        probe.probe_path(str(f), probe.get_backends('cached'))
+
+    results = probe.probe_files([f], 2, backends=probe.get_backends('cached'))
+
+    assert isinstance(results[f], probe.ProbeError)
+
+
+def test_header_chain_falls_back_to_cv2(tmp_path: Path, monkeypatch):
+    readable = tmp_path / 'a.mp4'
+    readable.write_bytes(mp4())
+    unreadable = tmp_path / 'b.mp4'
+    unreadable.write_bytes(b'not a video')
+    opened = []
+
+    def fake_cv2_probe(path: str, *args) -> probe.ProbeResult:
+        opened.append(path)
+        return probe.ProbeResult(25, 250, 640, 480)
+
+    monkeypatch.setattr(probe, 'cv2_probe', fake_cv2_probe)
+    backends = probe.get_backends('header')
+
+    assert probe.probe_path(str(readable), backends) == probe.ProbeResult(30000 / 1001, 300, 1920, 1080)
+    assert opened == []
+    assert probe.probe_path(str(unreadable), backends) == probe.ProbeResult(25, 250, 640, 480)
+    assert opened == [str(unreadable)]
+
+
+class FakeCapture:
+    released = 0
+
+    def __init__(self, path: str):
+        time.sleep(0.02)
+
+    def release(self):
+        FakeCapture.released += 1
+
+
+def test_session_bounds_open_captures(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'cv2', types.SimpleNamespace(VideoCapture=FakeCapture))
+    FakeCapture.released = 0
+    session = probe.ProbeSession(2)
+
+    def capture(i: int):
+        with session.capture(f'{i}.mp4'):
+            time.sleep(0.02)
+
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(capture, range(16)))
+
+    assert session.peakOpen == 2
+    assert session.openCount == 0
+    assert FakeCapture.released == 16
+
+
+# holds a capture slot for a moment and reports how many slots were held at once, across all workers
+class SlotBackend(probe.ProbeBackend):
+    name = 'slot'
+
+    def __init__(self, marks: Path):
+        self.marks = marks
+
+    def probe(self, path: str) -> probe.ProbeResult:
+        with probe.get_session().slot():
+            mark = self.marks / uuid.uuid4().hex
+            mark.touch()
+            time.sleep(0.05)
+            held = len(os.listdir(self.marks))
+            mark.unlink()
+
+        return probe.ProbeResult(held, 0, 0, 0)
+
+
+def test_max_open_holds_across_workers(tmp_path: Path):
+    marks = tmp_path / 'marks'
+    marks.mkdir()
+    paths = [tmp_path / f'{i}.mp4' for i in range(24)]
+
+    for p in paths:
+        p.write_bytes(b'x')
+
+    results = probe.probe_files(paths, 4, backends=[SlotBackend(marks)], maxOpen=2)
+
+    assert all(isinstance(r, probe.ProbeResult) for r in results.values())
+    assert max(r.fps for r in results.values()) <= 2
+
+
+def test_probe_iter_stays_within_window(tmp_path: Path):
+    marks = tmp_path / 'marks'
+    marks.mkdir()
+    paths = [tmp_path / f'{i}.mp4' for i in range(40)]
+    handed_out = []
+
+    for p in paths:
+        p.write_bytes(b'x')
+
+    def source():
+        for p in paths:
+            handed_out.append(p)
+            yield p
+
+    results = probe.probe_iter(source(), 2, backends=[SlotBackend(marks)], window=4)
+    first = next(results)
+
+    assert first[0] == paths[0]
+    assert len(handed_out) <= 4
+
+    rest = list(results)
+
+    assert [p for (p, res) in rest] == paths[1:]
+    assert all(isinstance(res, probe.ProbeResult) for (p, res) in rest)
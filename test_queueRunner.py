@@ -0,0 +1,371 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+
+import queueRunner as runner
+
+
+def make_job(root: Path, name: str, spans: list = None, seconds: float = 60, cost: float = None) -> runner.FileJob:
+    source = root / f'{name}.mp4'
+    source.write_bytes(b'x' * 2048)
+    dest = root / '__..c'
+    segments = [runner.Segment(dest / f'{name}-{i}-nvenc.mp4', s, l, l if cost is None else cost) for (i, (s, l)) in enumerate(spans)] \
+        if spans else [runner.Segment(dest / f'{name}-nvenc.mp4', cost=seconds if cost is None else cost)]
+    return runner.FileJob(name, source, dest, dest / source.name, [], segments, seconds)
+
+
+def test_run_jobs_moves_finished_sources(tmp_path: Path):
+    jobs = [make_job(tmp_path, 'a'), make_job(tmp_path, 'b', [(0, 10), (20, 10)])]
+
+    stats = runner.run_jobs(jobs, 2, runner.StubEncoder(0))
+
+    assert (stats.files, stats.moved, stats.segments, stats.failed) == (2, 2, 3, [])
+    assert all(j.moveTo.exists() and not j.source.exists() for j in jobs)
+    assert all(s.output.exists() for j in jobs for s in j.segments)
+
+
+def test_run_jobs_keeps_failed_sources(tmp_path: Path):
+    jobs = [make_job(tmp_path, 'bad', [(0, 10), (20, 10)]), make_job(tmp_path, 'good')]
+
+    stats = runner.run_jobs(jobs, 1, runner.StubEncoder(0, failOn='bad'))
+
+    assert stats.moved == 1
+    assert stats.failed == [str(jobs[0].source)]
+    assert jobs[0].source.exists()
+    assert jobs[1].moveTo.exists()
+
+
+def test_run_jobs_cleans_leftover_outputs(tmp_path: Path):
+    job = make_job(tmp_path, 'a')
+    job.destFolder.mkdir()
+    job.segments[0].output.write_bytes(b'partial')
+
+    stats = runner.run_jobs([job], 1, runner.StubEncoder(0))
+
+    assert stats.cleaned == 1
+    assert job.segments[0].output.stat().st_size == 1024
+
+
+def test_journal_round_trip(tmp_path: Path):
+    job = make_job(tmp_path, 'a', [(0, 10), (20, 10)])
+    (first, second) = job.segments
+    job.destFolder.mkdir()
+    first.output.write_bytes(b'x' * 10)
+    second.output.write_bytes(b'x' * 10)
+
+    journal = runner.Journal(tmp_path / runner.journal_name)
+    journal.record(job.source, first, 0, 10)
+    journal.record(job.source, second, 1, 10)
+
+    journal = runner.Journal(tmp_path / runner.journal_name)
+
+    assert journal.done(job.source, first)
+    assert not journal.done(job.source, second)
+
+    # an output that changed since it was journaled was cut short or replaced
+    first.output.write_bytes(b'x' * 5)
+
+    assert not journal.done(job.source, first)
+
+
+def test_journal_last_line_wins(tmp_path: Path):
+    job = make_job(tmp_path, 'a')
+    seg = job.segments[0]
+    job.destFolder.mkdir()
+    seg.output.write_bytes(b'x' * 10)
+
+    journal = runner.Journal(tmp_path / runner.journal_name)
+    journal.record(job.source, seg, 1, 0)
+    journal.record(job.source, seg, 0, 10)
+
+    assert runner.Journal(tmp_path / runner.journal_name).done(job.source, seg)
+
+
+def test_journal_compact(tmp_path: Path):
+    kept = make_job(tmp_path, 'kept')
+    moved = make_job(tmp_path, 'moved')
+    failed = make_job(tmp_path, 'failed')
+    path = tmp_path / runner.journal_name
+    journal = runner.Journal(path)
+
+    for (job, status) in [(kept, 0), (moved, 0), (failed, 1)]:
+        journal.record(job.source, job.segments[0], status, 0)
+
+    moved.source.unlink()
+    journal.compact()
+
+    lines = path.read_text().splitlines()
+
+    assert len(lines) == 1
+    assert str(kept.source) in lines[0]
+
+
+def test_journal_function_writes_what_journal_reads(tmp_path: Path):
+    job = make_job(tmp_path, 'a b$c', [(5, 10)])
+    seg = job.segments[0]
+    job.destFolder.mkdir()
+    seg.output.write_bytes(b'x' * 42)
+    path = tmp_path / runner.journal_name
+    args = [job.source, seg.output, runner.span_str(seg.start), runner.span_str(seg.length), seg.output]
+    script = runner.journal_function(runner.shell_arg(str(path))) + 'journal ' + ' '.join(runner.shell_arg(str(a)) for a in args) + '\n'
+
+    subprocess.run(['bash', '-c', script], check=True)
+
+    assert runner.Journal(path).done(job.source, seg)
+
+
+def test_run_jobs_journals_segments(tmp_path: Path):
+    jobs = [make_job(tmp_path, 'a', [(0, 10), (20, 10)]), make_job(tmp_path, 'bad')]
+    journal = runner.Journal(tmp_path / runner.journal_name)
+
+    runner.run_jobs(jobs, 2, runner.StubEncoder(0, failOn='bad'), journal)
+
+    assert all(journal.done(jobs[0].source, s) for s in jobs[0].segments)
+    assert not journal.done(jobs[1].source, jobs[1].segments[0])
+
+
+def test_run_jobs_moves_fully_journaled_files(tmp_path: Path):
+    job = make_job(tmp_path, 'a')
+    job.segments = []
+    job.done = 1
+
+    stats = runner.run_jobs([job], 1, runner.StubEncoder(0))
+
+    assert stats.moved == 1
+    assert job.moveTo.exists()
+
+
+def test_shard_jobs_balances_cost(tmp_path: Path):
+    costs = [50, 10, 40, 30, 20, 20, 10, 5]
+    jobs = [make_job(tmp_path, f'j{i}', cost=c) for (i, c) in enumerate(costs)]
+
+    shards = runner.shard_jobs(jobs, 3)
+    loads = [sum(j.cost for j in shard) for shard in shards]
+
+    assert sorted(j.title for shard in shards for j in shard) == sorted(j.title for j in jobs)
+    assert max(loads) - min(loads) <= max(costs)
+    assert max(loads) <= sum(costs) / 3 + max(costs)
+
+
+def test_shard_jobs_keeps_queue_order(tmp_path: Path):
+    jobs = [make_job(tmp_path, f'j{i}', cost=c) for (i, c) in enumerate([5, 50, 10, 40, 30, 20])]
+
+    for shard in runner.shard_jobs(jobs, 2):
+        assert shard == sorted(shard, key=jobs.index)
+
+
+def test_shard_jobs_more_shards_than_jobs(tmp_path: Path):
+    jobs = [make_job(tmp_path, 'a'), make_job(tmp_path, 'b')]
+    shards = runner.shard_jobs(jobs, 4)
+
+    assert len(shards) == 4
+    assert sorted(len(s) for s in shards) == [0, 0, 1, 1]
+
+
+def test_simulate(tmp_path: Path):
+    jobs = [make_job(tmp_path, 'a', cost=30), make_job(tmp_path, 'b', cost=10), make_job(tmp_path, 'c', cost=20)]
+
+    assert runner.simulate(jobs, 1) == (60, (30 + 40 + 60) / 3)
+    assert runner.simulate(jobs, 2) == (30, (30 + 10 + 30) / 3)
+    assert runner.simulate([], 2) == (0, 0)
+
+
+def test_simulate_spreads_segments(tmp_path: Path):
+    job = make_job(tmp_path, 'a', [(0, 10), (10, 10), (20, 10)])
+
+    assert runner.simulate([job], 3) == (10, 10)
+
+
+def test_policies_are_stable(tmp_path: Path):
+    jobs = [make_job(tmp_path, f'j{i}', cost=c) for (i, c) in enumerate([20, 10, 20, 5])]
+
+    assert [j.title for j in runner.policies['shortest'](jobs)] == ['j3', 'j1', 'j0', 'j2']
+    assert [j.title for j in runner.policies['longest'](jobs)] == ['j0', 'j2', 'j1', 'j3']
+    assert runner.policies['directory'](jobs) == jobs
+
+
+def test_shortest_first_finishes_files_sooner(tmp_path: Path):
+    jobs = [make_job(tmp_path, f'j{i}', cost=c) for (i, c) in enumerate([40, 5, 30, 10, 20])]
+
+    (_, mean_directory) = runner.simulate(runner.policies['directory'](jobs), 2)
+    (_, mean_shortest) = runner.simulate(runner.policies['shortest'](jobs), 2)
+
+    assert mean_shortest < mean_directory
+
+
+def test_split_segment_covers_the_span(tmp_path: Path):
+    job = make_job(tmp_path, 'a', [(100, 1000)])
+    seg = job.segments[0]
+
+    chunks = runner.split_segment(job, seg, 300)
+
+    assert [(c.start, c.length) for c in chunks] == [(100, 300), (400, 300), (700, 300), (1000, 100)]
+    assert sum(c.cost for c in chunks) == pytest.approx(seg.cost)
+    assert all(c.output.parent == seg.output.parent and c.output.name.startswith('.') for c in chunks)
+
+
+def test_split_segment_whole_file(tmp_path: Path):
+    job = make_job(tmp_path, 'a', seconds=650)
+
+    chunks = runner.split_segment(job, job.segments[0], 300)
+
+    assert [(c.start, c.length) for c in chunks] == [(0, 300), (300, 300), (600, 50)]
+
+
+def test_split_segment_leaves_short_segments(tmp_path: Path):
+    job = make_job(tmp_path, 'a', [(0, 450)])
+
+    assert runner.split_segment(job, job.segments[0], 300) == []
+    assert runner.split_segment(job, job.segments[0], 0) == []
+
+
+def test_run_jobs_joins_chunks(tmp_path: Path):
+    job = make_job(tmp_path, 'a', [(0, 1000)])
+
+    stats = runner.run_jobs([job], 3, runner.StubEncoder(0), chunk_len=300, duration=lambda p: 1000)
+
+    assert (stats.segments, stats.moved, stats.failed) == (1, 1, [])
+    assert job.segments[0].output.stat().st_size == 4 * 1024
+    assert sorted(p.name for p in job.destFolder.iterdir()) == sorted([job.segments[0].output.name, job.source.name])
+
+
+def test_run_jobs_rejects_short_joins(tmp_path: Path):
+    job = make_job(tmp_path, 'a', [(0, 1000)])
+
+    stats = runner.run_jobs([job], 2, runner.StubEncoder(0), chunk_len=300, duration=lambda p: 900)
+
+    assert stats.moved == 0
+    assert not job.segments[0].output.exists()
+    assert job.source.exists()
+    assert not [p for p in job.destFolder.iterdir() if '.part' in p.name]
+
+
+# encodes every chunk but the one starting at 300 s
+class ChunkFailEncoder(runner.StubEncoder):
+    def encode(self, job: runner.FileJob, segment: runner.Segment, progress) -> int:
+        return 1 if segment.start == 300 else super().encode(job, segment, progress)
+
+
+def test_run_jobs_removes_parts_of_failed_chunks(tmp_path: Path):
+    job = make_job(tmp_path, 'a', [(0, 1000)])
+
+    stats = runner.run_jobs([job], 2, ChunkFailEncoder(0), chunk_len=300, duration=lambda p: 1000)
+
+    assert (stats.segments, stats.moved) == (0, 0)
+    assert job.source.exists()
+    assert list(job.destFolder.iterdir()) == []
+
+
+# records which source each encode read and how much was staged at the time
+class RecordingEncoder(runner.StubEncoder):
+    def __init__(self, stager: runner.Stager, speed: float = 0):
+        super().__init__(speed)
+        self.stager = stager
+        self.sources = []
+        self.peak = 0
+
+    def encode(self, job: runner.FileJob, segment: runner.Segment, progress) -> int:
+        self.sources.append(job.source)
+        self.peak = max(self.peak, self.stager.used)
+        return super().encode(job, segment, progress)
+
+
+def test_stager_encodes_local_copies(tmp_path: Path):
+    share = tmp_path / 'share'
+    share.mkdir()
+    jobs = [make_job(share, f'j{i}', [(0, 10), (10, 10)]) for i in range(4)]
+    stager = runner.Stager(tmp_path / 'scratch', 10 * 2048)
+    # slow enough for the copies to get ahead of the encodes
+    encoder = RecordingEncoder(stager, 0.3)
+
+    stats = runner.run_jobs(jobs, 1, encoder, stager=stager)
+
+    assert (stats.moved, stats.failed) == (4, [])
+    assert all(s.output.exists() for j in jobs for s in j.segments)
+    assert stager.staged >= 3
+    assert all(share not in p.parents for p in encoder.sources[2:])
+    assert not (tmp_path / 'scratch').exists()
+
+
+def test_stager_stays_within_budget(tmp_path: Path):
+    share = tmp_path / 'share'
+    share.mkdir()
+    jobs = [make_job(share, f'j{i}') for i in range(6)]
+    stager = runner.Stager(tmp_path / 'scratch', 2 * 2048)
+    encoder = RecordingEncoder(stager)
+
+    stats = runner.run_jobs(jobs, 2, encoder, stager=stager)
+
+    assert stats.moved == 6
+    assert encoder.peak <= 2 * 2048
+
+
+def test_stager_skips_sources_over_budget(tmp_path: Path):
+    job = make_job(tmp_path, 'a')
+    stager = runner.Stager(tmp_path / 'scratch', 1024)
+
+    stats = runner.run_jobs([job], 1, runner.StubEncoder(0), stager=stager)
+
+    assert stats.moved == 1
+    assert stager.staged == 0
+
+
+def test_atomic_file_replaces_on_commit(tmp_path: Path):
+    target = tmp_path / 'queue.sh'
+    target.write_text('old')
+    target.chmod(0o755)
+
+    with runner.AtomicFile(target) as f:
+        f.write('new')
+        assert target.read_text() == 'old'
+
+    assert target.read_text() == 'new'
+    assert target.stat().st_mode & 0o777 == 0o755
+    assert not runner.temp_path(target).exists()
+
+
+def test_atomic_file_discards_on_error(tmp_path: Path):
+    target = tmp_path / 'queue.sh'
+    target.write_text('old')
+
+    with pytest.raises(KeyError):
+        with runner.AtomicFile(target) as f:
+            f.write('half')
+            raise KeyError()
+
+    assert target.read_text() == 'old'
+    assert not runner.temp_path(target).exists()
+
+
+@pytest.mark.parametrize('name, own', [
+    ('queue.sh', True), ('queue.bat', True), ('queue-3.sh', True), ('.queue-3.sh.tmp', True), ('.queue.bat.tmp', True),
+    (runner.journal_name, True), (runner.temp_path(Path(runner.journal_name)).name, True),
+    ('queue.mp4', False), ('myqueue.sh', False), ('.a.mp4.tmp', False)
+])
+def test_own_file(name: str, own: bool):
+    assert runner.own_file(name) == own
+
+
+@pytest.mark.parametrize('value', [
+    "scale='min(1920,iw)':'min(1080,ih)':force_original_aspect_ratio=decrease:force_divisible_by=2",
+    'H.265 NVENC 1080p',
+    'a "quoted" $HOME `id` back\\slash',
+    '*.mkv; rm -rf x & y | z',
+    '--pfr'
+])
+def test_shell_arg_survives_bash(value: str):
+    out = subprocess.run(['bash', '-c', f'printf "%s" {runner.shell_arg(value)}'], capture_output=True, text=True, check=True).stdout
+    assert out == value
+
+
+def test_shell_arg_leaves_plain_options_bare():
+    assert runner.shell_arg('-q') == '-q'
+    assert runner.shell_arg('24.0') == '24.0'
+    assert runner.shell_arg('hevc_nvenc') == 'hevc_nvenc'
+
+
+def test_shell_arg_quotes_filters():
+    assert runner.shell_arg("scale='min(1920,iw)'") == '"scale=\'min(1920,iw)\'"'
+    assert runner.shell_arg("scale='min(1920,iw)'", True) == '"scale=\'min(1920,iw)\'"'
+    assert runner.shell_arg('100%', True) == '"100%%"'
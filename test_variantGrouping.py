@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+import benchmarks
+import encodingCommon as enc
+import variantGrouping as grouping
+
+# a source, its encodes, titles sharing a prefix with it, encodes with equal sort keys and plain files around them
+_adversarial = [
+    ['a~0_00-0_30 [q28].mp4', 'a-nvenc-cq28.mp4', 'ab-nvenc-cq28.mp4', 'ab~0_00-0_30 [q28].mp4'],
+    ['a-0-nvenc-cq28.mp4', 'ab-nvenc-cq30.mp4', 'a-1-nvenc-cq28.mp4', 'a~0_00-0_30 0_40-0_50.mp4'],
+    ['x~1_00-2_00.mp4', 'y~1_00-2_00.mp4', 'z~1_00-2_00.mp4'],
+    ['plain.mp4', 'plain2.mkv', 'other.mov'],
+    ['b~0_00-0_10.mp4', 'b-nvenc-cq28.mp4', 'b.mp4', 'bc.mp4', 'c-nvenc-cq28.mp4'],
+    ['c-nvenc-cq28.mp4', 'c-nvenc-cq32.mp4', 'c-0-nvenc-cq30.mp4', 'c~0_00-0_10.mp4', 'c~0_00-0_20.mp4'],
+    ['a-01-nvenc-cq28.mp4', 'a-1-nvenc-cq28.mp4', 'a-001-nvenc-cq28.mp4', 'a~0_00-0_30.mp4'],
+    [],
+]
+
+
+@pytest.mark.parametrize('stem, keys', [
+    ('clip~0_00-0_30 [q28]', ('clip', None)),
+    ('clip-nvenc-cq28', (None, 'clip')),
+    ('clip-0-nvenc-cq28', (None, 'clip-0')),
+    ('clip', (None, 'clip')),
+])
+def test_group_keys(stem, keys):
+    assert grouping.group_keys(stem) == keys
+
+
+def grouped(grouper, names):
+    return benchmarks.group_result(grouper(benchmarks.group_rows(names), benchmarks.sort_rows))
+
+
+@pytest.mark.parametrize('names', _adversarial + [sum(_adversarial, [])])
+@pytest.mark.parametrize('order', ['listed', 'sorted', 'reversed', 'shuffled'])
+def test_group_variants_matches_reference(names, order):
+    names = list(names)
+
+    if order == 'sorted':
+        names.sort(key=lambda n: enc.dblcmd_file_sort_keys(n, None, True))
+    elif order == 'reversed':
+        names.reverse()
+    elif order == 'shuffled':
+        random.Random(len(names)).shuffle(names)
+
+    assert grouped(grouping.group_variants, names) == grouped(benchmarks.group_variants_reference, names)
+
+
+def test_group_variants_takes_encodes_back_to_the_first_other_file():
+    names = ['a-nvenc-cq28.mp4', 'z.mp4', 'a-1-nvenc-cq30.mp4', 'a-0-nvenc-cq30.mp4', 'a~0_00-0_30.mp4', 'b.mp4']
+
+    assert grouped(grouping.group_variants, names) == [
+        ('', [('a-nvenc-cq28.mp4', None), ('z.mp4', None)]),
+        ('a', [('a-0-nvenc-cq30.mp4', 'a'), ('a-1-nvenc-cq30.mp4', 'a'), ('a~0_00-0_30.mp4', 'a')]),
+        ('', [('b.mp4', None)]),
+    ]
+
+
+def test_group_bench_matches_reference():
+    assert [r['same output'] for r in benchmarks.group_bench(500, 1)] == ['yes'] * 2
@@ -0,0 +1,71 @@
+import re
+
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+# Groups a folder's files with their `~options` source and -nvenc encodes for the list modes. Rows are dicts with
+# the keys group_keys gives them as `_grp_enc` and `_grp_res`.
+
+_rx_enc_settings_strip = re.compile(r'~.+')
+_rx_enc_res_strip = re.compile(r'-nvenc-.+')
+
+
+# a `~options` source is grouped under its base name, an encode or any other file under its name without
+# the -nvenc suffix
+def group_keys(stem: str) -> Tuple[Union[str, None], Union[str, None]]:
+    if _rx_enc_settings_strip.search(stem):
+        return _rx_enc_settings_strip.sub('', stem), None
+    elif _rx_enc_res_strip.search(stem):
+        return None, _rx_enc_res_strip.sub('', stem)
+    else:
+        return None, stem
+
+
+# Groups a folder's listed rows, in listing order, into (name, rows). A source with `~options` starts a group named
+# after its base name and takes along the unnamed rows right before it whose names start with it, those are the
+# encodes that sort ahead of their source. Other rows join the previous group when it's unnamed or they share its
+# name, otherwise they start a new unnamed one. Each row is placed once and only a source looks back, over the tail
+# of the unnamed run it ends, so the whole folder is a single pass with the same result as the incremental grouping
+# it replaced, benchmarks.group_variants_reference. `sort_rows` puts rows taken along back in listing order.
+def group_variants(rows: List[Dict[str, Any]], sort_rows: Callable[[List[Dict[str, Any]]], None]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    groups: List[Tuple[str, List[Dict[str, Any]]]] = []
+
+    for datum in rows:
+        enc_name = datum['_grp_enc']
+
+        if not groups:
+            groups.append((enc_name or '', [datum]))
+            continue
+
+        (name, members) = groups[-1]
+
+        if enc_name:
+            taken = []
+
+            if not name:
+                i = len(members)
+
+                while i and members[i - 1]['_grp_res'] and members[i - 1]['_grp_res'].startswith(enc_name):
+                    i -= 1
+
+                taken = members[i:]
+                del members[i:]
+                # the reference collects them last first before sorting, which matters for equal sort keys
+                taken.reverse()
+
+                for dt in taken:
+                    dt['_grp_enc'] = enc_name
+
+                if len(taken) > 1:
+                    sort_rows(taken)
+
+                if not members:
+                    groups.pop()
+
+            taken.append(datum)
+            groups.append((enc_name, taken))
+        elif not name or datum['_grp_res'].startswith(name):
+            members.append(datum)
+        else:
+            groups.append(('', [datum]))
+
+    return groups